@@ -0,0 +1,276 @@
+"""Bulk backfill of searches for a list of food terms.
+
+Each term is searched like /search does (Twingly, then food terms in the post
+titles), without Flask. Worker threads do the API calls; one writer thread
+stores finished searches in batches, one transaction per batch. A term is
+appended to the checkpoint file once its batch is committed, so a run that
+crashes or is interrupted skips those terms when started again:
+
+    python backfill.py terms.txt --workers 8 --checkpoint nightly.ckpt \\
+        --spoonacular-rate 20 --twingly-rate 2
+
+The terms file has one food term per line; blank lines and lines starting
+with "#" are ignored. Rate limits are calls per second to each API, shared
+by all workers. Progress goes to stdout every --report-every seconds.
+"""
+
+import argparse
+import json
+import os
+import queue
+import signal
+import threading
+import time
+import traceback
+
+import calls
+from http_pool import RateLimiter
+
+
+def read_terms(path):
+    """Read food terms from path, lowercased and without duplicates."""
+    terms = []
+    seen = set()
+    with open(path) as f:
+        for line in f:
+            term = line.strip().lower()
+            if term and not term.startswith("#") and term not in seen:
+                seen.add(term)
+                terms.append(term)
+    return terms
+
+
+class Checkpoint():
+    """Append-only record of the terms a backfill has finished."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        self._lock = threading.Lock()
+
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)["term"])
+                    except (ValueError, KeyError):
+                        # a line cut short by a crash
+                        continue
+
+    def record(self, entries):
+        """Record (term, search id) pairs as done."""
+        with self._lock:
+            for term, search_id in entries:
+                self.done.add(term)
+
+            if not self.path:
+                return
+            with open(self.path, "a") as f:
+                for term, search_id in entries:
+                    f.write(json.dumps({"term": term,
+                                        "search_id": search_id}) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class Backfill():
+    """Search many food terms with worker threads and a batching writer."""
+
+    def __init__(self, terms, checkpoint, search_window=calls.SEARCH_WINDOW,
+                        num_workers=4, batch_size=20, flush_interval=5.0,
+                        force_refresh=False, report_every=10.0):
+        self.terms = [term for term in terms if term not in checkpoint.done]
+        self.checkpoint = checkpoint
+        self.search_window = search_window
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.force_refresh = force_refresh
+        self.report_every = report_every
+
+        self.stopping = threading.Event()
+        self._todo = queue.Queue()
+        self._processed = queue.Queue()
+        self._lock = threading.Lock()
+        self.stats = {"total": len(self.terms), "stored": 0, "reused": 0,
+                      "failed": 0, "posts": 0, "batches": 0}
+
+    def run(self):
+        """Search every term not yet checkpointed; return the stats."""
+        for term in self.terms:
+            self._todo.put(term)
+
+        workers = [threading.Thread(target=self._work,
+                                    name="backfill-worker-{}".format(i))
+                   for i in range(self.num_workers)]
+        writer = threading.Thread(target=self._write, name="backfill-writer")
+        self._start = time.perf_counter()
+        results_before = calls.db.result_counts()
+
+        for worker in workers:
+            worker.start()
+        writer.start()
+
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(self.report_every)
+                if worker.is_alive():
+                    self.report()
+                    break
+
+        # tell the writer no more searches are coming
+        self._processed.put(None)
+        writer.join()
+        self.report()
+
+        results = calls.db.result_counts()
+        inserted = results["inserted"] - results_before["inserted"]
+        offered = sum(results.values()) - sum(results_before.values())
+        return dict(self.stats, results_inserted=inserted,
+                    results_skipped=offered - inserted,
+                    elapsed_s=round(time.perf_counter() - self._start, 3))
+
+    def _count(self, **amounts):
+        with self._lock:
+            for key, amount in amounts.items():
+                self.stats[key] += amount
+
+    def _work(self):
+        while not self.stopping.is_set():
+            try:
+                term = self._todo.get_nowait()
+            except queue.Empty:
+                return
+
+            try:
+                self._search(term)
+            except Exception:
+                traceback.print_exc()
+                print("Could not search {!r}; it will be retried on the "
+                      "next run.".format(term))
+                self._count(failed=1)
+
+    def _search(self, term):
+        if not self.force_refresh:
+            search_id = calls.db.fresh_search_id(term, self.search_window,
+                                                 calls.SEARCH_TTL)
+            if search_id is not None:
+                self.checkpoint.record([(term, search_id)])
+                self._count(reused=1)
+                return
+
+        pages = calls.fetch_result_pages(term, self.search_window)
+        other_terms_dict, num_matches_total, result_rows = \
+                            calls.process_blog_results(pages, term)
+        self._count(posts=len(result_rows))
+        self._processed.put((term, num_matches_total, result_rows,
+                             other_terms_dict, self.search_window))
+
+    def _write(self):
+        finished = False
+        while not finished:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._processed.get(
+                            timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    finished = True
+                    break
+                batch.append(item)
+
+            if batch:
+                self._store(batch)
+
+    def _store(self, batch):
+        try:
+            search_ids = calls.store_searches(batch)
+        except Exception:
+            traceback.print_exc()
+            if len(batch) > 1:
+                # find the search that cannot be stored; keep the rest
+                for item in batch:
+                    self._store([item])
+            else:
+                print("Could not store {!r}; it will be retried on the "
+                      "next run.".format(batch[0][0]))
+                self._count(failed=1)
+            return
+
+        self.checkpoint.record([(item[0], search_id)
+                                for item, search_id in zip(batch, search_ids)])
+        self._count(stored=len(batch), batches=1)
+
+    def report(self):
+        """Print progress and throughput so far."""
+        elapsed = time.perf_counter() - self._start
+        with self._lock:
+            stats = dict(self.stats)
+
+        finished = stats["stored"] + stats["reused"] + stats["failed"]
+        rate = finished / elapsed if elapsed else 0
+        eta = (stats["total"] - finished) / rate if rate else None
+
+        print("[{:>{width}}/{}] {} stored, {} reused, {} failed | "
+              "{:.2f} terms/s, {:.1f} posts/s, {} batches | ETA {}".format(
+                    finished, stats["total"], stats["stored"],
+                    stats["reused"], stats["failed"], rate,
+                    stats["posts"] / elapsed if elapsed else 0,
+                    stats["batches"],
+                    "{:.0f}s".format(eta) if eta is not None else "-",
+                    width=len(str(stats["total"]))), flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+                            description=__doc__.splitlines()[0])
+    parser.add_argument("terms", help="file of food terms, one per line")
+    parser.add_argument("--checkpoint",
+                        help="file recording finished terms (default: "
+                             "<terms>.ckpt)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=20,
+                        help="searches written per transaction")
+    parser.add_argument("--flush-interval", type=float, default=5.0,
+                        help="most seconds a finished search waits to be "
+                             "written")
+    parser.add_argument("--window", default=calls.SEARCH_WINDOW)
+    parser.add_argument("--refresh", action="store_true",
+                        help="search again even if a fresh search is stored")
+    parser.add_argument("--spoonacular-rate", type=float,
+                        default=calls.SPOONACULAR_RATE,
+                        help="most Spoonacular calls per second (0 = no "
+                             "limit)")
+    parser.add_argument("--twingly-rate", type=float,
+                        default=calls.TWINGLY_RATE,
+                        help="most Twingly calls per second (0 = no limit)")
+    parser.add_argument("--report-every", type=float, default=10.0,
+                        help="seconds between progress lines")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    """Backfill the terms in the given file."""
+    args = parse_args()
+    calls.spoonacular_limit = RateLimiter(args.spoonacular_rate)
+    calls.twingly_limit = RateLimiter(args.twingly_rate)
+
+    backfill = Backfill(read_terms(args.terms),
+                        Checkpoint(args.checkpoint or args.terms + ".ckpt"),
+                        search_window=args.window,
+                        num_workers=args.workers,
+                        batch_size=args.batch_size,
+                        flush_interval=args.flush_interval,
+                        force_refresh=args.refresh,
+                        report_every=args.report_every)
+
+    # finish the searches in progress and write them before exiting
+    signal.signal(signal.SIGTERM, lambda signum, frame: backfill.stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: backfill.stopping.set())
+
+    print("Backfilling {} terms ({} already done).".format(
+                    len(backfill.terms), len(backfill.checkpoint.done)))
+    print(json.dumps(backfill.run(), indent=2))
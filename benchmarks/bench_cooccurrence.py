@@ -0,0 +1,83 @@
+"""Benchmark building the pairing co-occurrence graph and top-k queries.
+
+Pairings are generated with Zipf-like term popularity, like real food terms
+(a few very common, many rare), or loaded from the pairings table with
+--db. Prints JSON with build time and top-k latency percentiles per score.
+
+Run from the project root:
+    python benchmarks/bench_cooccurrence.py --rows 1000000 --terms 20000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cooccurrence import PairingGraph, SCORES
+
+
+def make_pairings(num_rows, num_terms, seed=0):
+    """Make (food_id1, food_id2, occurences) rows."""
+    rand = random.Random(seed)
+    weights = [1 / rank for rank in range(1, num_terms + 1)]
+    term_ids = list(range(1, num_terms + 1))
+    firsts = rand.choices(term_ids, weights, k=num_rows)
+    seconds = rand.choices(term_ids, weights, k=num_rows)
+    return [(first, second, rand.randint(1, 5))
+            for first, second in zip(firsts, seconds)]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10 ** 6)
+    parser.add_argument("--terms", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--db", help="load pairings from this database")
+    args = parser.parse_args()
+
+    graph = PairingGraph()
+    start = time.perf_counter()
+    if args.db:
+        from connector import DBConnector
+        graph.rebuild(DBConnector(args.db))
+    else:
+        graph.add_pairings(make_pairings(args.rows, args.terms))
+    build_time = time.perf_counter() - start
+
+    # queried terms follow the same popularity as the data
+    rand = random.Random(1)
+    term_ids = sorted(graph._counts, key=graph._counts.get, reverse=True)
+    weights = [1 / rank for rank in range(1, len(term_ids) + 1)]
+    queries = rand.choices(term_ids, weights, k=args.queries)
+
+    latency = {}
+    for score in SCORES:
+        times = []
+        for term_id in queries:
+            query_start = time.perf_counter()
+            graph.top_partners(term_id, args.k, score)
+            times.append((time.perf_counter() - query_start) * 1000)
+        times.sort()
+        latency[score] = {"p50_ms": round(percentile(times, 0.5), 4),
+                          "p99_ms": round(percentile(times, 0.99), 4),
+                          "max_ms": round(times[-1], 4)}
+
+    print(json.dumps({"rows": args.rows if not args.db else None,
+                      "terms": graph.num_terms,
+                      "pairs": graph.num_pairs,
+                      "build_s": round(build_time, 3),
+                      "top_k": latency}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+"""Benchmark storing the results of searches whose posts repeat earlier ones.
+
+Each of NUM_SEARCHES searches has 20 posts; a REPEAT fraction of them were
+already stored by one of the last few hundred searches, as when a term is
+searched again within its window. Three ways of storing them are timed on
+an emptied results table:
+
+    per_post        a SELECT on the URL per post, then an INSERT per new one
+                    (what DBConnector.new_results_record meant to do)
+    batched         DBConnector.insert_results without its URL filter: one
+                    INSERT ... ON CONFLICT DO NOTHING per search
+    batched_filter  the same, with repeats dropped by the URL filter first
+
+Prints JSON with the time and statements per search, the rows stored, and
+the posts inserted and skipped as DBConnector.result_counts reports them.
+
+Run from the project root (the results table in BENCH_DB_PATH is emptied):
+    BENCH_DB_PATH=postgresql:///food_trends_bench \\
+        python benchmarks/bench_dedup.py
+"""
+
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy.sql import select
+
+import migrations
+from cache import URLFilter
+from connector import DBConnector
+
+
+BENCH_DB_PATH = os.environ.get("BENCH_DB_PATH",
+                               "postgresql:///food_trends_bench")
+NUM_SEARCHES = int(os.environ.get("NUM_SEARCHES", 500))
+REPEAT = float(os.environ.get("REPEAT", 0.6))
+POSTS = 20
+
+
+class NoFilter():
+    """Stands in for the URL filter: has seen nothing."""
+
+    def __contains__(self, url):
+        return False
+
+    def update(self, urls):
+        pass
+
+
+def make_searches(seed=0):
+    """Make the post URLs of each search."""
+    rand = random.Random(seed)
+    stored = []
+    searches = []
+    for i in range(NUM_SEARCHES):
+        recent = stored[-200 * POSTS:]
+        urls = set()
+        while len(urls) < POSTS:
+            if recent and rand.random() < REPEAT:
+                urls.add(rand.choice(recent))
+            else:
+                url = "http://blog{}.example/post/{}".format(
+                                            rand.randint(1, 999), len(stored))
+                stored.append(url)
+                urls.add(url)
+        searches.append(sorted(urls))
+    return searches
+
+
+def per_post(db, urls, search_id):
+    """Store posts as new_results_record meant to: check, then insert."""
+    results = db.meta.tables["results"]
+    for url in urls:
+        if db.execute(select([results.c.id]).where(
+                                results.c.url == url)).fetchone() is None:
+            db.execute(results.insert().values(
+                                publish_date=datetime(2018, 3, 1),
+                                index_date=datetime(2018, 3, 1),
+                                url=url, search_id=search_id))
+
+
+def batched(db, urls, search_id):
+    db.insert_results([(datetime(2018, 3, 1), datetime(2018, 3, 1), url)
+                       for url in urls], search_id)
+
+
+def main():
+    db = DBConnector(BENCH_DB_PATH)
+    migrations.migrate(db.engine)
+    search_id = db.ingest_search("carrot", 10, 0, [], {})
+    searches = make_searches()
+
+    report = {"searches": NUM_SEARCHES, "posts_per_search": POSTS,
+              "repeat": REPEAT}
+    for name, store, url_filter in (("per_post", per_post, None),
+                                    ("batched", batched, NoFilter()),
+                                    ("batched_filter", batched, None)):
+        db.execute("TRUNCATE results")
+        db.vacuum("results")
+        db.url_filter = url_filter or URLFilter()
+        counts_before = db.result_counts()
+        queries_before = db.query_count
+
+        start = time.perf_counter()
+        for urls in searches:
+            store(db, urls, search_id)
+        elapsed = time.perf_counter() - start
+
+        counts = db.result_counts()
+        report[name] = {
+            "ms_per_search": round(elapsed / NUM_SEARCHES * 1000, 3),
+            "statements_per_search": round((db.query_count - queries_before) /
+                                           NUM_SEARCHES, 2),
+            "rows": db.execute("SELECT count(*) FROM results").fetchone()[0],
+            "counts": None if store is per_post else
+                      {key: counts[key] - counts_before[key] for key in counts}}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
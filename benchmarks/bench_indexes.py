@@ -0,0 +1,101 @@
+"""Benchmark hot lookups before and after migrations.py adds its indexes.
+
+Seeds a scratch database with NUM_ROWS pairings and results records (plus
+NUM_ROWS / 10 searches) and times the lookups the app makes, first without
+secondary indexes and then after running the migration.
+
+ALL TABLES IN BENCH_DB_PATH ARE DROPPED. Run from the project root:
+    BENCH_DB_PATH=postgresql:///food_trends_bench NUM_ROWS=1000000 \
+        python benchmarks/bench_indexes.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy.sql import select
+
+import create_tables
+import migrations
+from connector import DBConnector
+
+
+BENCH_DB_PATH = os.environ.get("BENCH_DB_PATH",
+                               "postgresql:///food_trends_bench")
+NUM_ROWS = int(os.environ.get("NUM_ROWS", 100000))
+NUM_CALLS = int(os.environ.get("NUM_CALLS", 200))
+NUM_TERMS = 5000
+
+
+def seed(db):
+    """Recreate the tables without secondary indexes and fill them."""
+    create_tables.metadata.drop_all(db.engine)
+    create_tables.metadata.create_all(db.engine)
+    for table in create_tables.metadata.sorted_tables:
+        for index in table.indexes:
+            db.execute("DROP INDEX {}".format(index.name))
+
+    num_searches = max(NUM_ROWS // 10, 1)
+    db.execute("INSERT INTO food_terms (term) "
+               "SELECT 'term' || i FROM generate_series(1, {}) i".format(NUM_TERMS))
+    db.execute("INSERT INTO searches (user_timestamp, search_window, food_id, "
+               "num_matches_total, num_matches_returned) "
+               "SELECT now() - i * interval '1 minute', 'tspan:w', "
+               "1 + mod(i, {}), 1000, 20 "
+               "FROM generate_series(1, {}) i".format(NUM_TERMS, num_searches))
+    db.execute("INSERT INTO pairings (food_id1, food_id2, search_id, occurences) "
+               "SELECT 1 + mod(i, {}), 1 + mod(i * 7, {}), 1 + mod(i, {}), "
+               "1 + mod(i, 13) "
+               "FROM generate_series(1, {}) i".format(NUM_TERMS, NUM_TERMS,
+                                                      num_searches, NUM_ROWS))
+    db.execute("INSERT INTO results (publish_date, index_date, url, search_id) "
+               "SELECT now(), now(), 'http://blog.example/' || i, 1 + mod(i, {}) "
+               "FROM generate_series(1, {}) i".format(num_searches, NUM_ROWS))
+    db.execute("ANALYZE")
+
+    return num_searches
+
+
+def time_lookups(db, num_searches):
+    """Return milliseconds per call of each lookup."""
+    results = db.meta.tables["results"]
+    rand = random.Random(0)
+
+    lookups = {
+        "pairings_with_terms": lambda: db.pairings_with_terms(
+                                        rand.randint(1, num_searches)),
+        "top_pairing_terms": lambda: db.top_pairing_terms(
+                                        list(range(1, 11)), 3),
+        "fresh_search_id": lambda: db.fresh_search_id(
+                        "term{}".format(rand.randint(1, NUM_TERMS)),
+                        "tspan:w", 60 * 60),
+        "results url lookup": lambda: db.execute(select([results.c.id]).where(
+                        results.c.url == "http://blog.example/{}".format(
+                                        rand.randint(1, NUM_ROWS)))).fetchone(),
+    }
+
+    return {name: timeit.timeit(fxn, number=NUM_CALLS) / NUM_CALLS * 1000
+            for name, fxn in lookups.items()}
+
+
+def main():
+    """Seed, time, migrate, time again."""
+    db = DBConnector(BENCH_DB_PATH)
+    print("Seeding {} rows...".format(NUM_ROWS))
+    num_searches = seed(db)
+    before = time_lookups(db, num_searches)
+
+    migrations.migrate(db.engine)
+    db.execute("ANALYZE")
+    after = time_lookups(db, num_searches)
+
+    print("{:<22} {:>12} {:>12}".format("ms/call", "before", "after"))
+    for name in before:
+        print("{:<22} {:>12.3f} {:>12.3f}".format(name, before[name],
+                                                  after[name]))
+
+
+if __name__ == '__main__':
+    main()
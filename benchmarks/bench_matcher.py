@@ -0,0 +1,71 @@
+"""Benchmark the local food term matcher against recorded Spoonacular answers.
+
+Reads a JSON lines file of {"text": ..., "annotations": [...]} records, as
+written by calls.get_food_terms when ANNOTATION_RECORD_PATH is set. The
+matcher's vocabulary is every term seen in the file, or the food_terms
+table with --db. Reports titles per second and how often the matcher
+agrees with Spoonacular.
+
+Run from the project root:
+    python benchmarks/bench_matcher.py recorded.jsonl [--db postgresql:///food_trends]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from term_matcher import TermMatcher
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("recorded", help="JSON lines file of responses")
+    parser.add_argument("--db", help="load the vocabulary from this database")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="passes over the titles when timing")
+    args = parser.parse_args()
+
+    with open(args.recorded) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    expected = [{annotation["annotation"].lower()
+                 for annotation in record["annotations"]}
+                for record in records]
+    titles = [record["text"] for record in records]
+
+    matcher = TermMatcher()
+    start = time.perf_counter()
+    if args.db:
+        from connector import DBConnector
+        matcher.refresh(DBConnector(args.db))
+    else:
+        matcher.add_terms(set().union(*expected))
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        found = [set(matcher.find(title)) for title in titles]
+    match_time = (time.perf_counter() - start) / args.repeat
+
+    true_positives = sum(len(f & e) for f, e in zip(found, expected))
+    num_found = sum(len(f) for f in found)
+    num_expected = sum(len(e) for e in expected)
+
+    print(json.dumps({
+        "titles": len(titles),
+        "vocabulary": matcher.num_terms,
+        "build_ms": round(build_time * 1000, 3),
+        "titles_per_s": round(len(titles) / match_time) if match_time else None,
+        "exact_agreement": sum(f == e for f, e in zip(found, expected)) /
+                                                        max(len(titles), 1),
+        "precision": true_positives / num_found if num_found else None,
+        "recall": true_positives / num_expected if num_expected else None,
+        "titles_answered_locally": sum(bool(f) for f in found) /
+                                                        max(len(titles), 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
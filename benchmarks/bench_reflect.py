@@ -0,0 +1,44 @@
+"""Benchmark the per-call cost of reflecting the schema in DBConnector.
+
+Compares search_record_by_id when every call reflects the schema first (the
+old behavior) with the shared create_tables metadata.
+
+Run from the project root against a populated database:
+    DB_PATH=postgresql:///food_trends python benchmarks/bench_reflect.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from connector import DBConnector
+
+
+DB_PATH = os.environ.get("DB_PATH", "postgresql:///food_trends")
+NUM_CALLS = int(os.environ.get("NUM_CALLS", 200))
+
+
+def main():
+    """Time both ways of looking up the most recent search."""
+    db = DBConnector(DB_PATH)
+    recent = db.recent_n_searches(1)
+    search_id = recent[0][0] if recent else 1
+
+    def reflect_each_call():
+        db.reflect()
+        db.search_record_by_id(search_id)
+
+    def shared_metadata():
+        db.search_record_by_id(search_id)
+
+    # shared metadata first; reflect() replaces db.meta
+    for label, fxn in [("shared metadata", shared_metadata),
+                       ("reflect each call", reflect_each_call)]:
+        seconds = timeit.timeit(fxn, number=NUM_CALLS)
+        print("{:<20} {:8.3f} ms/call".format(label,
+                                              seconds / NUM_CALLS * 1000))
+
+
+if __name__ == '__main__':
+    main()
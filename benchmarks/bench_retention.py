@@ -0,0 +1,194 @@
+"""Benchmark table sizes over months of searches, with and without retention.
+
+Simulates WEEKS weeks of searches in a scratch database, a week at a time:
+SEARCHES_PER_WEEK searches of random terms (one in ten of a single hot term)
+with 20 pairings and 20 results each, added to the rollups as they would
+be when stored. With retention, retention.py runs after each week, keeping
+MAX_AGE days (at least the longest search window) before the end of it.
+Reports, per week, the rows and on-disk size (tables and indexes) of
+pairings and results, and the time to load the hot term's pairing history
+(trends.py reads it, and it grows with every search of the term).
+
+Then, on the database left without retention, times storing a search while
+retention compacts the whole backlog in another thread, against storing one
+with nothing else running. Prints JSON.
+
+ALL TABLES IN BENCH_DB_PATH ARE DROPPED. Run from the project root:
+    BENCH_DB_PATH=postgresql:///food_trends_bench WEEKS=26 \\
+        python benchmarks/bench_retention.py
+"""
+
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy.sql import text
+
+import create_tables
+from connector import DBConnector
+from retention import Retention
+
+
+BENCH_DB_PATH = os.environ.get("BENCH_DB_PATH",
+                               "postgresql:///food_trends_bench")
+WEEKS = int(os.environ.get("WEEKS", 26))
+SEARCHES_PER_WEEK = int(os.environ.get("SEARCHES_PER_WEEK", 2000))
+MAX_AGE = int(os.environ.get("MAX_AGE", 90))
+NUM_CALLS = int(os.environ.get("NUM_CALLS", 200))
+NUM_TERMS = 2000
+HOT_TERM = 1
+
+
+# statements that do not look like writes are rolled back, and the
+# statistics ANALYZE gathers with them
+ANALYZE = text("ANALYZE").execution_options(autocommit=True)
+
+
+def add_week(db, week):
+    """Store a week of searches, ending WEEKS - week - 1 weeks ago."""
+    first = datetime.utcnow() - timedelta(weeks=WEEKS - week)
+    db.execute(text(
+        "INSERT INTO searches (user_timestamp, search_window, food_id, "
+        "num_matches_total, num_matches_returned) "
+        "SELECT CAST(:first AS timestamp) + (i::float / :n) * interval '7 days', "
+        "'tspan:w', CASE WHEN mod(i, 10) = 0 THEN :hot "
+        "ELSE 1 + mod(i * 7919, :terms) END, 1000, 20 "
+        "FROM generate_series(1, :n) i").bindparams(
+                first=first, n=SEARCHES_PER_WEEK, hot=HOT_TERM,
+                terms=NUM_TERMS))
+    db.execute(text(
+        "INSERT INTO pairings (food_id1, food_id2, search_id, occurences) "
+        "SELECT s.food_id, 1 + mod(s.id * 7 + g * g, :terms), s.id, "
+        "1 + mod(s.id + g, 13) FROM searches s, generate_series(1, 20) g "
+        "WHERE s.user_timestamp >= :first").bindparams(
+                terms=NUM_TERMS, first=first))
+    db.execute(text(
+        "INSERT INTO results (publish_date, index_date, url, search_id) "
+        "SELECT s.user_timestamp, s.user_timestamp, "
+        "'http://blog/' || s.id || '/' || g, s.id "
+        "FROM searches s, generate_series(1, 20) g "
+        "WHERE s.user_timestamp >= :first").bindparams(first=first))
+    # added to the rollups as DBConnector.ingest_searches would
+    for table_name, period in (("pairing_rollups_daily", "day"),
+                               ("pairing_rollups_weekly", "week")):
+        db.execute(text(
+            "INSERT INTO {0} SELECT p.food_id1, s.search_window, "
+            "CAST(date_trunc('{1}', s.user_timestamp) AS date), p.food_id2, "
+            "sum(p.occurences), count(*) "
+            "FROM pairings p JOIN searches s ON s.id = p.search_id "
+            "WHERE s.user_timestamp >= :first GROUP BY 1, 2, 3, 4 "
+            "ON CONFLICT (food_id1, search_window, period_start, food_id2) "
+            "DO UPDATE SET occurences = {0}.occurences + excluded.occurences, "
+            "num_searches = {0}.num_searches + excluded.num_searches".format(
+                                        table_name, period)).bindparams(
+                                                            first=first))
+    db.execute(ANALYZE)
+
+
+def sizes(db):
+    """Rows and bytes of pairings (all partitions) and results."""
+    return db.execute(
+        "SELECT (SELECT count(*) FROM pairings), "
+        "(SELECT coalesce(sum(pg_total_relation_size(inhrelid)), 0) "
+        "FROM pg_inherits WHERE inhparent = to_regclass('pairings')), "
+        "(SELECT count(*) FROM results), "
+        "pg_total_relation_size('results')").fetchone()
+
+
+def simulate(db, keeper):
+    """Store WEEKS weeks of searches; return a report line per week."""
+    create_tables.metadata.drop_all(db.engine)
+    create_tables.metadata.create_all(db.engine)
+    db.execute("INSERT INTO food_terms (term) SELECT 'term' || i "
+               "FROM generate_series(1, {}) i".format(NUM_TERMS))
+
+    weeks = []
+    for week in range(WEEKS):
+        if keeper is not None:
+            keeper.ensure_partitions()
+        add_week(db, week)
+
+        compact_s = None
+        if keeper is not None:
+            # as if run at the end of this week
+            keeper.max_age_days = MAX_AGE + 7 * (WEEKS - week - 1)
+            start = time.perf_counter()
+            keeper.run_once()
+            compact_s = round(time.perf_counter() - start, 3)
+            db.execute(ANALYZE)
+
+        start = time.perf_counter()
+        history = db.pairing_history([HOT_TERM])
+        history_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        pairing_rows, pairing_bytes, result_rows, result_bytes = map(
+                                                            int, sizes(db))
+        weeks.append({"week": week + 1,
+                      "pairings": pairing_rows,
+                      "pairings_mb": round(pairing_bytes / 2 ** 20, 1),
+                      "results": result_rows,
+                      "results_mb": round(result_bytes / 2 ** 20, 1),
+                      "partitions": len(db.pairing_partitions()),
+                      "hot_history_rows": len(history),
+                      "hot_history_ms": history_ms,
+                      "retention_s": compact_s})
+
+    return weeks
+
+
+def ingest_ms(db, count, prefix):
+    """Store count searches; return each one's time in milliseconds."""
+    other_terms = {"term{}".format(i): 1 + i % 5 for i in range(2, 30)}
+    times = []
+    for i in range(count):
+        posts = [(datetime(2018, 3, 1), datetime(2018, 3, 1),
+                  "http://blog/{}/{}/{}".format(prefix, i, j))
+                 for j in range(20)]
+        start = time.perf_counter()
+        db.ingest_search("term1", 1000, 20, posts, other_terms)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def summary(times):
+    times = sorted(times)
+    return {"p50_ms": round(statistics.median(times), 2),
+            "p99_ms": round(times[int(len(times) * 0.99) - 1], 2)}
+
+
+def main():
+    db = DBConnector(BENCH_DB_PATH)
+    report = {"weeks": WEEKS, "searches_per_week": SEARCHES_PER_WEEK,
+              "max_age_days": MAX_AGE}
+    report["with_retention"] = simulate(db, Retention(
+            db, max_age_days=MAX_AGE, partition_searches=SEARCHES_PER_WEEK,
+            batch_size=5000, pause=0.05))
+    report["without_retention"] = simulate(db, None)
+
+    report["ingest_idle"] = summary(ingest_ms(db, NUM_CALLS, "idle"))
+
+    # a whole backlog to compact, partitioned as migrations.py would leave it
+    keeper = Retention(db, max_age_days=MAX_AGE, batch_size=5000, pause=0.05)
+    stats = {}
+    compacting = threading.Thread(
+                    target=lambda: stats.update(keeper.compact()))
+    start = time.perf_counter()
+    compacting.start()
+    times = []
+    while compacting.is_alive():
+        times.extend(ingest_ms(db, 10, "busy{}".format(len(times))))
+    compacting.join()
+    report["backlog_compact_s"] = round(time.perf_counter() - start, 2)
+    report["backlog_compact"] = stats
+    report["ingest_while_compacting"] = summary(times)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Benchmark top pairings of a term over a month: raw pairings vs rollups.
+
+Seeds a scratch database with NUM_ROWS pairings (20 per search) from
+searches spread over DAYS days, one in ten of them for a single hot term,
+and fills the rollups with rollups.py. Then times "top pairings of a term
+over the last 30 days" read from raw pairings joined to searches, and read
+by DBConnector.top_pairings_since from the rollups, for the hot term and
+for random ones. Also times storing a search, which now updates the
+rollups too. Prints JSON.
+
+ALL TABLES IN BENCH_DB_PATH ARE DROPPED. Run from the project root:
+    BENCH_DB_PATH=postgresql:///food_trends_bench NUM_ROWS=2000000 \\
+        python benchmarks/bench_rollups.py
+"""
+
+import json
+import os
+import random
+import sys
+import time
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sqlalchemy import desc, func
+from sqlalchemy.sql import select, text
+
+import create_tables
+import rollups
+from connector import DBConnector
+
+
+BENCH_DB_PATH = os.environ.get("BENCH_DB_PATH",
+                               "postgresql:///food_trends_bench")
+NUM_ROWS = int(os.environ.get("NUM_ROWS", 1000000))
+NUM_CALLS = int(os.environ.get("NUM_CALLS", 50))
+DAYS = int(os.environ.get("DAYS", 180))
+NUM_TERMS = 2000
+HOT_TERM = 1
+
+
+# statements that do not look like writes are rolled back, and the 
+# statistics ANALYZE gathers with them
+ANALYZE = text("ANALYZE").execution_options(autocommit=True)
+
+
+def seed(db):
+    """Recreate the tables and fill them; return the time to roll up."""
+    create_tables.metadata.drop_all(db.engine)
+    create_tables.metadata.create_all(db.engine)
+
+    num_searches = max(NUM_ROWS // 20, 1)
+    db.execute("INSERT INTO food_terms (term) "
+               "SELECT 'term' || i FROM generate_series(1, {}) i".format(NUM_TERMS))
+    db.execute("INSERT INTO searches (user_timestamp, search_window, food_id, "
+               "num_matches_total, num_matches_returned) "
+               "SELECT now() at time zone 'utc' - "
+               "(i::float / {}) * interval '{} days', 'tspan:w', "
+               "CASE WHEN mod(i, 10) = 0 THEN {} ELSE 1 + mod(i, {}) END, "
+               "1000, 20 FROM generate_series(1, {}) i".format(
+                    num_searches, DAYS, HOT_TERM, NUM_TERMS, num_searches))
+    db.execute("INSERT INTO pairings (food_id1, food_id2, search_id, occurences) "
+               "SELECT s.food_id, 1 + mod(s.id * 7 + g * g, {}), s.id, "
+               "1 + mod(s.id + g, 13) "
+               "FROM searches s, generate_series(1, 20) g".format(NUM_TERMS))
+    db.execute(ANALYZE)
+
+    start = time.perf_counter()
+    rollups.rebuild(db, chunk_weeks=4)
+    db.execute(ANALYZE)
+    return time.perf_counter() - start
+
+
+def raw_top_pairings(db, term_id, since, limit):
+    """Top pairings since a time, summed from raw pairings only."""
+    searches = db.meta.tables["searches"]
+    pairings = db.meta.tables["pairings"]
+    total = func.sum(pairings.c.occurences).label("occurences")
+    selection = select([pairings.c.food_id2, total,
+                        func.count()]).select_from(
+            pairings.join(searches, pairings.c.search_id == searches.c.id)).where(
+            searches.c.food_id == term_id).where(
+            searches.c.search_window == "tspan:w").where(
+            searches.c.user_timestamp >= since).group_by(
+            pairings.c.food_id2).order_by(
+            desc("occurences"), pairings.c.food_id2).limit(limit)
+
+    return [(partner, int(occurences), int(count))
+            for partner, occurences, count in db.execute(selection)]
+
+
+def main():
+    db = DBConnector(BENCH_DB_PATH)
+    rollup_time = seed(db)
+    rand = random.Random(0)
+    since = datetime.utcnow() - timedelta(days=30)
+
+    report = {"pairings": NUM_ROWS,
+              "days": DAYS,
+              "rebuild_s": round(rollup_time, 2),
+              "daily_rollup_rows": db.execute(
+                "SELECT count(*) FROM pairing_rollups_daily").fetchone()[0],
+              "weekly_rollup_rows": db.execute(
+                "SELECT count(*) FROM pairing_rollups_weekly").fetchone()[0]}
+
+    for label, pick_term in (("hot_term", lambda: HOT_TERM),
+                             ("random_term",
+                              lambda: rand.randint(2, NUM_TERMS))):
+        term_id = pick_term()
+        report[label + "_agree"] = (
+                raw_top_pairings(db, term_id, since, 10) ==
+                db.top_pairings_since(term_id, "tspan:w", since, 10))
+        for name, fxn in (("raw", raw_top_pairings),
+                          ("rollups", DBConnector.top_pairings_since)):
+            if name == "raw":
+                call = lambda: fxn(db, pick_term(), since, 10)
+            else:
+                call = lambda: fxn(db, pick_term(), "tspan:w", since, 10)
+            report["{}_{}_ms".format(label, name)] = round(
+                    timeit.timeit(call, number=NUM_CALLS) / NUM_CALLS * 1000, 3)
+
+    other_terms = {"term{}".format(i): 1 + i % 5 for i in range(2, 30)}
+    ingest = lambda: db.ingest_search("term1", 1000, 20, [], other_terms)
+    report["ingest_ms"] = round(timeit.timeit(ingest, number=NUM_CALLS) /
+                                NUM_CALLS * 1000, 3)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""End-to-end /search -> /results benchmark with no live API keys.
+
+Starts local stand-ins for Spoonacular and Twingly (see stand_ins.py),
+points the app at them and a scratch database, then runs searches through
+the Flask app at each concurrency level. Prints JSON with latency
+percentiles, throughput, and DB queries and external calls per search.
+
+Run from the project root (tables in BENCH_DB_PATH are migrated, not dropped):
+    BENCH_DB_PATH=postgresql:///food_trends_bench \
+        python benchmarks/bench_search.py --concurrency 1,4,16 \
+        --searches 50 --latency-ms 80 --jitter-ms 30 --error-rate 0.01 \
+        --output bench.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import stand_ins
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", default="1,4,16",
+                        help="comma-separated numbers of concurrent users")
+    parser.add_argument("--searches", type=int, default=40,
+                        help="searches to run at each concurrency level")
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--jitter-ms", type=float, default=30)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--handshake-ms", type=float, default=0,
+                        help="extra delay on each new connection to an API")
+    parser.add_argument("--corpus", help="file of blog post titles, one per "
+                                         "line (default: generated)")
+    parser.add_argument("--corpus-size", type=int, default=2000)
+    parser.add_argument("--reuse", action="store_true",
+                        help="allow fresh stored searches to be reused")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    return parser.parse_args()
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def run_level(app, db, spoonacular, twingly, concurrency, num_searches,
+                                                                    refresh):
+    """Run num_searches searches with concurrency users; return stats."""
+    terms = [stand_ins.FOODS[i % len(stand_ins.FOODS)]
+             for i in range(num_searches)]
+    latencies = []
+    failures = []
+    lock = threading.Lock()
+
+    def _user():
+        client = app.test_client()
+        while True:
+            with lock:
+                if not terms:
+                    return
+                term = terms.pop()
+
+            start = time.perf_counter()
+            try:
+                response = client.get("/search", follow_redirects=True,
+                            query_string={"choice": term, "refresh": refresh})
+                ok = response.status_code == 200
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+
+            with lock:
+                (latencies if ok else failures).append(elapsed)
+
+    start_queries = db.query_count
+    start_spoonacular, start_twingly = spoonacular.calls, twingly.calls
+    start_connections = spoonacular.connections + twingly.connections
+    start = time.perf_counter()
+
+    users = [threading.Thread(target=_user) for _ in range(concurrency)]
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+
+    wall_time = time.perf_counter() - start
+    latencies.sort()
+    ms = [latency * 1000 for latency in latencies]
+
+    return {"concurrency": concurrency,
+            "searches": num_searches,
+            "failed": len(failures),
+            "wall_time_s": round(wall_time, 3),
+            "throughput_per_s": round(num_searches / wall_time, 2),
+            "latency_ms": {"p50": percentile(ms, 0.50),
+                           "p95": percentile(ms, 0.95),
+                           "p99": percentile(ms, 0.99),
+                           "max": ms[-1] if ms else None},
+            "db_queries_per_search":
+                (db.query_count - start_queries) / num_searches,
+            "spoonacular_calls_per_search":
+                (spoonacular.calls - start_spoonacular) / num_searches,
+            "twingly_calls_per_search":
+                (twingly.calls - start_twingly) / num_searches,
+            "api_connections_per_search":
+                (spoonacular.connections + twingly.connections - 
+                 start_connections) / num_searches}
+
+
+def main():
+    args = parse_args()
+
+    if args.corpus:
+        with open(args.corpus) as f:
+            corpus = [line.strip() for line in f if line.strip()]
+    else:
+        corpus = stand_ins.make_corpus(args.corpus_size)
+
+    latency, jitter = args.latency_ms / 1000, args.jitter_ms / 1000
+    handshake = args.handshake_ms / 1000
+    spoonacular = stand_ins.SpoonacularStandIn(latency=latency, jitter=jitter,
+                error_rate=args.error_rate, handshake=handshake).start()
+    twingly = stand_ins.TwinglyStandIn(corpus, latency=latency, jitter=jitter,
+                error_rate=args.error_rate, handshake=handshake).start()
+
+    # the app reads its configuration at import
+    os.environ.update({
+        "DB_PATH": os.environ.get("BENCH_DB_PATH",
+                                  "postgresql:///food_trends_bench"),
+        "SPOONACULAR_URL": spoonacular.url,
+        "TWINGLY_URL": twingly.url,
+        "MASHAPE_KEY": "bench",
+        "TWINGLY_SEARCH_KEY": "bench",
+        "APP_KEY": "bench",
+        "SEARCH_MODE": "sync"})
+
+    import calls
+    import migrations
+    from food_trends import app
+
+    migrations.migrate(calls.db.engine)
+    app.config["TESTING"] = True
+
+    runs = [run_level(app, calls.db, spoonacular, twingly, concurrency,
+                      args.searches, "" if args.reuse else "1")
+            for concurrency in map(int, args.concurrency.split(","))]
+
+    report = {"config": vars(args), "runs": runs}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    spoonacular.stop()
+    twingly.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark how fast a fresh worker process can start serving.
+
+Each run is a new Python process that imports food_trends, makes an app
+with create_app and serves its first request to "/". Prints JSON with the
+median time of each step, and whether anything that must not cross a fork
+(a database engine, the Twingly client) was made during import.
+
+Run from the project root:
+    APP_KEY=bench python benchmarks/bench_startup.py --runs 20
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from statistics import median
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# run in each new process; prints one JSON line
+WORKER = """
+import json, sys, time
+start = time.perf_counter()
+import food_trends
+imported = time.perf_counter()
+app = food_trends.create_app()
+created = time.perf_counter()
+status = app.test_client().get("/").status_code
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "status": status,
+    "engine_made": food_trends.calls.db._engine.peek() is not None,
+    "twingly_client_made": food_trends.calls.twingly_client.peek() is not None,
+    "modules": sorted(name for name in ("twingly_search", "psycopg2", "jobs",
+                      "mock_twingly", "mock_spoonacular") if name in sys.modules),
+}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("APP_KEY", "bench")
+
+    runs = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", WORKER], cwd=ROOT,
+                                env=env, check=True, capture_output=True,
+                                text=True).stdout
+        wall_time = time.perf_counter() - start
+        run = json.loads(output.strip().splitlines()[-1])
+        run["process_ms"] = wall_time * 1000
+        runs.append(run)
+
+    report = {"runs": args.runs}
+    for key in ("process_ms", "import_ms", "create_app_ms",
+                "first_request_ms"):
+        report[key] = round(median(run[key] for run in runs), 1)
+    for key in ("status", "engine_made", "twingly_client_made", "modules"):
+        report[key] = runs[-1][key]
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
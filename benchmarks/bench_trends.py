@@ -0,0 +1,199 @@
+"""Benchmark pairing trend analytics: NumPy arrays vs per-search dicts.
+
+Both paths take the same pairing history rows and compute, for every term,
+rolling mean popularity, growth rates and the top rising partners. The dict
+path scores each search with metric_calcs.get_pairing_popularities and works
+partner by partner in Python, as code built on it would; the NumPy path is
+trends.py. Rows are generated (terms searched repeatedly over 90 days, with
+Zipf-like partner popularity) or loaded from the database with --db. Prints
+JSON with the time of each path and whether their rankings agree.
+
+Run from the project root:
+    python benchmarks/bench_trends.py --terms 200 --searches 60 --pairings 15
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import metric_calcs
+import trends
+
+
+def make_rows(num_terms, searches_per_term, pairings_per_search,
+                                            num_partners=2000, seed=0):
+    """Make pairing history rows as DBConnector.pairing_history returns."""
+    rand = random.Random(seed)
+    weights = [1 / rank for rank in range(1, num_partners + 1)]
+    partner_ids = list(range(num_terms + 1, num_terms + num_partners + 1))
+    start = datetime(2018, 1, 1)
+
+    rows = []
+    search_id = 0
+    for term_id in range(1, num_terms + 1):
+        offsets = sorted(rand.uniform(0, 90) for _ in range(searches_per_term))
+        for offset in offsets:
+            search_id += 1
+            timestamp = start + timedelta(days=offset)
+            returned = 20
+            # the same partner can come up twice; a search stores it once
+            pairings = {}
+            for partner_id in rand.choices(partner_ids, weights,
+                                           k=pairings_per_search):
+                pairings[partner_id] = rand.randint(1, returned)
+            for partner_id, occurences in pairings.items():
+                rows.append((term_id, search_id, timestamp, returned,
+                             partner_id, occurences))
+
+    return rows
+
+
+def dict_path(rows, rolling_days, k, min_searches):
+    """Rolling means and rising partners of each term, dict by dict."""
+    # one pairings dict per search, as calls.get_pairings gives
+    searches = {}
+    for food_id, search_id, timestamp, returned, partner_id, occurences in rows:
+        term_searches = searches.setdefault(food_id, {})
+        if search_id not in term_searches:
+            term_searches[search_id] = (timestamp, returned, {})
+        if partner_id:
+            term_searches[search_id][2][partner_id] = occurences
+
+    results = {}
+    for food_id, term_searches in searches.items():
+        ordered = sorted(term_searches.values(), key=lambda search: search[0])
+        first_time = ordered[0][0]
+        days = [(timestamp - first_time).total_seconds() / 86400
+                for timestamp, returned, pairings in ordered]
+        popularities = [metric_calcs.get_pairing_popularities(pairings,
+                                                              returned)
+                        for timestamp, returned, pairings in ordered]
+
+        partners = set()
+        for pairings in popularities:
+            partners.update(pairings)
+
+        mean_day = sum(days) / len(days)
+        spread = sum((day - mean_day) ** 2 for day in days)
+        rolling = {}
+        ranked = []
+        for partner_id in partners:
+            series = [pairings.get(partner_id, 0) for pairings in popularities]
+
+            window = []
+            start = 0
+            total = 0
+            for index, day in enumerate(days):
+                total += series[index]
+                while days[start] < day - rolling_days:
+                    total -= series[start]
+                    start += 1
+                window.append(total / (index + 1 - start))
+            rolling[partner_id] = window
+
+            growth = (sum((day - mean_day) * value
+                          for day, value in zip(days, series)) / spread
+                      if spread else 0)
+            seen = sum(1 for value in series if value)
+            if seen >= min_searches and growth > 0:
+                ranked.append((partner_id, growth, sum(series) / len(series),
+                               seen))
+
+        ranked.sort(key=lambda partner: (-partner[1], partner[0]))
+        results[food_id] = (rolling, ranked[:k])
+
+    return results
+
+
+def numpy_path(rows, rolling_days, k, min_searches):
+    """Rolling means and rising partners of each term, with trends.py."""
+    results = {}
+    for food_id, history in trends.histories_from_rows(rows).items():
+        results[food_id] = (history.rolling_mean(rolling_days),
+                            history.rising(k, min_searches=min_searches))
+    return results
+
+
+def rankings_agree(dict_results, numpy_results):
+    """Check both paths ranked the same partners with the same growth."""
+    if dict_results.keys() != numpy_results.keys():
+        return False
+    for food_id, ranked in dict_results.items():
+        numpy_ranked = numpy_results[food_id]
+        if [partner[0] for partner in ranked] != [partner[0] for partner
+                                                  in numpy_ranked]:
+            return False
+        for partner, numpy_partner in zip(ranked, numpy_ranked):
+            if abs(partner[1] - numpy_partner[1]) > 1e-6 * max(1, partner[1]):
+                return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--terms", type=int, default=200)
+    parser.add_argument("--searches", type=int, default=60,
+                        help="searches per term")
+    parser.add_argument("--pairings", type=int, default=15,
+                        help="pairings drawn per search")
+    parser.add_argument("--rolling-days", type=float, default=7)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--min-searches", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--db", help="load pairing history from this database")
+    args = parser.parse_args()
+
+    load_time = None
+    if args.db:
+        from connector import DBConnector
+        db = DBConnector(args.db)
+        term_ids = [row[0] for row in db.execute(
+                                    "SELECT DISTINCT food_id FROM searches")]
+        start = time.perf_counter()
+        rows = db.pairing_history(term_ids)
+        load_time = time.perf_counter() - start
+    else:
+        rows = make_rows(args.terms, args.searches, args.pairings)
+
+    timings = {}
+    for name, path in (("dict", dict_path), ("numpy", numpy_path)):
+        times = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            results = path(rows, args.rolling_days, args.k, args.min_searches)
+            times.append(time.perf_counter() - start)
+            # keep only the rankings, so a big heap of rolling means left 
+            # over does not slow down the next run's garbage collection
+            rankings = {food_id: ranked
+                        for food_id, (rolling, ranked) in results.items()}
+            del results
+            gc.collect()
+        timings[name] = (min(times), rankings)
+
+    # the NumPy path split into building arrays and analysing them
+    start = time.perf_counter()
+    histories = trends.histories_from_rows(rows)
+    build_time = time.perf_counter() - start
+
+    print(json.dumps({
+        "rows": len(rows),
+        "terms": len(histories),
+        "searches": sum(history.num_searches
+                        for history in histories.values()),
+        "load_s": round(load_time, 3) if load_time is not None else None,
+        "dict_s": round(timings["dict"][0], 3),
+        "numpy_s": round(timings["numpy"][0], 3),
+        "numpy_build_s": round(build_time, 3),
+        "speedup": round(timings["dict"][0] / timings["numpy"][0], 1),
+        "rankings_agree": rankings_agree(timings["dict"][1],
+                                         timings["numpy"][1])}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
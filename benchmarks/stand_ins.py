@@ -0,0 +1,184 @@
+"""Local HTTP stand-ins for the Spoonacular and Twingly APIs.
+
+Each stand-in runs an HTTP server on a background thread and answers like the
+real API, with configurable latency, jitter and error rate. Blog post titles
+come from a corpus; food terms are found by looking for a vocabulary of
+known foods in the text.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+
+FOODS = ["apple", "avocado", "bacon", "banana", "basil", "beet", "blueberry",
+         "burrata", "butter", "cake", "caramel", "carrot", "cheese", "chicken",
+         "chocolate", "cinnamon", "coconut", "cookie", "corn", "feta",
+         "garlic", "ginger", "honey", "kale", "lemon", "lime", "maple syrup",
+         "mint", "mushroom", "onion", "orange", "peach", "peanut butter",
+         "pecan", "pesto", "pie", "pork", "pumpkin", "quinoa", "salmon",
+         "scone", "spinach", "strawberry", "sweet potato", "tomato", "vanilla",
+         "walnut", "yogurt", "zucchini"]
+
+TITLE_TEMPLATES = ["Easy {0} and {1} salad", "My favorite {0} {1} recipe",
+                   "{0} with {1} and {2}", "Weeknight {0} soup",
+                   "How to make {0} {1} bread", "{0}, {1} & {2} bowls",
+                   "The best {0} you will ever eat", "Roasted {0} with {1}"]
+
+
+def make_corpus(num_titles, seed=0):
+    """Generate blog post titles made from FOODS."""
+    rand = random.Random(seed)
+    return [rand.choice(TITLE_TEMPLATES).format(*rand.sample(FOODS, 3))
+            for _ in range(num_titles)]
+
+
+class StandIn():
+    """An HTTP server thread pretending to be an external API."""
+
+    def __init__(self, latency=0.05, jitter=0.02, error_rate=0.0, seed=0,
+                                                            handshake=0.0):
+        self.latency = latency
+        # extra delay on each new connection, like a TCP+TLS handshake
+        self.handshake = handshake
+        self.connections = 0
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = 0
+        self.errors = 0
+        self._rand = random.Random(seed)
+        self._lock = threading.Lock()
+
+        stand_in = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            # keep-alive, like the real APIs
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stand_in._lock:
+                    stand_in.connections += 1
+                time.sleep(stand_in.handshake)
+
+            def do_GET(self):
+                stand_in._serve(self)
+
+            def do_POST(self):
+                stand_in._serve(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return "http://{}:{}{}".format(host, port, self.path)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _serve(self, handler):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._rand.uniform(-self.jitter,
+                                                      self.jitter)
+            failed = self._rand.random() < self.error_rate
+            if failed:
+                self.errors += 1
+
+        time.sleep(max(delay, 0))
+        if failed:
+            status, content_type, body = 500, "text/plain", "stand-in error"
+        else:
+            status, content_type, body = self.respond(handler)
+
+        body = body.encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type)
+        handler.send_header("Content-Length", str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+
+class SpoonacularStandIn(StandIn):
+    """Answers POST /food/detect with the known foods found in the text."""
+
+    path = "/food/detect"
+
+    def __init__(self, vocabulary=None, **kwargs):
+        super().__init__(**kwargs)
+        vocabulary = sorted(vocabulary or FOODS, key=len, reverse=True)
+        self.pattern = re.compile(r"\b(" + "|".join(map(re.escape,
+                                  vocabulary)) + r")\b", re.IGNORECASE)
+
+    def respond(self, handler):
+        length = int(handler.headers.get("Content-Length", 0))
+        form = parse_qs(handler.rfile.read(length).decode("utf-8"))
+        text = form.get("text", [""])[0]
+
+        annotations = [{"annotation": match.lower(), "tag": "ingredient"}
+                       for match in set(self.pattern.findall(text))]
+        return 200, "application/json", json.dumps(
+                    {"annotations": annotations, "processedInMs": 1})
+
+
+class TwinglyStandIn(StandIn):
+    """Answers Twingly Blog Search v3 queries with titles from a corpus."""
+
+    path = "/blog/search/api/v3/search"
+
+    def __init__(self, corpus, **kwargs):
+        super().__init__(**kwargs)
+        self.corpus = corpus
+
+    def respond(self, handler):
+        query = parse_qs(urlparse(handler.path).query).get("q", [""])[0]
+        food_term = query.split(" fields:")[0]
+        page_size = re.search(r"page-size:(\d+)", query)
+        page_size = int(page_size.group(1)) if page_size else 10
+
+        with self._lock:
+            titles = [self._rand.choice(self.corpus)
+                      for _ in range(page_size)]
+            total = self._rand.randint(page_size, 50 * page_size)
+
+        now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+        posts = "".join(POST_XML.format(id=uuid.uuid4().hex,
+                                        title=escape(food_term + " " + title),
+                                        now=now)
+                        for title in titles)
+        body = ('<?xml version="1.0" encoding="utf-8"?>'
+                '<twinglydata numberOfMatchesReturned="{}" '
+                'secondsElapsed="0.01" numberOfMatchesTotal="{}" '
+                'incompleteResult="false">{}</twinglydata>').format(
+                                                    len(titles), total, posts)
+        return 200, "application/xml", body
+
+
+POST_XML = ("<post><id>{id}</id><author>cook</author>"
+            "<url>http://blog.example/{id}</url><title>{title}</title>"
+            "<text></text><languageCode>en</languageCode>"
+            "<locationCode>us</locationCode><coordinates /><links />"
+            "<tags /><images /><indexedAt>{now}</indexedAt>"
+            "<publishedAt>{now}</publishedAt><reindexedAt>{now}</reindexedAt>"
+            "<inlinksCount>0</inlinksCount><blogId>1</blogId>"
+            "<blogName>Blog</blogName><blogUrl>http://blog.example</blogUrl>"
+            "<blogRank>1</blogRank><authority>0</authority></post>")
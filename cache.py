@@ -0,0 +1,361 @@
+"""In-process and persistent caches for Food Trends application."""
+
+import hashlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.exc import SQLAlchemyError
+
+
+class LRUCache():
+    """Thread-safe least-recently-used cache with optional time-to-live.
+
+    Holds at most `maxsize` entries; the least recently used entry is dropped
+    to make room. Entries older than `ttl` seconds count as misses.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the value stored under key, or default."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, stored_at = entry
+            if self.ttl is not None and time.time() - stored_at > self.ttl:
+                del self._data[key]
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Store value under key, evicting the oldest entry if full."""
+        with self._lock:
+            self._data[key] = (value, time.time())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove key and return its value, or default."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TermCache():
+    """Bounded two-way map between food terms and their ids.
+
+    Food term records are never changed once made, so entries do not expire.
+    """
+
+    def __init__(self, maxsize=50000):
+        self.maxsize = maxsize
+        self._ids = LRUCache(maxsize=maxsize)
+        self._terms = LRUCache(maxsize=maxsize)
+
+    def id_for(self, term):
+        """Return the id of term, or None if not cached."""
+        return self._ids.get(term)
+
+    def term_for(self, term_id):
+        """Return the term with id term_id, or None if not cached."""
+        return self._terms.get(term_id)
+
+    def add(self, term, term_id):
+        """Remember a term and its id."""
+        self._ids.set(term, term_id)
+        self._terms.set(term_id, term)
+
+    def update(self, term_ids):
+        """Remember every term and id in a dictionary of term to id."""
+        for term, term_id in term_ids.items():
+            self.add(term, term_id)
+
+    def clear(self):
+        """Forget every term."""
+        self._ids.clear()
+        self._terms.clear()
+
+    def stats(self):
+        """Return hit/miss counters for both directions."""
+        return {"term_id_hits": self._ids.hits,
+                "term_id_misses": self._ids.misses,
+                "id_term_hits": self._terms.hits,
+                "id_term_misses": self._terms.misses}
+
+    def __len__(self):
+        return len(self._ids)
+
+
+class URLFilter():
+    """Bloom filter of recently stored blog post URLs.
+
+    Answers "seen before?" in constant memory: never wrong about a URL it 
+    was given, but wrong about new URLs a fraction `error_rate` of the time. 
+    Holds about `capacity` URLs; once that many are added, they become the 
+    previous generation and the one before is forgotten, so at most twice 
+    `capacity` recent URLs are remembered.
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.0001):
+        self.capacity = capacity
+        # the optimal number of bits and of hashes per URL for error_rate
+        self.num_bits = max(int(-capacity * math.log(error_rate) / 
+                                math.log(2) ** 2), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * 
+                                        math.log(2))), 1)
+        self.hits = 0
+        self.misses = 0
+        self._current = bytearray((self.num_bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, url):
+        digest = hashlib.blake2b(url.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * step) % self.num_bits 
+                for i in range(self.num_hashes)]
+
+    def __contains__(self, url):
+        positions = self._positions(url)
+        with self._lock:
+            for bits in (self._current, self._previous):
+                if all(bits[position >> 3] & (1 << (position & 7)) 
+                       for position in positions):
+                    self.hits += 1
+                    return True
+            self.misses += 1
+            return False
+
+    def add(self, url):
+        """Remember url."""
+        positions = self._positions(url)
+        with self._lock:
+            if self._count >= self.capacity:
+                self._previous = self._current
+                self._current = bytearray(len(self._previous))
+                self._count = 0
+            for position in positions:
+                self._current[position >> 3] |= 1 << (position & 7)
+            self._count += 1
+
+    def update(self, urls):
+        """Remember every URL in urls."""
+        for url in urls:
+            self.add(url)
+
+    def clear(self):
+        """Forget every URL."""
+        with self._lock:
+            self._current = bytearray(len(self._current))
+            self._previous = bytearray(len(self._current))
+            self._count = 0
+
+    def stats(self):
+        """Return hit/miss counters."""
+        return {"url_filter_hits": self.hits, 
+                "url_filter_misses": self.misses}
+
+
+def title_hash(title):
+    """Hash a blog post title after normalizing case and whitespace."""
+    normalized = " ".join(title.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+class AnnotationCache():
+    """Two-tier cache of blog post title -> food terms.
+
+    An LRUCache sits in front of the `annotations` table in the database.
+    Both tiers expire entries after `ttl` seconds; the table is trimmed to
+    `max_rows` every `evict_every` writes, in a background thread so the
+    write that triggers it does not wait.
+    """
+
+    def __init__(self, db, maxsize=10000, ttl=30 * 24 * 60 * 60,
+                                    max_rows=500000, evict_every=500):
+        self.db = db
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.evict_every = evict_every
+        self.store_hits = 0
+        self.store_misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._evicting = None
+
+    def get(self, title):
+        """Return a list of food terms for title, or None if not cached."""
+        key = title_hash(title)
+
+        terms = self.memory.get(key)
+        if terms is not None:
+            return list(terms)
+
+        try:
+            record = self.db.annotation_by_hash(key, max_age=self.ttl)
+        except SQLAlchemyError as error:
+            print("Annotation store unavailable: {}".format(error))
+            return None
+
+        if record is None:
+            self.store_misses += 1
+            return None
+
+        self.store_hits += 1
+        terms = json.loads(record[1])
+        self.memory.set(key, terms)
+        return list(terms)
+
+    def set(self, title, terms):
+        """Store the food terms found in title in both tiers."""
+        key = title_hash(title)
+        self.memory.set(key, list(terms))
+
+        try:
+            self.db.new_annotation_record(key, json.dumps(sorted(terms)))
+        except SQLAlchemyError as error:
+            print("Annotation store unavailable: {}".format(error))
+            return
+
+        if self._count_write() % self.evict_every == 0:
+            self._evict_in_background()
+
+    def _count_write(self):
+        with self._lock:
+            self._writes += 1
+            return self._writes
+
+    def _evict_in_background(self):
+        """Trim the table in a thread, unless one is already."""
+        with self._lock:
+            if self._evicting is not None and self._evicting.is_alive():
+                return
+            self._evicting = threading.Thread(target=self._evict, daemon=True)
+            self._evicting.start()
+
+    def _evict(self):
+        try:
+            self.db.evict_annotations(self.ttl, self.max_rows)
+        except SQLAlchemyError as error:
+            print("Annotation store unavailable: {}".format(error))
+
+    def stats(self):
+        """Return hit/miss counters for both tiers."""
+        return {"memory_hits": self.memory.hits,
+                "memory_misses": self.memory.misses,
+                "store_hits": self.store_hits,
+                "store_misses": self.store_misses}
+
+
+class PageCache():
+    """Rendered pages by key, in memory and optionally in a directory.
+
+    Entries are (body, etag, last_modified) with last_modified a Unix time.
+    The directory tier lets worker processes share pages; both tiers expire 
+    entries after `ttl` seconds. Failing to read or write a file is treated 
+    as a miss.
+    """
+
+    def __init__(self, maxsize=500, ttl=None, directory=None):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.ttl = ttl
+        self.directory = directory
+        self.disk_hits = 0
+        self.disk_misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, "{}.json".format(key))
+
+    def get(self, key):
+        """Return the entry stored under key, or None."""
+        entry = self.memory.get(key)
+        if entry is not None or not self.directory:
+            return entry
+
+        try:
+            with open(self._path(key)) as f:
+                entry = tuple(json.load(f))
+        except (OSError, ValueError):
+            entry = None
+
+        if entry is None or (self.ttl is not None and 
+                                    time.time() - entry[2] > self.ttl):
+            self.disk_misses += 1
+            return None
+
+        self.disk_hits += 1
+        self.memory.set(key, entry)
+        return entry
+
+    def set(self, key, body):
+        """Store a page under key in both tiers; return its entry."""
+        etag = hashlib.sha1(body.encode("utf-8")).hexdigest()
+        entry = (body, etag, time.time())
+        self.memory.set(key, entry)
+
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                # written whole, then renamed, so readers never see half a page
+                fd, temp_path = tempfile.mkstemp(dir=self.directory)
+                with os.fdopen(fd, "w") as f:
+                    json.dump(entry, f)
+                os.replace(temp_path, self._path(key))
+            except OSError as error:
+                print("Page cache directory unavailable: {}".format(error))
+
+        return entry
+
+    def pop(self, key):
+        """Remove key from both tiers."""
+        self.memory.pop(key)
+        if self.directory:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        """Remove every entry from both tiers."""
+        self.memory.clear()
+        if self.directory and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith(".json"):
+                    self.pop(name[:-len(".json")])
+
+    def stats(self):
+        """Return hit/miss counters for both tiers."""
+        return {"page_memory_hits": self.memory.hits,
+                "page_memory_misses": self.memory.misses,
+                "page_disk_hits": self.disk_hits,
+                "page_disk_misses": self.disk_misses}
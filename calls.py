@@ -3,44 +3,257 @@
 import os
 import requests
 import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
 
-from twingly_search import Client
 from flask import session
 
 from connector import DBConnector
-import mock_spoonacular
-import mock_twingly
+from cache import AnnotationCache, LRUCache, PageCache
+from term_matcher import TermMatcher
+from cooccurrence import PairingGraph, SCORES as PAIRING_SCORES
+from singleflight import SingleFlight, LocalLock, FileLock, AdvisoryLock
+from http_pool import PooledSession, RateLimiter, make_adapter
+from process_local import ProcessLocal
 import metric_calcs as calcs
+import formatting
+import metrics
 
 
 MASHAPE_KEY = os.environ.get("MASHAPE_KEY")
 # TWINGLY_SEARCH_KEY pulled from environment variables by library
 
+# API endpoints; overridden to point at local stand-ins for benchmarks
+SPOONACULAR_URL = os.environ.get("SPOONACULAR_URL", 
+        "https://spoonacular-recipe-food-nutrition-v1.p.mashape.com/food/detect")
+TWINGLY_URL = os.environ.get("TWINGLY_URL")
+
+# pooled connections to both APIs: HTTP_POOL_SIZE kept open per host, failed 
+# calls retried HTTP_RETRIES times with exponential backoff
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 10))
+HTTP_RETRIES = int(os.environ.get("HTTP_RETRIES", 2))
+HTTP_BACKOFF = float(os.environ.get("HTTP_BACKOFF", 0.3))
+# seconds to connect, and to wait for an answer unless a call sets its own
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", 30))
+# most calls per second to each API, across all threads (0 = no limit)
+SPOONACULAR_RATE = float(os.environ.get("SPOONACULAR_RATE", 0))
+TWINGLY_RATE = float(os.environ.get("TWINGLY_RATE", 0))
+
+# where food terms come from: "api" (Spoonacular), "local" (terms already in 
+# the food_terms table) or "local+api" (Spoonacular only when none are known)
+ANNOTATION_SOURCE = os.environ.get("ANNOTATION_SOURCE", "api")
+# append each Spoonacular response to this JSON lines file, if set
+ANNOTATION_RECORD_PATH = os.environ.get("ANNOTATION_RECORD_PATH")
+
+# annotating blog titles; "concurrent" fans out, "serial" is the fallback
+ANNOTATION_MODE = os.environ.get("ANNOTATION_MODE", "concurrent")
+ANNOTATION_WORKERS = int(os.environ.get("ANNOTATION_WORKERS", 8))
+# seconds to wait on a single Spoonacular call
+ANNOTATION_TIMEOUT = float(os.environ.get("ANNOTATION_TIMEOUT", 5))
+
+# reuse a search for the same term made within this many seconds (0 = never)
+SEARCH_TTL = int(os.environ.get("SEARCH_TTL", 60 * 60))
+SEARCH_WINDOW = "tspan:w"
+# windows searched by each request, in parallel; the first is the one shown 
+# in full, the others are linked to it (e.g. "tspan:w,tspan:24h,tspan:m")
+SEARCH_WINDOWS = os.environ.get("SEARCH_WINDOWS", SEARCH_WINDOW).split(",")
+if not set(SEARCH_WINDOWS) <= set(calcs.WINDOW_DAYS):
+    raise ValueError("SEARCH_WINDOWS must be some of {}, not {}.".format(
+                        ", ".join(calcs.WINDOW_DAYS), ",".join(SEARCH_WINDOWS)))
+
+# how many blog posts a search samples: TWINGLY_PAGES pages of 
+# TWINGLY_PAGE_SIZE posts, at most TWINGLY_FETCH_WORKERS fetched at once
+TWINGLY_PAGE_SIZE = int(os.environ.get("TWINGLY_PAGE_SIZE", 20))
+TWINGLY_PAGES = int(os.environ.get("TWINGLY_PAGES", 1))
+TWINGLY_FETCH_WORKERS = int(os.environ.get("TWINGLY_FETCH_WORKERS", 4))
+
+# "sync" runs searches inside the request; "job" queues them for workers
+SEARCH_MODE = os.environ.get("SEARCH_MODE", "sync")
+SEARCH_WORKERS = int(os.environ.get("SEARCH_WORKERS", 2))
+
+# how identical concurrent searches are coalesced across worker processes: 
+# "local" (threads in one process only), "file" or "postgres"
+SEARCH_LOCK = os.environ.get("SEARCH_LOCK", "local")
+SEARCH_LOCK_DIR = os.environ.get("SEARCH_LOCK_DIR", "/tmp/food_trends_locks")
+
 # several fxns need to access the database
-DB_PATH = "postgresql:///food_trends"
-db = DBConnector(DB_PATH)
+DB_PATH = os.environ.get("DB_PATH", "postgresql:///food_trends")
+# URLs per generation of the filter in front of the results table
+URL_FILTER_SIZE = int(os.environ.get("URL_FILTER_SIZE", 100000))
+db = DBConnector(DB_PATH, url_filter_size=URL_FILTER_SIZE)
+
+# blog post title -> food terms, in memory and in the annotations table
+annotation_cache = AnnotationCache(db, 
+        maxsize=int(os.environ.get("ANNOTATION_CACHE_SIZE", 10000)), 
+        ttl=int(os.environ.get("ANNOTATION_CACHE_TTL", 30 * 24 * 60 * 60)), 
+        max_rows=int(os.environ.get("ANNOTATION_STORE_ROWS", 500000)))
+
+# known food terms, for finding them in titles without the API
+term_matcher = TermMatcher(
+        refresh_interval=int(os.environ.get("TERM_MATCHER_REFRESH", 60)))
+
+# made again in each process, so forked workers never share connections
+http_adapter = ProcessLocal(lambda: make_adapter(
+                                        pool_maxsize=HTTP_POOL_SIZE, 
+                                        retries=HTTP_RETRIES, 
+                                        backoff_factor=HTTP_BACKOFF))
+http_session = ProcessLocal(lambda: PooledSession(http_adapter.get(), 
+                            timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT)))
+
+
+def make_twingly_client():
+    """Make a Twingly client sending its requests through the pool."""
+    # imported when first needed; it is slow to import and unused by most 
+    # requests
+    from twingly_search import Client
+
+    client = Client()
+    if TWINGLY_URL:
+        client.API_URL = TWINGLY_URL
+
+    session = PooledSession(http_adapter.get(), 
+                            timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    session.headers.update(client._session.headers)
+    client._session = session
+    return client
+
+
+twingly_client = ProcessLocal(make_twingly_client)
+
+spoonacular_limit = RateLimiter(SPOONACULAR_RATE)
+twingly_limit = RateLimiter(TWINGLY_RATE)
+
+# co-occurrence counts over all stored pairings; pairs seen fewer than 
+# PAIRING_MIN_COUNT times are not ranked by lift or PMI
+pairing_graph = PairingGraph(
+        refresh_interval=int(os.environ.get("PAIRING_GRAPH_REFRESH", 60)), 
+        rebuild_interval=int(os.environ.get("PAIRING_GRAPH_REBUILD", 60 * 60)))
+PAIRING_MIN_COUNT = int(os.environ.get("PAIRING_MIN_COUNT", 2))
+
+# pairing trends over a term's searches: popularity averaged over the last 
+# TREND_ROLLING_DAYS days; partners seen in fewer than TREND_MIN_SEARCHES 
+# searches are not ranked
+TREND_ROLLING_DAYS = float(os.environ.get("TREND_ROLLING_DAYS", 7))
+TREND_MIN_SEARCHES = int(os.environ.get("TREND_MIN_SEARCHES", 3))
+
+# search id -> (bubble chart JSON, ETag); a stored search never changes
+graph_data_cache = LRUCache(
+        maxsize=int(os.environ.get("GRAPH_DATA_CACHE_SIZE", 1000)))
+
+# rendered past search pages by search id; PAGE_CACHE_DIR, if set, is shared 
+# by worker processes. A page only changes if a later search over other 
+# windows is linked to it, so entries expire after PAGE_CACHE_TTL seconds.
+PAGE_CACHE_TTL = int(os.environ.get("PAGE_CACHE_TTL", 60 * 60))
+page_cache = PageCache(maxsize=int(os.environ.get("PAGE_CACHE_SIZE", 500)), 
+                       ttl=PAGE_CACHE_TTL, 
+                       directory=os.environ.get("PAGE_CACHE_DIR"))
+
+# the first search id whose pairings retention.py keeps, read again every 
+# RETENTION_CHECK_INTERVAL seconds; earlier searches cannot be shown
+RETENTION_CHECK_INTERVAL = int(os.environ.get("RETENTION_CHECK_INTERVAL", 60))
+retention_cache = LRUCache(maxsize=1, ttl=RETENTION_CHECK_INTERVAL)
+
+# the rendered recent searches page; cleared when a search is stored
+RECENT_CACHE_TTL = int(os.environ.get("RECENT_CACHE_TTL", 30))
+recent_page_cache = PageCache(maxsize=1, ttl=RECENT_CACHE_TTL)
+
+metrics.CallbackCounter("food_trends_cache_lookups_total", 
+        "Cache lookups by cache and result.", "lookup", 
+        lambda: list(annotation_cache.stats().items()) + 
+                list(db.term_cache.stats().items()) + 
+                list(db.url_filter.stats().items()) + 
+                list(page_cache.stats().items()) + 
+                [("graph_data_hits", graph_data_cache.hits), 
+                 ("graph_data_misses", graph_data_cache.misses)])
+
+metrics.CallbackCounter("food_trends_results_total", 
+        "Blog posts of stored searches, by whether their results record "
+        "was inserted or skipped as a duplicate.", "outcome", 
+        lambda: db.result_counts().items())
+
+
+def use_database(db_uri):
+    """Use the database at db_uri from now on.
+
+    Everything cached from the old database is dropped: term ids, URLs, 
+    annotations, pages, chart data, co-occurrence counts and known terms.
+    """
+    global pairing_graph, term_matcher
+    if db_uri == db.db_uri:
+        return
+
+    db.configure(db_uri)
+    annotation_cache.memory.clear()
+    page_cache.clear()
+    recent_page_cache.clear()
+    graph_data_cache.clear()
+    retention_cache.clear()
+    pairing_graph = PairingGraph(pairing_graph.refresh_interval, 
+                                 pairing_graph.rebuild_interval)
+    term_matcher = TermMatcher(term_matcher.refresh_interval)
+
+
+if SEARCH_LOCK == "file":
+    search_flight = SingleFlight(FileLock(SEARCH_LOCK_DIR))
+elif SEARCH_LOCK == "postgres":
+    search_flight = SingleFlight(AdvisoryLock(db))
+else:
+    search_flight = SingleFlight(LocalLock())
 
 #####################################################################
-def get_food_terms(input_text, api_key):
+def get_food_terms(input_text, api_key, timeout=None):
     """Get food terms from input text using Spoonacular API.
 
-    Return list of food terms (dupes removed).
+    Return list of food terms (dupes removed). Titles seen before are answered
+    from annotation_cache without calling the API. See ANNOTATION_SOURCE for 
+    finding terms locally instead.
     """
+    if ANNOTATION_SOURCE != "api":
+        term_matcher.refresh_if_stale(db)
+        local_terms = term_matcher.find(input_text)
+        if local_terms or ANNOTATION_SOURCE == "local":
+            return local_terms
+
+    cached_terms = annotation_cache.get(input_text)
+    if cached_terms is not None:
+        return cached_terms
+
     if api_key:
-        endpoint_url = "https://spoonacular-recipe-food-nutrition-v1.p.mashape.com/food/detect"
+        endpoint_url = SPOONACULAR_URL
         payload = {"text": input_text}
         headers = {"X-Mashape-Key": api_key,
                     "Content-Type": "application/x-www-form-urlencoded",
                     "Accept": "application/json"}
-        r = requests.post(endpoint_url, data=payload, headers=headers)
+        spoonacular_limit.acquire()
+        with metrics.timed("spoonacular"):
+            r = http_session.get().post(endpoint_url, data=payload, 
+                                        headers=headers, timeout=timeout)
+            r.raise_for_status()
         
     response_content = json.loads(r.text)
-    return terms_from_response(response_content)
+    if ANNOTATION_RECORD_PATH:
+        record_response(input_text, response_content)
+
+    terms = terms_from_response(response_content)
+    annotation_cache.set(input_text, terms)
+
+    return terms
 
     # MOCK RESPONSE FOR DEV
+    #import mock_spoonacular
     #return mock_spoonacular.mock_get_food_terms(input_text)
 
 
+def record_response(input_text, response_content):
+    """Append a Spoonacular response to ANNOTATION_RECORD_PATH."""
+    line = json.dumps({"text": input_text, 
+                       "annotations": response_content["annotations"]})
+    with open(ANNOTATION_RECORD_PATH, "a") as f:
+        f.write(line + "\n")
+
+
 def terms_from_response(response_content):
     """Extract food terms from response.
 
@@ -57,72 +270,302 @@ def terms_from_response(response_content):
 
 
 #### I HAVE LIMITED ACCESS TO THIS API; USE MOCK FOR DEV
-def find_store_matches(food_term):
+def find_store_matches(food_term, force_refresh=False, search_windows=None):
     """Make call to Twingly Blog Search API. 
 
-    Search blog post TITLES using the food term. Store relevant response
-    information in the database.
+    Search blog post TITLES using the food term, over each of search_windows 
+    (default SEARCH_WINDOWS). Store relevant response information in the 
+    database. A search for the same term made in the last SEARCH_TTL seconds 
+    is reused instead, unless force_refresh is set.
     """
+    search_id = run_window_searches(food_term, 
+                                    search_windows or SEARCH_WINDOWS, 
+                                    force_refresh)
+
+    # want to access search id in several routes
+    session["search_id"] = search_id
+
+
+def run_window_searches(food_term, search_windows, force_refresh=False, 
+                                                            progress=None):
+    """Search blogs for food term over several windows at once.
+
+    The searches over the other windows are linked to the first window's 
+    search, whose progress is reported to progress if given (see 
+    run_search). Return the first window's search id.
+    """
+    if len(search_windows) == 1:
+        return run_search(food_term, force_refresh, progress, 
+                                            search_window=search_windows[0])
+
+    with ThreadPoolExecutor(max_workers=len(search_windows)) as executor:
+        search_ids = list(executor.map(
+                lambda search_window: run_search(food_term, force_refresh, 
+                        progress if search_window == search_windows[0] 
+                                                                else None, 
+                        search_window=search_window), 
+                search_windows))
+
+    if db.link_searches(search_ids[0], search_ids[1:]):
+        page_cache.pop(search_ids[0])
+    return search_ids[0]
+
+
+def run_search(food_term, force_refresh=False, progress=None, 
+                                                search_window=SEARCH_WINDOW):
+    """Search blogs for food term and store the results; return search id.
+
+    Concurrent calls for the same term and window share one search. 
+    progress, if given, is called with (posts annotated, total posts) as 
+    titles are annotated.
+    """
+    requested_at = datetime.utcnow()
+    key = "{}|{}".format(food_term.lower(), search_window)
+
+    return search_flight.do(key, lambda: search_or_reuse(food_term, 
+                                                            force_refresh, 
+                                                            requested_at, 
+                                                            progress, 
+                                                            search_window))
+
+
+def search_or_reuse(food_term, force_refresh, requested_at, progress=None, 
+                                                search_window=SEARCH_WINDOW):
+    """Return the id of a usable stored search, or make a new search."""
+    # a search finished by another process while this one waited to run
+    waited = (datetime.utcnow() - requested_at).total_seconds()
+    max_age = waited if force_refresh else max(SEARCH_TTL, waited)
+
+    search_id = db.fresh_search_id(food_term, search_window, max_age)
+    if search_id is not None:
+        return search_id
+
     # real API call
-    q = build_twingly_query(food_term, "tspan:w")
-    client = Client()
-    results = client.execute_query(q)
+    pages = fetch_result_pages(food_term, search_window)
 
     # # FAKE API CALL
-    # results = mock_twingly.mock_api_call()
+    # import mock_twingly
+    # pages = [mock_twingly.mock_api_call()]
 
-    term_id = db.new_food_term_record(food_term)
-    search_id = db.new_search_record(term_id, 
-                                        results.number_of_matches_total, 
-                                        results.number_of_matches_returned)
-    process_blog_results(results, search_id, food_term)
+    other_terms_dict, num_matches_total, result_rows = process_blog_results(
+                                                pages, food_term, progress)
+    return build_pairs(food_term, num_matches_total, result_rows, 
+                                    other_terms_dict, search_window)
 
-    # want to access search id in several routes
-    session["search_id"] = search_id
 
+def enqueue_search(food_term, force_refresh=False, search_windows=None):
+    """Queue a search to be run by a background worker; return the job id.
 
-def build_twingly_query(food_term, search_window):
-    """Build query string for Twingly Blog Search API."""
-    return (food_term + " fields:title lang:en page-size:20 sort:created " + 
-            search_window)
+    The job searches over each of search_windows (default SEARCH_WINDOWS), 
+    as find_store_matches does.
+    """
+    return db.new_job_record(food_term, force_refresh, 
+                             search_windows or SEARCH_WINDOWS)
 
 
-def process_blog_results(results, search_id, search_term):
-    """Put desired data from blog search results into database."""
+def get_job(job_id):
+    """Retrieve the search job record associated with job_id."""
+    return db.job_by_id(job_id)
+
+
+def run_job(job):
+    """Run a queued search job and record its search id."""
+    job_id = job[0]
+
+    def progress(posts_done, posts_total):
+        db.update_job_progress(job_id, posts_done, posts_total)
+
+    # jobs queued before windows were recorded search the default ones
+    search_windows = job[3].split(",") if job[3] else SEARCH_WINDOWS
+    search_id = run_window_searches(job[1], search_windows, job[2], progress)
+    db.finish_job(job_id, search_id)
 
-    # want to keep the search term separate from other food terms
-    other_terms_dict = {}
 
-    for post in results.posts:
-        db.new_results_record(post, search_id)
-        post_title = post.title
+def build_twingly_query(food_term, search_window, page=1, 
+                                            page_size=TWINGLY_PAGE_SIZE):
+    """Build query string for Twingly Blog Search API."""
+    q = (food_term + " fields:title lang:en page-size:" + str(page_size) + 
+            " sort:created " + search_window)
+    if page > 1:
+        q += " page:" + str(page)
+    return q
 
-        other_terms = get_food_terms(post_title, MASHAPE_KEY)
 
-        # clean so that search term is not in other_terms
-        if search_term in other_terms:
-            other_terms.remove(search_term)
+def execute_twingly_query(q):
+    """Make one call to Twingly Blog Search API; return its Result."""
+    client = twingly_client.get()
+    twingly_limit.acquire()
+    with metrics.timed("twingly"):
+        return client.execute_query(q)
 
-        for term in other_terms:
-            if search_term in term:
-                other_terms.remove(term)
-            elif term in other_terms_dict.keys():
-                other_terms_dict[term] += 1
-            else:
-                other_terms_dict[term] = 1
 
-    if other_terms_dict != {}:
-        build_pairs(search_term, search_id, other_terms_dict)
+def fetch_result_pages(food_term, search_window):
+    """Yield pages of Twingly results for food term as they arrive.
 
+    The first page tells how many posts match; up to TWINGLY_PAGES pages are 
+    then fetched concurrently. Only TWINGLY_FETCH_WORKERS pages are requested 
+    or waiting to be used at a time, so memory does not grow with depth.
+    """
+    first_page = execute_twingly_query(build_twingly_query(food_term, 
+                                                           search_window))
+    yield first_page
+
+    num_pages = min(TWINGLY_PAGES, 
+                    -(-first_page.number_of_matches_total // TWINGLY_PAGE_SIZE))
+    if num_pages < 2:
+        return
+
+    page_numbers = iter(range(2, num_pages + 1))
+    with ThreadPoolExecutor(max_workers=TWINGLY_FETCH_WORKERS) as executor:
+        pending = set()
+
+        def request_next_page():
+            page = next(page_numbers, None)
+            if page is not None:
+                pending.add(executor.submit(execute_twingly_query, 
+                        build_twingly_query(food_term, search_window, page)))
+
+        for _ in range(TWINGLY_FETCH_WORKERS):
+            request_next_page()
+
+        while pending:
+            future = next(as_completed(pending))
+            pending.remove(future)
+            request_next_page()
+            yield future.result()
+
+
+def process_blog_results(pages, search_term, progress=None):
+    """Count the other food terms found in blog search result titles.
+
+    Takes an iterable of Twingly result pages and annotates each page's 
+    titles as it arrives. Return a tuple of
+        - a dictionary of food term and number of titles it appeared in:
+            {"food_term": occurences, ..., "food_term_n": occurences}
+        - the number of posts matching the search in total
+        - a (publish date, index date, url) tuple per post looked at
+    """
+
+    # want to keep the search term separate from other food terms
+    other_terms_dict = {}
+    num_matches_total = 0
+    result_rows = []
+
+    for results in pages:
+        if not result_rows:
+            num_matches_total = results.number_of_matches_total
+            posts_expected = min(TWINGLY_PAGES * TWINGLY_PAGE_SIZE, 
+                                 num_matches_total)
+
+        num_done = len(result_rows)
+        if progress:
+            page_progress = lambda done, _: progress(num_done + done, 
+                                                     posts_expected)
+        else:
+            page_progress = None
+
+        post_titles = [post.title for post in results.posts]
+        for other_terms in annotate_titles(post_titles, 
+                                           progress=page_progress):
+
+            # clean so that search term is not in other_terms
+            if search_term in other_terms:
+                other_terms.remove(search_term)
+
+            for term in other_terms:
+                if search_term in term:
+                    other_terms.remove(term)
+                elif term in other_terms_dict.keys():
+                    other_terms_dict[term] += 1
+                else:
+                    other_terms_dict[term] = 1
+
+        # keep only what gets stored, not the whole post
+        result_rows.extend((post.published_at, post.indexed_at, post.url) 
+                                                for post in results.posts)
+
+    return other_terms_dict, num_matches_total, result_rows
+
+
+@metrics.timed("annotate")
+def annotate_titles(post_titles, mode=None, progress=None):
+    """Get the food terms for each blog post title.
+
+    Return a list of food term lists in the same order as post_titles. In 
+    "concurrent" mode the Spoonacular calls are spread over a thread pool of 
+    ANNOTATION_WORKERS; "serial" makes them one after another. progress, if 
+    given, is called with (titles done, total titles) after each title.
+    """
+    mode = mode or ANNOTATION_MODE
+    num_titles = len(post_titles)
+
+    if mode == "serial" or num_titles < 2:
+        annotated = []
+        for title in post_titles:
+            annotated.append(annotate_title(title))
+            if progress:
+                progress(len(annotated), num_titles)
+        return annotated
+
+    num_workers = max(1, min(ANNOTATION_WORKERS, num_titles))
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(annotate_title, title) 
+                                                for title in post_titles]
+        if progress:
+            for num_done, _ in enumerate(as_completed(futures), 1):
+                progress(num_done, num_titles)
+
+        # keep results in input order
+        return [future.result() for future in futures]
+
+
+def annotate_title(post_title):
+    """Get the food terms for one title; a failed call yields no terms."""
+    try:
+        return get_food_terms(post_title, MASHAPE_KEY, 
+                                timeout=ANNOTATION_TIMEOUT)
+    # ValueError and KeyError from a response that is not the JSON expected
+    except (requests.RequestException, ValueError, KeyError) as error:
+        print("Could not annotate {!r}: {}".format(post_title, error))
+        return []
+
+
+def build_pairs(search_term, num_matches_total, result_rows, 
+                                other_terms_dict, search_window=SEARCH_WINDOW):
+    """Create pairings and put them in the database with the search.
+
+    The search record, its results and pairings are written in a single 
+    transaction; the number of posts looked at is stored as 
+    num_matches_returned. Return the id of the new search record.
+    """
+    return store_searches([(search_term, num_matches_total, result_rows, 
+                            other_terms_dict, search_window)])[0]
 
-def build_pairs(search_term, search_id, other_terms_dict):
-    """Create pairings and put each in database."""
-    search_term_id = db.id_by_term(search_term)
 
-    for other_term, count in other_terms_dict.items():
-        other_term_id = db.new_food_term_record(other_term)
-        db.new_pairings_record(search_term_id, other_term_id, 
-                                                    search_id, count)
+def store_searches(processed_searches):
+    """Put several searches in the database in a single transaction.
+
+    Takes a list of (search_term, num_matches_total, result_rows, 
+    other_terms_dict, search_window). Return the new search ids, in order.
+    """
+    search_ids = db.ingest_searches([(search_term, 
+                                      num_matches_total, 
+                                      len(result_rows), 
+                                      result_rows, 
+                                      other_terms_dict, 
+                                      search_window) 
+                                     for (search_term, num_matches_total, 
+                                          result_rows, other_terms_dict, 
+                                          search_window) in processed_searches])
+
+    # new terms are known locally without waiting for a refresh
+    for search_term, _, _, other_terms_dict, _ in processed_searches:
+        term_matcher.add_terms([search_term] + list(other_terms_dict))
+    recent_page_cache.clear()
+
+    if pairing_graph.last_refresh is not None:
+        pairing_graph.refresh(db)
+    return search_ids
 
 
 def get_search_record(search_id):
@@ -135,6 +578,11 @@ def get_search_term(term_id):
     return db.term_by_id(term_id)
 
 
+def get_search_terms(term_ids):
+    """Retrieve the search terms of many ids as a dictionary of id to term."""
+    return db.terms_by_ids(term_ids)
+
+
 def get_pairings(search_id):
     """Retrieve all pairings associated with a given search id.
 
@@ -142,12 +590,8 @@ def get_pairings(search_id):
     it occured in the search:
         {"food_term": occurences, ..., "food_term_n": occurences}
     """
-    pairings = db.pairings_by_search(search_id)
-
     pairings_dict = {}
-    for pairing in pairings:
-        pairing_term = db.term_by_id(pairing[2])
-        occurences = pairing[4]
+    for pairing_term, occurences in db.pairings_with_terms(search_id):
         pairings_dict[pairing_term] = occurences
 
     return pairings_dict
@@ -156,11 +600,13 @@ def get_pairings(search_id):
 def gather_results(search_id):
     """Gather information for displaying search results."""
     search_record = get_search_record(search_id)
-    timestamp, srch_term_id = search_record[1], search_record[3]
+    timestamp, search_window = search_record[1], search_record[2]
+    srch_term_id = search_record[3]
     num_matches_total, num_matches_returned = search_record[4], search_record[5]
 
     srch_term = get_search_term(srch_term_id)
-    srch_term_pop = calcs.get_srch_term_popularity(num_matches_total)
+    srch_term_pop = calcs.get_srch_term_popularity(num_matches_total, 
+                                                    search_window)
 
     pairings_dict = get_pairings(search_id)
     pairings = calcs.get_pairing_popularities(pairings_dict, 
@@ -169,20 +615,166 @@ def gather_results(search_id):
     return srch_term, timestamp, pairings, srch_term_pop
 
 
+def gather_window_results(search_id):
+    """Gather pairing popularities of search_id and its linked searches.
+
+    Return (windows, rows) as follows, shortest window first:
+        [(search_window, window length in days, srch_term_pop), ...]
+        [(food_term, [popularity per window], trend), ...]
+    or ([], []) if no searches are linked to search_id.
+    """
+    linked = db.linked_searches(search_id)
+    if not linked:
+        return [], []
+
+    search_record = get_search_record(search_id)
+    linked.append((search_record[0], search_record[2]))
+    linked.sort(key=lambda record: calcs.WINDOW_DAYS[record[1]])
+
+    windows = []
+    window_pairings = []
+    for linked_id, search_window in linked:
+        srch_term, timestamp, pairings, srch_term_pop = gather_results(
+                                                                linked_id)
+        windows.append((search_window, calcs.WINDOW_DAYS[search_window], 
+                                                            srch_term_pop))
+        window_pairings.append((search_window, pairings))
+
+    return windows, calcs.compare_windows(window_pairings)
+
+
+def is_compacted(search_id):
+    """Return whether retention.py has removed the pairings of search_id.
+
+    If so, its page and chart data are dropped from the caches, which 
+    would otherwise go on serving them.
+    """
+    kept_from = retention_cache.get("pairings")
+    if kept_from is None:
+        kept_from = db.kept_from("pairings") or 0
+        retention_cache.set("pairings", kept_from)
+
+    if search_id >= kept_from:
+        return False
+    page_cache.pop(search_id)
+    graph_data_cache.pop(search_id)
+    return True
+
+
+def get_graph_data(search_id):
+    """Get the bubble chart data of a search as JSON text and its ETag.
+
+    Return (None, None) if there is no such search.
+    """
+    cached = graph_data_cache.get(search_id)
+    if cached is not None:
+        return cached
+
+    search_record = get_search_record(search_id)
+    if not search_record:
+        return None, None
+
+    pairings = calcs.get_pairing_popularities(get_pairings(search_id), 
+                                              search_record[5])
+    data = json.dumps(formatting.format_pairings(pairings), sort_keys=True)
+    etag = hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+    graph_data_cache.set(search_id, (data, etag))
+    return data, etag
+
+
+def get_partners(food_term, k=10, score="count"):
+    """Find the foods most often paired with food_term over all searches.
+
+    Return a list of (partner term, count, lift, pmi), best first by score 
+    ("count", "lift" or "pmi"), or None if food_term is not a known term.
+    """
+    pairing_graph.refresh_if_stale(db)
+
+    term_id = db.id_by_term(food_term.lower())
+    if term_id is None:
+        return None
+
+    top = pairing_graph.top_partners(term_id, k, score, PAIRING_MIN_COUNT)
+    terms = get_search_terms([row[0] for row in top])
+    return [(terms[partner_id], count, lift, pmi) 
+            for partner_id, count, lift, pmi in top]
+
+
+def get_trends(food_term, k=10, days=None):
+    """Find the pairings of food_term growing fastest over its searches.
+
+    Only searches over SEARCH_WINDOW are compared, the last `days` days of 
+    them if given. Return (timestamps, rising) with rising a list of 
+    (partner term, growth per day, mean popularity, searches seen, rolling 
+    mean popularity per search), fastest first, or None if food_term has 
+    never been searched for.
+    """
+    # imported when first needed, as most processes never analyse trends
+    import trends
+
+    term_id = db.id_by_term(food_term.lower())
+    if term_id is None:
+        return None
+    history = trends.load_histories(db, [term_id], SEARCH_WINDOW).get(term_id)
+    if history is None:
+        return None
+
+    rolling = history.rolling_mean(TREND_ROLLING_DAYS)
+    top = history.rising(k, days, TREND_MIN_SEARCHES)
+    terms = get_search_terms([row[0] for row in top])
+    rising = [(terms[partner_id], growth, mean, seen, 
+               rolling[:, history.index_of(partner_id)].tolist())
+              for partner_id, growth, mean, seen in top]
+
+    return history.timestamps.tolist(), rising
+
+
+def get_top_pairings(food_term, days=30, k=10):
+    """Find the foods paired most with food_term in the last `days` days.
+
+    Only searches over SEARCH_WINDOW are counted. Return a list of (partner 
+    term, occurences, searches, [(day, occurences), ...]), most occurences 
+    first, or None if food_term is not a known term.
+    """
+    term_id = db.id_by_term(food_term.lower())
+    if term_id is None:
+        return None
+
+    since = datetime.utcnow() - timedelta(days=days)
+    top = db.top_pairings_since(term_id, SEARCH_WINDOW, since, k)
+    if not top:
+        return []
+
+    daily = {}
+    for day, partner_id, occurences, num_searches in db.daily_pairing_totals(
+                term_id, SEARCH_WINDOW, since, [row[0] for row in top]):
+        daily.setdefault(partner_id, []).append((day, occurences))
+
+    terms = get_search_terms([row[0] for row in top])
+    return [(terms[partner_id], occurences, num_searches, 
+             daily.get(partner_id, [])) 
+            for partner_id, occurences, num_searches in top]
+
+
 def search_summaries():
     """Get a list containing recent search summaries."""
-    records = db.recent_n_searches(10)
+    records = db.recent_searches_with_terms(10)
     # # FOR DEMO HARD CODED
     # records = []
     # records.append(db.recent_n_searches(1)[0])
     # for desired_search_id in [109, 110, 129, 140, 128, 
     #                             132, 138, 130, 100]:
     #     records.append(db.demo_search_record_by_id(desired_search_id))
-    return build_summary_info(records)
+    previews = db.top_pairing_terms([record[0] for record in records], 3)
+    return build_summary_info(records, previews)
 
 
-def build_summary_info(records):
+def build_summary_info(records, previews):
     """Build a list containing search record summaries.
+
+    Takes (search_id, timestamp, food term) records and a dictionary of 
+    search_id to preview terms.
     
     Return a list as follows:
         [(foodterm1, search_id, searchdate, [previews]), 
@@ -191,20 +783,13 @@ def build_summary_info(records):
     """
     summaries = []
     for record in records:
-        previews = get_previews(record[0])
-        summaries.append((db.term_by_id(record[2]), 
-                                        record[0], 
-                                        record[1].strftime("%m-%d-%y"), 
-                                        previews))
+        summaries.append((record[2], 
+                          record[0], 
+                          record[1].strftime("%m-%d-%y"), 
+                          previews.get(record[0], [])))
     return summaries
 
 
 def get_previews(search_id):
-    """Get the first 3 pairing foods associated with food_id."""
-    records = db.pairings_by_search(search_id)
-    all_pairing_terms = [db.term_by_id(record[2]) for record in records]
-
-    if len(all_pairing_terms) >= 3:
-        return all_pairing_terms[:3]
-    else:
-        return all_pairing_terms[:len(all_pairing_terms)]
+    """Get the first 3 pairing foods associated with search_id."""
+    return db.top_pairing_terms([search_id], 3)[search_id]
@@ -10,102 +10,785 @@ resource - the Engine is most efficient when created just once at the module
 level of an application, not per-object or per-function call.'
 """
 
-from datetime import datetime
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
-from sqlalchemy import create_engine, MetaData, desc
-from sqlalchemy.sql import select
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import create_engine, event, func, MetaData, desc, cast, Date
+from sqlalchemy.sql import select, union_all, literal, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
+import metrics
+import rollups
+from cache import TermCache, URLFilter
+from create_tables import metadata
+from process_local import ProcessLocal
 
+
+# e.g. "FOR VALUES FROM ('1') TO ('5001')"
+PARTITION_BOUND = re.compile(r"FROM \('?(-?\d+)'?\) TO \('?(-?\d+)'?\)")
+
+
+class FetchedResult():
+    """Rows of a query result, already fetched from the database."""
+
+    def __init__(self, rows):
+        self.rowcount = len(rows)
+        self._rows = iter(rows)
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def __iter__(self):
+        return self._rows
+
+
+@metrics.instrument_methods("db")
 class DBConnector():
     """Handles database interactions with Flask app."""
 
-    def __init__(self, db_uri):
-        self.engine = create_engine(db_uri, echo=False)
+    def __init__(self, db_uri, term_cache_size=50000, url_filter_size=100000):
+        self.db_uri = db_uri
+
+        # made on first use in each process, so pooled connections are 
+        # never shared with forked workers
+        self._engine = ProcessLocal(self._make_engine)
+
+        # table definitions live in create_tables; no catalog queries needed
+        self.meta = metadata
+
+        # food terms never change once created, so they are safe to keep
+        self.term_cache = TermCache(maxsize=term_cache_size)
+
+        # URLs of results stored lately; most repeats are skipped without 
+        # asking the database
+        self.url_filter = URLFilter(capacity=url_filter_size)
+        self._result_counts = {"inserted": 0, "duplicate": 0, "filtered": 0}
+        self._counts_lock = threading.Lock()
+
+        # number of statements sent to the database, for tests and benchmarks
+        self.query_count = 0
+
+    @property
+    def engine(self):
+        return self._engine.get()
+
+    def _make_engine(self):
+        engine = create_engine(self.db_uri, echo=False)
+        event.listen(engine, "before_cursor_execute", self._count_query)
         print("Connected to DB.")
-        self.meta = None
+        return engine
+
+    def _count_query(self, *args):
+        self.query_count += 1
+
+    def configure(self, db_uri):
+        """Use the database at db_uri from now on.
+
+        Term ids and URLs cached from the old database are forgotten; ids 
+        of one database mean other terms, or none, in another.
+        """
+        if db_uri == self.db_uri:
+            return
+
+        engine = self._engine.peek()
+        if engine is not None:
+            engine.dispose()
+        self.db_uri = db_uri
+        self._engine = ProcessLocal(self._make_engine)
+
+        self.term_cache.clear()
+        self.url_filter.clear()
 
     def reflect(self):
-        """Load table information from the database."""
+        """Reload table information from the database.
+
+        Only needed if the schema was changed outside of create_tables.
+        """
         meta = MetaData()
         meta.reflect(bind=self.engine)
 
         # want to be able to access tables through instance attr
         self.meta = meta
 
+    def check_schema(self):
+        """Compare the database against the create_tables definitions.
+
+        Return a list of problems found (empty if the schema matches).
+        """
+        db_meta = MetaData()
+        db_meta.reflect(bind=self.engine)
+
+        problems = []
+        for name, table in metadata.tables.items():
+            if name not in db_meta.tables:
+                problems.append("missing table {}".format(name))
+                continue
+
+            db_columns = db_meta.tables[name].c.keys()
+            for column in table.c.keys():
+                if column not in db_columns:
+                    problems.append("missing column {}.{}".format(name, 
+                                                                  column))
+
+        return problems
+
     def execute(self, statement):
-        """Wrapper to execute a SQL construct."""
+        """Wrapper to execute a SQL construct.
+
+        Rows are fetched before the connection goes back to the pool, so 
+        another thread cannot pick it up while they are being read.
+        """
         with self.engine.connect() as conn:
-            return conn.execute(statement)
+            result = conn.execute(statement)
+            if result.returns_rows:
+                return FetchedResult(result.fetchall())
+            return result
+
+    def ingest_search(self, search_term, num_matches_total, 
+                        num_matches_returned, result_rows, other_terms_dict, 
+                        search_window="tspan:w"):
+        """Store a whole search in one transaction.
+
+        Writes the search record, a results record per (publish_date, 
+        index_date, url) in result_rows whose URL is not stored yet, any new 
+        food terms and a pairing per other term. Nothing is written if any 
+        statement fails. Return the id of the new search record.
+        """
+        return self.ingest_searches([(search_term, num_matches_total, 
+                                      num_matches_returned, result_rows, 
+                                      other_terms_dict, search_window)])[0]
 
-    def new_search_record(self, term_id, num_matches_total, 
-                                            num_matches_returned):
-        """Make a new search record in the database.
+    def ingest_searches(self, searches_to_store):
+        """Store many searches in one transaction.
 
-        Return the id of the newly inserted record.
+        Takes a list of (search_term, num_matches_total, num_matches_returned, 
+        result_rows, other_terms_dict, search_window), stored as by 
+        ingest_search. Food terms are resolved, and results and pairings 
+        inserted, once for the whole batch. Results are counted in 
+        result_counts. Return the new search ids, in order.
         """
         searches = self.meta.tables["searches"]
-        ins = searches.insert().values(user_timestamp=datetime.utcnow(), 
-                                   search_window="tspan:w", 
-                                   food_id=term_id, 
-                                   num_matches_total=num_matches_total,
-                                   num_matches_returned=num_matches_returned)
-        result = self.execute(ins)
-        return result.inserted_primary_key[0]
+        pairings = self.meta.tables["pairings"]
 
-    def new_food_term_record(self, food_term):
-        """Make a new record in the food_terms table.
+        all_terms = set()
+        for search_term, _, _, _, other_terms_dict, _ in searches_to_store:
+            all_terms.add(search_term)
+            all_terms.update(other_terms_dict)
+
+        search_ids = []
+        result_records = []
+        seen_urls = set()
+        filtered = 0
+        pairing_rows = []
+        daily = {}
+        weekly = {}
+        with self.engine.begin() as conn:
+            term_ids = self._resolve_terms(conn, all_terms)
+
+            for (search_term, num_matches_total, num_matches_returned, 
+                    result_rows, other_terms_dict, 
+                    search_window) in searches_to_store:
+                search_term_id = term_ids[search_term.lower()]
+                user_timestamp = datetime.utcnow()
 
-        Return the id of the newly inserted record.
+                ins = searches.insert().values(
+                                    user_timestamp=user_timestamp, 
+                                    search_window=search_window, 
+                                    food_id=search_term_id, 
+                                    num_matches_total=num_matches_total, 
+                                    num_matches_returned=num_matches_returned)
+                search_id = conn.execute(ins).inserted_primary_key[0]
+                search_ids.append(search_id)
+
+                for publish_date, index_date, url in result_rows:
+                    if url in seen_urls:
+                        continue
+                    seen_urls.add(url)
+                    if url in self.url_filter:
+                        filtered += 1
+                        continue
+                    result_records.append((publish_date, index_date, url, 
+                                           search_id))
+
+                pairing_rows.extend({"food_id1": search_term_id, 
+                                     "food_id2": term_ids[other_term.lower()], 
+                                     "search_id": search_id, 
+                                     "occurences": count} 
+                            for other_term, count in other_terms_dict.items())
+
+                day = user_timestamp.date()
+                for other_term, count in other_terms_dict.items():
+                    for totals, period_start in ((daily, day), 
+                                        (weekly, rollups.week_start(day))):
+                        key = (search_term_id, search_window, period_start, 
+                               term_ids[other_term.lower()])
+                        occurences, num_searches = totals.get(key, (0, 0))
+                        totals[key] = (occurences + count, num_searches + 1)
+
+            inserted = self._insert_results(conn, result_records)
+            if pairing_rows:
+                conn.execute(pairings.insert(), pairing_rows)
+                self._add_to_rollups(conn, "pairing_rollups_daily", daily)
+                self._add_to_rollups(conn, "pairing_rollups_weekly", weekly)
+
+        # only cache ids and URLs once they are committed
+        self.term_cache.update(term_ids)
+        self.url_filter.update(record[2] for record in result_records)
+        self._count_results(inserted, 
+                            sum(len(search[3]) for search in searches_to_store) - 
+                            inserted - filtered, 
+                            filtered)
+        return search_ids
+
+    def _insert_results(self, conn, result_records):
+        """Insert (publish_date, index_date, url, search_id) results records.
+
+        Records whose URL is stored already are skipped, in the same single 
+        statement; the unique index on url decides. Return the number 
+        inserted.
         """
-        self.reflect()
-        food_terms = self.meta.tables['food_terms']
-        ins = food_terms.insert().values(term=food_term.lower())
+        if not result_records:
+            return 0
 
-        # want to execute statment then get food term's id
-        try:
-            result = self.execute(ins)
-            term_id = result.inserted_primary_key[0]
-        except IntegrityError:
-            # sqlalchemy wraps psycopg2.IntegrityError with its own exception
-            print("This food term is already in the table.")
-            term_id = self.id_by_term(food_term=food_term.lower())
+        return conn.execute(text(
+            "INSERT INTO results (publish_date, index_date, url, search_id) "
+            "SELECT * FROM unnest(CAST(:publish_dates AS timestamp[]), "
+            "CAST(:index_dates AS timestamp[]), CAST(:urls AS varchar[]), "
+            "CAST(:search_ids AS bigint[])) "
+            "ON CONFLICT (url) DO NOTHING"), 
+            publish_dates=[record[0] for record in result_records], 
+            index_dates=[record[1] for record in result_records], 
+            urls=[record[2] for record in result_records], 
+            search_ids=[record[3] for record in result_records]).rowcount
 
-        return term_id
+    def _count_results(self, inserted, duplicate, filtered):
+        with self._counts_lock:
+            self._result_counts["inserted"] += inserted
+            self._result_counts["duplicate"] += duplicate
+            self._result_counts["filtered"] += filtered
 
-    def new_results_record(self, post, search_id):
-        """Make a new record in the results table.
+    def result_counts(self):
+        """Count the results records offered since this connector was made.
+
+        Return a dictionary: inserted were stored; duplicate were skipped by 
+        the database, their URL being stored already, or repeated within a 
+        batch; filtered were skipped by url_filter before reaching it.
+        """
+        with self._counts_lock:
+            return dict(self._result_counts)
+
+    def insert_results(self, result_rows, search_id):
+        """Store (publish_date, index_date, url) results of a search.
 
-        Fields to include: publish_date, index_date, url, search_id.
+        Posts whose URL is stored already are skipped. Return the number of 
+        (inserted, skipped) posts.
         """
-        publish_date, index_date = post.published_at, post.indexed_at
-        post_url = post.url
-        results = self.meta.tables["results"]
+        records = []
+        seen_urls = set()
+        for publish_date, index_date, url in result_rows:
+            if url not in seen_urls and url not in self.url_filter:
+                seen_urls.add(url)
+                records.append((publish_date, index_date, url, search_id))
 
-        selection = select([results]).where(results.c.url == post_url)
-        result = self.execute(selection)
+        with self.engine.begin() as conn:
+            inserted = self._insert_results(conn, records)
+
+        self.url_filter.update(record[2] for record in records)
+        self._count_results(inserted, len(records) - inserted, 
+                            len(result_rows) - len(records))
+        return inserted, len(result_rows) - inserted
+
+    def _add_to_rollups(self, conn, table_name, totals):
+        """Add (occurences, num_searches) totals by key to a rollup table.
+
+        Rows are upserted in key order, so concurrent searches lock them in 
+        the same order and cannot deadlock. They are sent as one array per 
+        column: the statement is the same whatever the number of rows, so 
+        it is cheap to build, unlike a multi-row VALUES list.
+        """
+        keys = sorted(totals)
+        conn.execute(text(
+            "INSERT INTO {0} (food_id1, search_window, period_start, "
+            "food_id2, occurences, num_searches) "
+            "SELECT * FROM unnest(:food_id1s, :search_windows, "
+            "CAST(:period_starts AS date[]), :food_id2s, :occurences, "
+            "CAST(:num_searches AS integer[])) "
+            "ON CONFLICT (food_id1, search_window, period_start, food_id2) "
+            "DO UPDATE SET occurences = {0}.occurences + excluded.occurences, "
+            "num_searches = {0}.num_searches + excluded.num_searches".format(
+                                                                table_name)), 
+            food_id1s=[key[0] for key in keys], 
+            search_windows=[key[1] for key in keys], 
+            period_starts=[key[2] for key in keys], 
+            food_id2s=[key[3] for key in keys], 
+            occurences=[totals[key][0] for key in keys], 
+            num_searches=[totals[key][1] for key in keys])
 
-        # do not want redundant URLs in table
-        if result:
-            ins = results.insert().values(publish_date=publish_date, 
-                                           index_date=index_date, 
-                                           url=post_url, 
-                                           search_id=search_id)
-            self.execute(ins)
+    def rebuild_rollups(self, start, end):
+        """Recompute the rollups of searches from start up to end (dates).
 
-    def new_pairings_record(self, search_term_id, other_term_id, 
-                                                search_id, count):
-        """Make a new record in the pairings table."""
+        start and end should be Mondays, so whole weeks are rebuilt. Return 
+        the number of (daily, weekly) rollup rows written.
+        """
+        searches = self.meta.tables["searches"]
         pairings = self.meta.tables["pairings"]
-        ins = pairings.insert().values(food_id1=search_term_id, 
-                                   food_id2=other_term_id, 
-                                   search_id=search_id, 
-                                   occurences=count)
+
+        written = []
+        with self.engine.begin() as conn:
+            # searches being stored wait here before adding to the rollups: 
+            # those committed already are counted below, the rest are added 
+            # to the rebuilt rows once this commits
+            conn.execute("LOCK TABLE pairing_rollups_daily, "
+                         "pairing_rollups_weekly IN EXCLUSIVE MODE")
+
+            for table_name, period in (("pairing_rollups_daily", "day"), 
+                                       ("pairing_rollups_weekly", "week")):
+                rollup = self.meta.tables[table_name]
+                conn.execute(rollup.delete().where(
+                                    rollup.c.period_start >= start).where(
+                                    rollup.c.period_start < end))
+
+                period_start = cast(func.date_trunc(period, 
+                                            searches.c.user_timestamp), Date)
+                selection = select([pairings.c.food_id1, 
+                                    searches.c.search_window, 
+                                    period_start, 
+                                    pairings.c.food_id2, 
+                                    func.sum(pairings.c.occurences), 
+                                    func.count()]).select_from(
+                        pairings.join(searches, 
+                                      pairings.c.search_id == searches.c.id)).where(
+                        searches.c.user_timestamp >= start).where(
+                        searches.c.user_timestamp < end).group_by(
+                        pairings.c.food_id1, searches.c.search_window, 
+                        period_start, pairings.c.food_id2)
+
+                written.append(conn.execute(rollup.insert().from_select(
+                        ["food_id1", "search_window", "period_start", 
+                         "food_id2", "occurences", "num_searches"], 
+                        selection)).rowcount)
+
+        return tuple(written)
+
+    def first_search_time(self):
+        """Return the time of the oldest search (None if there are none)."""
+        searches = self.meta.tables["searches"]
+        return self.execute(select([func.min(
+                                searches.c.user_timestamp)])).fetchone()[0]
+
+    def first_search_id_since(self, since):
+        """Return the id of the first search made since a time.
+
+        If none were, return the id the next search will get. None if there 
+        are no searches.
+        """
+        searches = self.meta.tables["searches"]
+        first_id, last_id = self.execute(select([
+                func.min(searches.c.id).filter(
+                                    searches.c.user_timestamp >= since), 
+                func.max(searches.c.id)])).fetchone()
+        if last_id is None:
+            return None
+        return first_id if first_id is not None else last_id + 1
+
+    def pairing_partitions(self):
+        """List the partitions of the pairings table.
+
+        Return (table name, first search id, search id after the last) for 
+        each, lowest first; both ids are None for the default partition.
+        """
+        rows = self.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass('pairings')")
+
+        partitions = []
+        for name, bound in rows:
+            match = PARTITION_BOUND.search(bound)
+            if match:
+                partitions.append((name, int(match.group(1)), 
+                                   int(match.group(2))))
+            else:
+                partitions.append((name, None, None))
+
+        return sorted(partitions, key=lambda partition: (
+                            partition[1] is None, partition[1] or 0))
+
+    def add_pairing_partition(self, start_id, end_id, lock_timeout="2s"):
+        """Add a partition for pairings of searches start_id to end_id - 1.
+
+        The table is made first and then attached, which only briefly locks 
+        pairings against schema changes; writes carry on. Waiting longer 
+        than lock_timeout for a lock raises OperationalError.
+        """
+        name = "pairings_p{}_{}".format(start_id, end_id)
+        with self.engine.begin() as conn:
+            conn.execute("SET LOCAL lock_timeout = '{}'".format(lock_timeout))
+            conn.execute("CREATE TABLE {} (LIKE pairings INCLUDING DEFAULTS "
+                         "INCLUDING CONSTRAINTS INCLUDING INDEXES)".format(name))
+            conn.execute("ALTER TABLE pairings ATTACH PARTITION {} "
+                         "FOR VALUES FROM ({}) TO ({})".format(
+                                                name, start_id, end_id))
+        return name
+
+    def drop_pairing_partition(self, name, lock_timeout="2s"):
+        """Detach and drop a partition of pairings in one transaction.
+
+        Waiting longer than lock_timeout for a lock raises OperationalError 
+        and leaves the partition in place.
+        """
+        with self.engine.begin() as conn:
+            conn.execute("SET LOCAL lock_timeout = '{}'".format(lock_timeout))
+            conn.execute("ALTER TABLE pairings DETACH PARTITION {}".format(name))
+            conn.execute("DROP TABLE {}".format(name))
+
+    def copy_pairings(self, table_name, f, end_id=None):
+        """Write pairings in table_name to file f as CSV with a header.
+
+        Only those of searches before end_id, if given.
+        """
+        query = "SELECT * FROM {}".format(table_name)
+        if end_id is not None:
+            query += " WHERE search_id < {:d}".format(end_id)
+
+        conn = self.engine.raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.copy_expert("COPY ({}) TO STDOUT WITH CSV HEADER".format(
+                                                                    query), f)
+        finally:
+            conn.close()
+
+    def pairings_missing_from_rollups(self, table_name, end_id):
+        """Count pairing totals in table_name not yet in the daily rollups.
+
+        Pairings of searches before end_id are summed by (searched term, 
+        search window, day, partner); each total should be in the daily 
+        rollup, which may also count searches stored elsewhere. Return how 
+        many are not.
+        """
+        return self.execute(text(
+            "SELECT count(*) FROM ("
+            "SELECT p.food_id1, s.search_window, "
+            "CAST(s.user_timestamp AS date) AS period_start, p.food_id2, "
+            "sum(p.occurences) AS occurences, count(*) AS num_searches "
+            "FROM {} p JOIN searches s ON s.id = p.search_id "
+            "WHERE p.search_id < :end_id "
+            "GROUP BY 1, 2, 3, 4) raw "
+            "LEFT JOIN pairing_rollups_daily r USING (food_id1, search_window, "
+            "period_start, food_id2) "
+            "WHERE r.occurences IS NULL OR r.occurences < raw.occurences "
+            "OR r.num_searches < raw.num_searches".format(table_name)).bindparams(
+                                        end_id=end_id)).fetchone()[0]
+
+    def has_rows_before(self, table_name, end_id):
+        """Check if table_name has rows of searches before end_id."""
+        return self.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM {} WHERE search_id < :end_id)".format(
+                            table_name)).bindparams(end_id=end_id)).fetchone()[0]
+
+    def delete_old_rows(self, table_name, end_id, batch_size):
+        """Delete up to batch_size rows of searches before end_id.
+
+        table_name is results or a partition of pairings. Return the number 
+        of rows deleted.
+        """
+        return self.execute(text(
+            "DELETE FROM {0} WHERE ctid IN (SELECT ctid FROM {0} "
+            "WHERE search_id < :end_id LIMIT :batch_size)".format(
+                                                            table_name)).bindparams(
+                                end_id=end_id, batch_size=batch_size)).rowcount
+
+    def vacuum(self, table_name):
+        """Make the space of deleted rows in table_name reusable.
+
+        Writes to the table carry on meanwhile.
+        """
+        # VACUUM cannot run inside a transaction
+        with self.engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(
+                                            "VACUUM ANALYZE " + table_name)
+
+    def mark_retention(self, table_name, kept_from_search_id):
+        """Record that table_name keeps only rows of later searches."""
+        marks = self.meta.tables["retention_marks"]
+        ins = pg_insert(marks).values(table_name=table_name, 
+                                      kept_from_search_id=kept_from_search_id, 
+                                      updated_at=datetime.utcnow())
+        ins = ins.on_conflict_do_update(
+                    index_elements=[marks.c.table_name], 
+                    set_={"kept_from_search_id": func.greatest(
+                                        marks.c.kept_from_search_id, 
+                                        ins.excluded.kept_from_search_id), 
+                          "updated_at": ins.excluded.updated_at})
         self.execute(ins)
 
+    def kept_from(self, table_name):
+        """Return the first search id whose rows table_name still keeps.
+
+        None if retention.py has not removed any.
+        """
+        marks = self.meta.tables["retention_marks"]
+        row = self.execute(select([marks.c.kept_from_search_id]).where(
+                                marks.c.table_name == table_name)).fetchone()
+        return row[0] if row else None
+
+    def removed_until(self, table_name):
+        """Return the time of the newest search whose rows were removed.
+
+        That is, the newest search table_name no longer keeps rows of since 
+        retention.py ran; None if there is none.
+        """
+        marks = self.meta.tables["retention_marks"]
+        searches = self.meta.tables["searches"]
+        kept_from = select([marks.c.kept_from_search_id]).where(
+                            marks.c.table_name == table_name).as_scalar()
+        return self.execute(select([func.max(
+                            searches.c.user_timestamp)]).where(
+                            searches.c.id < kept_from)).fetchone()[0]
+
+    @contextmanager
+    def advisory_lock(self, key):
+        """Hold a session advisory lock while in the block, if it is free.
+
+        Yield whether it was taken; if not, another process holds it.
+        """
+        with self.engine.connect() as conn:
+            locked = conn.execute(select([
+                            func.pg_try_advisory_lock(key)])).scalar()
+            try:
+                yield locked
+            finally:
+                if locked:
+                    conn.execute(select([func.pg_advisory_unlock(key)]))
+
+    def _pairing_spans(self, term_id, search_window, since, use_weeks, 
+                                                    partner_ids=None):
+        """Select term_id's pairings since a time, from rollups if possible.
+
+        Rows are (day, partner id, occurences, searches); day is None for 
+        rows from the weekly rollup.
+        """
+        searches = self.meta.tables["searches"]
+        pairings = self.meta.tables["pairings"]
+
+        parts = []
+        for source, start, end in rollups.plan_spans(since, datetime.utcnow(), 
+                                                     use_weeks):
+            if source == "raw":
+                part = select([cast(searches.c.user_timestamp, Date), 
+                               pairings.c.food_id2, 
+                               pairings.c.occurences, 
+                               literal(1)]).select_from(
+                        pairings.join(searches, 
+                                      pairings.c.search_id == searches.c.id)).where(
+                        searches.c.food_id == term_id).where(
+                        searches.c.search_window == search_window).where(
+                        searches.c.user_timestamp >= start)
+                if end is not None:
+                    part = part.where(searches.c.user_timestamp < end)
+                partner_column = pairings.c.food_id2
+            else:
+                rollup = self.meta.tables["pairing_rollups_daily" 
+                            if source == "day" else "pairing_rollups_weekly"]
+                part = select([rollup.c.period_start if source == "day" 
+                                    else literal(None, Date), 
+                               rollup.c.food_id2, 
+                               rollup.c.occurences, 
+                               rollup.c.num_searches]).where(
+                        rollup.c.food_id1 == term_id).where(
+                        rollup.c.search_window == search_window).where(
+                        rollup.c.period_start >= start).where(
+                        rollup.c.period_start < end)
+                partner_column = rollup.c.food_id2
+
+            if partner_ids is not None:
+                part = part.where(partner_column.in_(partner_ids))
+            parts.append(part)
+
+        return union_all(*parts).alias("spans")
+
+    def top_pairings_since(self, term_id, search_window, since, limit):
+        """Sum the pairings of term_id's searches since a time.
+
+        Only searches over search_window are counted. Return up to limit 
+        (partner id, occurences, searches) rows, most occurences first. 
+        Whole weeks and days are read from the rollups.
+        """
+        spans = self._pairing_spans(term_id, search_window, since, True)
+        partner_id, occurences, num_searches = list(spans.c)[1:]
+        selection = select([partner_id, 
+                            func.sum(occurences).label("occurences"), 
+                            func.sum(num_searches)]).group_by(
+                partner_id).order_by(desc("occurences"), 
+                                     partner_id).limit(limit)
+
+        return [(partner, int(total), int(count)) 
+                for partner, total, count in self.execute(selection)]
+
+    def daily_pairing_totals(self, term_id, search_window, since, 
+                                                    partner_ids=None):
+        """Sum the pairings of term_id's searches over search_window by day.
+
+        Return (day, partner id, occurences, searches) rows since a time, 
+        oldest day first, for the given partners only if partner_ids is 
+        given. Whole days are read from the daily rollup.
+        """
+        spans = self._pairing_spans(term_id, search_window, since, False, 
+                                    partner_ids)
+        day, partner_id, occurences, num_searches = spans.c
+        selection = select([day, partner_id, func.sum(occurences), 
+                            func.sum(num_searches)]).group_by(
+                day, partner_id).order_by(day, partner_id)
+
+        return [(row_day, partner, int(total), int(count)) 
+                for row_day, partner, total, count in self.execute(selection)]
+
+    def ids_for_terms(self, food_terms):
+        """Get the ids of many food terms, making records for new ones.
+
+        Return a dictionary of (lowercased) term to id.
+        """
+        with self.engine.begin() as conn:
+            term_ids = self._resolve_terms(conn, food_terms)
+
+        self.term_cache.update(term_ids)
+        return term_ids
+
+    def _resolve_terms(self, conn, food_terms):
+        """Look up term ids in the cache, upserting the rest using conn."""
+        term_ids = {}
+        missing = set()
+        for term in {food_term.lower() for food_term in food_terms}:
+            term_id = self.term_cache.id_for(term)
+            if term_id is None:
+                missing.add(term)
+            else:
+                term_ids[term] = term_id
+
+        if missing:
+            term_ids.update(self._upsert_terms(conn, missing))
+
+        return term_ids
+
+    def _upsert_terms(self, conn, terms):
+        """Make food_terms records for any new terms using conn.
+
+        A single statement inserts the new terms and returns the ids of both 
+        new and existing ones. Return a dictionary of term to id.
+        """
+        food_terms = self.meta.tables["food_terms"]
+
+        inserted = pg_insert(food_terms).values(
+                                    [{"term": term} for term in terms])
+        inserted = inserted.on_conflict_do_nothing(
+                        index_elements=[food_terms.c.term]).returning(
+                        food_terms.c.term, food_terms.c.id).cte("inserted")
+        existing = select([food_terms.c.term, food_terms.c.id]).where(
+                                                food_terms.c.term.in_(terms))
+        term_ids = dict(conn.execute(union_all(
+                select([inserted.c.term, inserted.c.id]), existing)).fetchall())
+
+        # a term committed by a concurrent search after this statement began 
+        # is neither inserted nor visible to it
+        if len(term_ids) < len(terms):
+            term_ids.update(conn.execute(existing).fetchall())
+
+        return term_ids
+
+    def warm_term_cache(self):
+        """Load the most recently created food terms into the term cache."""
+        food_terms = self.meta.tables["food_terms"]
+        selection = select([food_terms.c.term, food_terms.c.id]).order_by(
+                desc(food_terms.c.id)).limit(self.term_cache.maxsize)
+
+        self.term_cache.update(dict(self.execute(selection).fetchall()))
+
+    def terms_since(self, last_id):
+        """Retrieve (id, term) of food terms with ids above last_id."""
+        food_terms = self.meta.tables["food_terms"]
+        selection = select([food_terms.c.id, food_terms.c.term]).where(
+                            food_terms.c.id > last_id).order_by(food_terms.c.id)
+
+        return self.execute(selection).fetchall()
+
+    def pairing_counts_since(self, last_id):
+        """Total occurences per (food_id1, food_id2) of newer pairings.
+
+        Only pairing records with ids above last_id are counted. Return the 
+        rows and the largest pairing id seen (None if there are none).
+        """
+        pairings = self.meta.tables["pairings"]
+        selection = select([pairings.c.food_id1, pairings.c.food_id2, 
+                            func.sum(pairings.c.occurences), 
+                            func.max(pairings.c.pairing_id)]).where(
+                pairings.c.pairing_id > last_id).group_by(
+                pairings.c.food_id1, pairings.c.food_id2)
+
+        rows = []
+        max_id = None
+        for food_id1, food_id2, occurences, group_max_id in self.execute(selection):
+            rows.append((food_id1, food_id2, int(occurences)))
+            if max_id is None or group_max_id > max_id:
+                max_id = group_max_id
+
+        return rows, max_id
+
+    def pairing_history(self, term_ids, search_window=None):
+        """Retrieve the pairings of every search for the given term ids.
+
+        Return (food_id, search_id, user_timestamp, num_matches_returned,
+        partner_id, occurences) rows ordered by food_id, then user_timestamp
+        and search_id. A search without pairings gets one row with a
+        partner_id and occurences of 0. Searches whose pairings retention.py 
+        removed are left out.
+        """
+        searches = self.meta.tables["searches"]
+        pairings = self.meta.tables["pairings"]
+        marks = self.meta.tables["retention_marks"]
+        kept_from = select([marks.c.kept_from_search_id]).where(
+                                    marks.c.table_name == "pairings").as_scalar()
+        selection = select([searches.c.food_id,
+                            searches.c.id,
+                            searches.c.user_timestamp,
+                            searches.c.num_matches_returned,
+                            func.coalesce(pairings.c.food_id2, 0),
+                            func.coalesce(pairings.c.occurences, 0)]).select_from(
+                searches.outerjoin(pairings,
+                                   pairings.c.search_id == searches.c.id)).where(
+                searches.c.food_id.in_(term_ids)).where(
+                searches.c.id >= func.coalesce(kept_from, 0)).order_by(
+                searches.c.food_id, searches.c.user_timestamp, searches.c.id)
+        if search_window is not None:
+            selection = selection.where(
+                                searches.c.search_window == search_window)
+
+        return self.execute(selection).fetchall()
+
+    def new_food_term_record(self, food_term):
+        """Make a new record in the food_terms table if needed.
+
+        Return the id of the food term's record.
+        """
+        return self.ids_for_terms([food_term])[food_term.lower()]
+
+    def new_results_record(self, post, search_id):
+        """Make a new record in the results table, unless the URL has one.
+
+        Return whether it was made.
+        """
+        inserted, _ = self.insert_results([(post.published_at, 
+                                            post.indexed_at, post.url)], 
+                                          search_id)
+        return inserted == 1
+
     def search_record_by_id(self, search_id):
         """Retrieve the search record associated with search_id."""
-        self.reflect()
         searches = self.meta.tables["searches"]
         selection = select([searches]).where(searches.c.id == search_id)
         
@@ -118,27 +801,101 @@ class DBConnector():
         
         return self.execute(selection).fetchall()
 
+    def pairings_with_terms(self, search_id):
+        """Retrieve (pairing term, occurences) for pairings of search_id.
+
+        Ordered by occurences, most first.
+        """
+        pairings = self.meta.tables["pairings"]
+        food_terms = self.meta.tables["food_terms"]
+        selection = select([food_terms.c.term, pairings.c.occurences]).select_from(
+                pairings.join(food_terms, pairings.c.food_id2 == food_terms.c.id)).where(
+                pairings.c.search_id == search_id).order_by(
+                desc(pairings.c.occurences), pairings.c.pairing_id)
+
+        return self.execute(selection).fetchall()
+
+    def top_pairing_terms(self, search_ids, num_terms):
+        """Retrieve the num_terms most common pairing terms of each search.
+
+        Return a dictionary of search id to list of terms, most common first.
+        """
+        pairings = self.meta.tables["pairings"]
+        food_terms = self.meta.tables["food_terms"]
+
+        # rank each search's pairings, then keep the top few of each
+        rank = func.row_number().over(partition_by=pairings.c.search_id, 
+                        order_by=[desc(pairings.c.occurences), 
+                                  pairings.c.pairing_id]).label("rank")
+        ranked = select([pairings.c.search_id, pairings.c.food_id2, rank]).where(
+                            pairings.c.search_id.in_(search_ids)).alias("ranked")
+        selection = select([ranked.c.search_id, food_terms.c.term]).select_from(
+                ranked.join(food_terms, ranked.c.food_id2 == food_terms.c.id)).where(
+                ranked.c.rank <= num_terms).order_by(ranked.c.search_id, ranked.c.rank)
+
+        top_terms = {search_id: [] for search_id in search_ids}
+        for search_id, term in self.execute(selection):
+            top_terms[search_id].append(term)
+
+        return top_terms
+
     def term_by_id(self, term_id):
         """Retrieve food term using its id."""
+        term = self.term_cache.term_for(term_id)
+        if term is not None:
+            return term
+
         food_terms = self.meta.tables["food_terms"]
         selection = select([food_terms]).where(food_terms.c.id == term_id)
-        
-        return self.execute(selection).fetchone()[1]
+        record = self.execute(selection).fetchone()
+        self.term_cache.add(record[1], record[0])
+
+        return record[1]
+
+    def terms_by_ids(self, term_ids):
+        """Retrieve many food terms by id, in one query for those not cached.
+
+        Return a dictionary of id to term.
+        """
+        terms = {}
+        missing = set()
+        for term_id in term_ids:
+            term = self.term_cache.term_for(term_id)
+            if term is None:
+                missing.add(term_id)
+            else:
+                terms[term_id] = term
+
+        if missing:
+            food_terms = self.meta.tables["food_terms"]
+            selection = select([food_terms.c.term, food_terms.c.id]).where(
+                                                food_terms.c.id.in_(missing))
+            found = dict(self.execute(selection).fetchall())
+            self.term_cache.update(found)
+            terms.update((term_id, term) for term, term_id in found.items())
+
+        return terms
 
     def id_by_term(self, food_term):
-        """Retrieve a food term's id by the term itself."""
+        """Retrieve a food term's id by the term itself (None if unknown)."""
+        term_id = self.term_cache.id_for(food_term)
+        if term_id is not None:
+            return term_id
+
         food_terms = self.meta.tables["food_terms"]
         selection = select([food_terms]).where(food_terms.c.term == food_term)
-        result = self.execute(selection)
+        record = self.execute(selection).fetchone()
+        if record is None:
+            return None
+        self.term_cache.add(record[1], record[0])
 
-        return result.fetchone()[0]
+        return record[0]
 
     def recent_n_searches(self, num_searches):
         """Return search records for the n most recent searches searches.
 
         Information included: id, user_timestamp, food_id
         """
-        self.reflect()
         searches = self.meta.tables["searches"]
 
         selection = select([searches.c.id, 
@@ -147,12 +904,221 @@ class DBConnector():
 
         return self.execute(selection).fetchall()
 
+    def recent_searches_with_terms(self, num_searches):
+        """Return the n most recent searches with their search terms.
+
+        Information included: id, user_timestamp, term
+        """
+        searches = self.meta.tables["searches"]
+        food_terms = self.meta.tables["food_terms"]
+
+        selection = select([searches.c.id, 
+                            searches.c.user_timestamp, 
+                            food_terms.c.term]).select_from(
+                searches.join(food_terms, searches.c.food_id == food_terms.c.id)).order_by(
+                desc(searches.c.id)).limit(num_searches)
+
+        return self.execute(selection).fetchall()
+
+    def fresh_search_id(self, food_term, search_window, max_age):
+        """Find the latest search for food_term no older than max_age seconds.
+
+        Return its id, or None if there is no such search.
+        """
+        searches = self.meta.tables["searches"]
+        food_terms = self.meta.tables["food_terms"]
+        cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+
+        selection = select([searches.c.id]).select_from(
+                searches.join(food_terms, searches.c.food_id == food_terms.c.id)).where(
+                (food_terms.c.term == food_term.lower()) & 
+                (searches.c.search_window == search_window) & 
+                (searches.c.user_timestamp >= cutoff)).order_by(
+                desc(searches.c.user_timestamp)).limit(1)
+        record = self.execute(selection).fetchone()
+
+        return record[0] if record else None
+
+    def link_searches(self, search_id, linked_ids):
+        """Record searches over other windows as linked to search_id.
+
+        Return the number of new links.
+        """
+        linked_ids = [linked_id for linked_id in linked_ids 
+                                        if linked_id != search_id]
+        if not linked_ids:
+            return 0
+
+        search_links = self.meta.tables["search_links"]
+        return self.execute(pg_insert(search_links).values(
+                [{"search_id": search_id, "linked_id": linked_id} 
+                        for linked_id in linked_ids]).on_conflict_do_nothing()).rowcount
+
+    def linked_searches(self, search_id):
+        """Retrieve (id, search_window) of searches linked to search_id.
+
+        Only the latest linked search over each window is returned.
+        """
+        searches = self.meta.tables["searches"]
+        search_links = self.meta.tables["search_links"]
+        selection = select([searches.c.id, searches.c.search_window]).select_from(
+                search_links.join(searches, search_links.c.linked_id == searches.c.id)).where(
+                search_links.c.search_id == search_id).order_by(
+                desc(searches.c.id))
+
+        latest = {}
+        for linked_id, search_window in self.execute(selection):
+            latest.setdefault(search_window, linked_id)
+
+        return [(linked_id, search_window) for search_window, linked_id 
+                                                        in latest.items()]
+
     def demo_search_record_by_id(self, search_id):
         """Retrieve the search record associated with search_id."""
-        self.reflect()
         searches = self.meta.tables["searches"]
         selection = select([searches.c.id, 
                             searches.c.user_timestamp, 
                             searches.c.food_id]).where(searches.c.id == search_id)
         
-        return self.execute(selection).fetchone()
\ No newline at end of file
+        return self.execute(selection).fetchone()
+
+    def new_job_record(self, food_term, force_refresh=False, 
+                                                    search_windows=None):
+        """Queue a search job; return the id of the new job record.
+
+        search_windows is a list of windows to search over, if not the 
+        default ones.
+        """
+        jobs = self.meta.tables["jobs"]
+        now = datetime.utcnow()
+        ins = jobs.insert().values(food_term=food_term, 
+                                   force_refresh=force_refresh, 
+                                   search_windows=",".join(search_windows) 
+                                                if search_windows else None, 
+                                   status="queued", 
+                                   created_at=now, 
+                                   updated_at=now)
+
+        return self.execute(ins).inserted_primary_key[0]
+
+    def claim_job(self):
+        """Mark the oldest queued job as running and return its record.
+
+        Information included: id, food_term, force_refresh, search_windows. 
+        Uses SKIP LOCKED so several workers never claim the same job. Return 
+        None if no job is queued.
+        """
+        jobs = self.meta.tables["jobs"]
+        selection = select([jobs.c.id]).where(jobs.c.status == "queued").order_by(
+                        jobs.c.id).limit(1).with_for_update(skip_locked=True)
+
+        with self.engine.begin() as conn:
+            record = conn.execute(selection).fetchone()
+            if record is None:
+                return None
+
+            update = jobs.update().where(jobs.c.id == record[0]).values(
+                            status="running", updated_at=datetime.utcnow())
+            conn.execute(update)
+
+            return conn.execute(select([jobs.c.id, 
+                                        jobs.c.food_term, 
+                                        jobs.c.force_refresh, 
+                                        jobs.c.search_windows]).where(
+                                        jobs.c.id == record[0])).fetchone()
+
+    def update_job_progress(self, job_id, posts_done, posts_total):
+        """Record how many posts of a running job have been annotated."""
+        jobs = self.meta.tables["jobs"]
+        self.execute(jobs.update().where(jobs.c.id == job_id).values(
+                                posts_done=posts_done, 
+                                posts_total=posts_total, 
+                                updated_at=datetime.utcnow()))
+
+    def finish_job(self, job_id, search_id):
+        """Mark a job as done with the id of its search."""
+        jobs = self.meta.tables["jobs"]
+        self.execute(jobs.update().where(jobs.c.id == job_id).values(
+                                status="done", 
+                                search_id=search_id, 
+                                updated_at=datetime.utcnow()))
+
+    def fail_job(self, job_id, error):
+        """Mark a job as failed with a description of the error."""
+        jobs = self.meta.tables["jobs"]
+        self.execute(jobs.update().where(jobs.c.id == job_id).values(
+                                status="failed", 
+                                error=error, 
+                                updated_at=datetime.utcnow()))
+
+    def requeue_stale_jobs(self, max_age):
+        """Queue again running jobs not updated for max_age seconds.
+
+        These were left behind by a worker that died. Return how many.
+        """
+        jobs = self.meta.tables["jobs"]
+        cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+        update = jobs.update().where((jobs.c.status == "running") & 
+                                     (jobs.c.updated_at < cutoff)).values(
+                        status="queued", updated_at=datetime.utcnow())
+
+        return self.execute(update).rowcount
+
+    def job_by_id(self, job_id):
+        """Retrieve the job record associated with job_id.
+
+        Information included: id, food_term, status, search_id, posts_done, 
+        posts_total, error
+        """
+        jobs = self.meta.tables["jobs"]
+        selection = select([jobs.c.id, 
+                            jobs.c.food_term, 
+                            jobs.c.status, 
+                            jobs.c.search_id, 
+                            jobs.c.posts_done, 
+                            jobs.c.posts_total, 
+                            jobs.c.error]).where(jobs.c.id == job_id)
+
+        return self.execute(selection).fetchone()
+
+    def annotation_by_hash(self, title_hash, max_age=None):
+        """Retrieve the cached annotation for a hashed blog post title.
+
+        Records older than max_age seconds are ignored.
+        """
+        annotations = self.meta.tables["annotations"]
+        selection = select([annotations]).where(
+                                    annotations.c.title_hash == title_hash)
+        if max_age is not None:
+            cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+            selection = selection.where(annotations.c.created_at >= cutoff)
+
+        return self.execute(selection).fetchone()
+
+    def new_annotation_record(self, title_hash, terms_json):
+        """Make or refresh a record in the annotations table."""
+        annotations = self.meta.tables["annotations"]
+        ins = pg_insert(annotations).values(title_hash=title_hash, 
+                                            terms=terms_json, 
+                                            created_at=datetime.utcnow())
+        ins = ins.on_conflict_do_update(
+                        index_elements=[annotations.c.title_hash], 
+                        set_={"terms": ins.excluded.terms, 
+                              "created_at": ins.excluded.created_at})
+        self.execute(ins)
+
+    def evict_annotations(self, max_age, max_rows):
+        """Delete expired annotations and trim the table to max_rows."""
+        annotations = self.meta.tables["annotations"]
+        cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+        self.execute(annotations.delete().where(
+                                        annotations.c.created_at < cutoff))
+
+        # keep only the newest max_rows records: find the newest one past 
+        # them with the created_at index, then delete it and those older
+        row = self.execute(select([annotations.c.created_at]).order_by(
+                                desc(annotations.c.created_at)).offset(
+                                                max_rows).limit(1)).fetchone()
+        if row is not None:
+            self.execute(annotations.delete().where(
+                                        annotations.c.created_at <= row[0]))
\ No newline at end of file
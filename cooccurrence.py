@@ -0,0 +1,166 @@
+"""Which foods go together, across every stored search.
+
+Each pairing record says two food terms were in the same blog post titles
+some number of times. PairingGraph adds these up over all searches into a
+symmetric sparse co-occurrence matrix, kept as a dict of partner counts per
+term id, so "what goes with burrata?" can be answered from memory even if
+burrata was never searched for itself.
+
+Partners are ranked by raw count, by lift or by PMI (pointwise mutual
+information, the log2 of lift):
+
+    lift(a, b) = count(a, b) * total / (count(a) * count(b))
+
+where count(a) is the sum of a's row and total the sum of the matrix. Lift
+above 1 means a and b appear together more often than their popularity
+alone would suggest. Lift and PMI favor rare pairs, so partners seen fewer
+than min_count times are left out of those rankings.
+"""
+
+import heapq
+import math
+import threading
+import time
+
+
+SCORES = ("count", "lift", "pmi")
+
+
+class PairingGraph():
+    """Co-occurrence counts between food term ids, updated incrementally."""
+
+    def __init__(self, refresh_interval=60, rebuild_interval=60 * 60):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.last_id = 0
+        self.last_refresh = None
+        self.last_rebuild = None
+        self.total = 0
+        self._partners = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+        # one refresh at a time, so no rows are added twice
+        self._refresh_lock = threading.Lock()
+        self._rebuilding = None
+
+    def add_pairings(self, rows):
+        """Add (food_id1, food_id2, occurences) rows to the counts."""
+        with self._lock:
+            for food_id1, food_id2, occurences in rows:
+                if food_id1 == food_id2 or not occurences:
+                    continue
+                for term_id, partner_id in ((food_id1, food_id2),
+                                            (food_id2, food_id1)):
+                    partners = self._partners.setdefault(term_id, {})
+                    partners[partner_id] = partners.get(partner_id,
+                                                        0) + occurences
+                    self._counts[term_id] = self._counts.get(term_id,
+                                                             0) + occurences
+                self.total += 2 * occurences
+
+    def refresh(self, db):
+        """Add pairings stored since the last refresh."""
+        with self._refresh_lock:
+            rows, max_id = db.pairing_counts_since(self.last_id)
+            self.add_pairings(rows)
+            if max_id is not None:
+                self.last_id = max(self.last_id, max_id)
+            self.last_refresh = time.time()
+
+    def rebuild(self, db):
+        """Reload every pairing.
+
+        Picks up pairings a refresh missed because they were committed out
+        of id order by concurrent searches.
+        """
+        with self._refresh_lock:
+            fresh = PairingGraph(self.refresh_interval, self.rebuild_interval)
+            fresh.refresh(db)
+            with self._lock:
+                self._partners, self._counts = fresh._partners, fresh._counts
+                self.total, self.last_id = fresh.total, fresh.last_id
+            self.last_refresh = self.last_rebuild = time.time()
+
+    def rebuild_in_background(self, db):
+        """Rebuild in a thread, unless one already is; return the thread."""
+        with self._lock:
+            if self._rebuilding is None or not self._rebuilding.is_alive():
+                self._rebuilding = threading.Thread(target=self._rebuild, 
+                                                    args=(db,), daemon=True)
+                self._rebuilding.start()
+            return self._rebuilding
+
+    def _rebuild(self, db):
+        try:
+            self.rebuild(db)
+        except Exception as error:
+            # tried again on the next call to refresh_if_stale
+            print("Could not rebuild pairing graph: {!r}".format(error))
+
+    def refresh_if_stale(self, db):
+        """Rebuild or refresh if their intervals have passed.
+
+        Only the first rebuild is waited for; later ones run in the 
+        background while the current counts are served.
+        """
+        now = time.time()
+        if self.last_rebuild is None:
+            self.rebuild_in_background(db).join()
+        elif now - self.last_rebuild > self.rebuild_interval:
+            self.rebuild_in_background(db)
+        elif now - self.last_refresh > self.refresh_interval:
+            self.refresh(db)
+
+    def count(self, term_id, partner_id):
+        """Return how often two terms were seen together."""
+        return self._partners.get(term_id, {}).get(partner_id, 0)
+
+    def lift(self, term_id, partner_id):
+        """Return the lift of a pair (0 if never seen together)."""
+        pair_count = self.count(term_id, partner_id)
+        if not pair_count:
+            return 0.0
+        return pair_count * self.total / (self._counts[term_id] *
+                                          self._counts[partner_id])
+
+    def top_partners(self, term_id, k=10, score="count", min_count=2):
+        """Return the k best partners of term_id, best first.
+
+        Each is (partner_id, count, lift, pmi); score picks the ranking.
+        """
+        if score not in SCORES:
+            raise ValueError("score must be one of {}".format(SCORES))
+
+        with self._lock:
+            partners = self._partners.get(term_id)
+            if not partners:
+                return []
+
+            if score == "count":
+                best = heapq.nlargest(k, partners.items(),
+                                      key=lambda item: (item[1], -item[0]))
+            else:
+                # PMI ranks the same as lift; for a fixed term, lift goes 
+                # with count(a, b) / count(b)
+                counts = self._counts
+                best = heapq.nlargest(k,
+                        ((partner_id, pair_count) for partner_id, pair_count
+                         in partners.items() if pair_count >= min_count),
+                        key=lambda item: (item[1] / counts[item[0]],
+                                          -item[0]))
+
+            ranked = []
+            for partner_id, pair_count in best:
+                lift = pair_count * self.total / (self._counts[term_id] *
+                                                  self._counts[partner_id])
+                ranked.append((partner_id, pair_count, lift, math.log2(lift)))
+
+        return ranked
+
+    @property
+    def num_terms(self):
+        return len(self._partners)
+
+    @property
+    def num_pairs(self):
+        return sum(len(partners) for partners in self._partners.values()) // 2
@@ -3,9 +3,9 @@
 Run directly to create (empty) tables from scratch.
 """
 
-from sqlalchemy import create_engine
-from sqlalchemy import Table, Column, MetaData, ForeignKey
-from sqlalchemy import Integer, String, BigInteger, DateTime
+from sqlalchemy import create_engine, event, DDL
+from sqlalchemy import Table, Column, MetaData, ForeignKey, Index
+from sqlalchemy import Integer, String, BigInteger, DateTime, Date, Text, Boolean
 
 """
 NOTE TO SELF:
@@ -22,12 +22,24 @@ food_terms = Table("food_terms", metadata,
      Column("id", Integer, primary_key=True, autoincrement=True), 
      Column("term", String(30), nullable=False, unique=True))
 
+# partitioned by ranges of search ids, so pairings of old searches can be 
+# dropped a partition at a time (see retention.py); rows outside every range 
+# go to the default partition
 pairings = Table("pairings", metadata,
      Column("pairing_id", BigInteger, primary_key=True, autoincrement=True),
      Column("food_id1", Integer, ForeignKey("food_terms.id"), nullable=False),
      Column("food_id2", Integer, ForeignKey("food_terms.id"), nullable=False),
-     Column("search_id", BigInteger, ForeignKey("searches.id"), nullable=False), 
-     Column("occurences", Integer, nullable=False))
+     Column("search_id", BigInteger, ForeignKey("searches.id"), 
+                                    primary_key=True, autoincrement=False), 
+     Column("occurences", Integer, nullable=False), 
+     postgresql_partition_by="RANGE (search_id)")
+
+event.listen(pairings, "after_create", 
+     DDL("CREATE TABLE pairings_default PARTITION OF pairings DEFAULT"))
+
+# a search's pairings, most common first (see DBConnector.pairings_with_terms)
+Index("ix_pairings_search_id_occurences", pairings.c.search_id, 
+     pairings.c.occurences.desc())
 
 searches = Table("searches", metadata,
      Column("id", BigInteger, primary_key=True, autoincrement=True),
@@ -37,6 +49,10 @@ searches = Table("searches", metadata,
      Column("num_matches_total", Integer, nullable=False),
      Column("num_matches_returned", Integer, nullable=False))
 
+# finding a recent search for a term (see DBConnector.fresh_search_id)
+Index("ix_searches_food_id_window_timestamp", searches.c.food_id, 
+     searches.c.search_window, searches.c.user_timestamp)
+
 results = Table("results", metadata,
      Column("id", BigInteger, primary_key=True, autoincrement=True),
      Column("publish_date", DateTime, nullable=False),
@@ -44,9 +60,78 @@ results = Table("results", metadata,
      Column("url", String(300), nullable=False),
      Column("search_id", BigInteger, ForeignKey("searches.id"), nullable=False))
 
+# each blog post is stored once
+Index("uq_results_url", results.c.url, unique=True)
+Index("ix_results_search_id", results.c.search_id)
+
+# searches of one term over other windows, made in the same request
+search_links = Table("search_links", metadata,
+     Column("search_id", BigInteger, ForeignKey("searches.id"), 
+                                                       primary_key=True),
+     Column("linked_id", BigInteger, ForeignKey("searches.id"), 
+                                                       primary_key=True))
+
+# pairings summed per searched term (food_id1), search window, partner and 
+# day or week (starting Monday) of the search; kept up to date as searches 
+# are stored (see DBConnector.ingest_searches) and rebuilt by rollups.py
+pairing_rollups_daily = Table("pairing_rollups_daily", metadata,
+     Column("food_id1", Integer, ForeignKey("food_terms.id"), primary_key=True),
+     Column("search_window", String(10), primary_key=True),
+     Column("period_start", Date, primary_key=True),
+     Column("food_id2", Integer, ForeignKey("food_terms.id"), primary_key=True),
+     Column("occurences", BigInteger, nullable=False),
+     Column("num_searches", Integer, nullable=False))
+
+pairing_rollups_weekly = Table("pairing_rollups_weekly", metadata,
+     Column("food_id1", Integer, ForeignKey("food_terms.id"), primary_key=True),
+     Column("search_window", String(10), primary_key=True),
+     Column("period_start", Date, primary_key=True),
+     Column("food_id2", Integer, ForeignKey("food_terms.id"), primary_key=True),
+     Column("occurences", BigInteger, nullable=False),
+     Column("num_searches", Integer, nullable=False))
+
+# searches in a time range, for rebuilding rollups
+Index("ix_searches_user_timestamp", searches.c.user_timestamp)
+
+# searches below kept_from_search_id have had their rows in table_name 
+# removed by retention.py; rollups of their weeks can no longer be rebuilt
+retention_marks = Table("retention_marks", metadata,
+     Column("table_name", String(30), primary_key=True),
+     Column("kept_from_search_id", BigInteger, nullable=False),
+     Column("updated_at", DateTime, nullable=False))
+
+annotations = Table("annotations", metadata,
+     Column("title_hash", String(40), primary_key=True),
+     Column("terms", Text, nullable=False),
+     Column("created_at", DateTime, nullable=False))
+
+# oldest annotations, for eviction
+Index("ix_annotations_created_at", annotations.c.created_at)
+
+# statuses: queued, running, done, failed
+jobs = Table("jobs", metadata,
+     Column("id", BigInteger, primary_key=True, autoincrement=True),
+     Column("food_term", String(30), nullable=False),
+     Column("force_refresh", Boolean, nullable=False, default=False),
+     # comma-separated, e.g. "tspan:w,tspan:24h"; NULL for the default ones
+     Column("search_windows", String(100)),
+     Column("status", String(10), nullable=False),
+     Column("search_id", BigInteger, ForeignKey("searches.id")),
+     Column("posts_done", Integer, nullable=False, default=0),
+     Column("posts_total", Integer, nullable=False, default=0),
+     Column("error", Text),
+     Column("created_at", DateTime, nullable=False),
+     Column("updated_at", DateTime, nullable=False))
+
+# workers claim the oldest queued job
+Index("ix_jobs_status_id", jobs.c.status, jobs.c.id)
+
 
 if __name__ == '__main__':
-     """Create tables if script run directly."""
+     """Create tables if script run directly.
+
+     Use migrations.py to bring an existing database up to date.
+     """
      engine = create_engine("postgresql:///food_trends", echo=True)
 
      ans = input("Are you sure you want to make the tables? (Y/N) ")
@@ -1,35 +1,144 @@
 """
 Food Trends app made with Flask.
 
-This file creates and configures the Flask application instance and connects 
-to the database.
+This file defines the routes and create_app, which makes and configures a 
+Flask application instance. Database connections, API clients and search 
+workers are made on first use in each process, so a pre-fork server can 
+import the app once and fork workers that share none of them.
 """
 
 import os
-import json
+import atexit
+import time
+from datetime import datetime
 
-from flask import Flask, render_template, redirect, request, url_for, flash
-from flask import jsonify, session
+from flask import Flask, Blueprint, render_template, redirect, request
+from flask import url_for, flash, jsonify, session, g, Response
+from flask import current_app
 
 import calls
 import forms
 import metric_calcs as calcs
-import formatting
+import metrics
+from process_local import ProcessLocal
 
 
 APP_KEY = os.environ.get("APP_KEY")
-app = Flask(__name__)
-app.config['SECRET_KEY'] = APP_KEY
+routes = Blueprint("food_trends", __name__)
+
+render_template = metrics.timed("render")(render_template)
+
+
+def start_job_pool():
+    """Start background search workers in this process."""
+    import jobs
+
+    job_pool = jobs.WorkerPool(calls.db, calls.run_job, 
+                                num_workers=calls.SEARCH_WORKERS)
+    job_pool.start()
+    atexit.register(job_pool.stop)
+    return job_pool
+
+
+# searches run in background workers instead of the request; threads do not 
+# survive a fork, so each process starts its own on its first request
+job_pool = ProcessLocal(start_job_pool)
+
+
+def prepare_db():
+    """Check the database schema and warm this process's term cache."""
+    schema_problems = calls.db.check_schema()
+    if schema_problems:
+        raise RuntimeError("Database schema out of date ({}); run "
+                           "migrations.py.".format(", ".join(schema_problems)))
+    calls.db.warm_term_cache()
+    # a full load takes seconds; the first '/goes-with' waits only for 
+    # what is left of it
+    calls.pairing_graph.rebuild_in_background(calls.db)
+    return True
+
+
+# done on the first request in each process, however the app is served; 
+# tried again on the next request if it fails
+db_ready = ProcessLocal(prepare_db)
+
+
+def create_app(config=None):
+    """Make and configure a Flask application instance.
+
+    config overrides settings read from the environment, e.g. DB_PATH.
+    """
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = APP_KEY
+    app.config["DB_PATH"] = calls.DB_PATH
+    app.config.update(config or {})
+
+    if app.config["DB_PATH"] != calls.db.db_uri:
+        calls.use_database(app.config["DB_PATH"])
+        # checked again against the new database
+        db_ready.reset()
+    app.register_blueprint(routes)
+
+    return app
 
 #####################################################################
-@app.route("/", methods=["GET", "POST"])
+@routes.before_app_request
+def start_timing():
+    """Start timing the stages of this request; set up the process first."""
+    g.request_start = time.perf_counter()
+    metrics.begin_request()
+
+    # tests stand in for the database
+    if not current_app.testing:
+        db_ready.get()
+    if calls.SEARCH_MODE == "job":
+        job_pool.get()
+
+
+@routes.after_app_request
+def add_server_timing(response):
+    """Report this request's stage timings in a Server-Timing header."""
+    timings = metrics.end_request()
+    timings["total"] = time.perf_counter() - g.request_start
+    metrics.STAGE_SECONDS.observe("request", timings["total"])
+    response.headers["Server-Timing"] = metrics.server_timing(timings)
+
+    return response
+
+
+def cached_page(entry, max_age):
+    """Respond with a cached page, or 304 if the client's copy is current."""
+    body, etag, last_modified = entry
+    response = Response(body, mimetype="text/html")
+    response.set_etag(etag)
+    response.last_modified = datetime.utcfromtimestamp(last_modified)
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+
+    return response.make_conditional(request)
+
+
+def compacted_search():
+    """Tell the user a past search's results were removed by retention."""
+    flash("That search is too old to show; its results have been removed.")
+    return render_template("index.html", form=forms.QueryForm()), 410
+
+
+@routes.route("/metrics")
+def get_metrics():
+    """Expose timings and counters in Prometheus text format."""
+    return Response(metrics.render(), 
+                    mimetype="text/plain; version=0.0.4")
+
+
+@routes.route("/", methods=["GET", "POST"])
 def index():
     """Display landing page with search form."""
     form = forms.QueryForm(request.form)
 
     if form.validate_on_submit():
         query = form.user_query.data
-        return redirect(url_for("get_final_term", srch_query=query))
+        return redirect(url_for(".get_final_term", srch_query=query))
         
     if form.errors:
         for error in form.errors.get("user_query", []):
@@ -38,7 +147,7 @@ def index():
     return render_template("index.html", form=form)
 
 
-@app.route("/verify-term", methods=["GET", "POST"])
+@routes.route("/verify-term", methods=["GET", "POST"])
 def get_final_term():
     """Get the final search term from the user query."""
     query = request.args.get("srch_query")
@@ -51,80 +160,241 @@ def get_final_term():
                                 results=parsed_terms)
     elif len(parsed_terms) < 1:
         flash("Please enter a food or ingredient.")
-        return redirect(url_for("index"))
+        return redirect(url_for(".index"))
     else:
-        return redirect(url_for("search_blogs", choice=parsed_terms[0]))
+        return redirect(url_for(".search_blogs", choice=parsed_terms[0]))
 
 
-@app.route("/search", methods=["GET", "POST"])
+@routes.route("/search", methods=["GET", "POST"])
 def search_blogs():
     """Do blog search with final search term."""
     if request.method == "GET":
         final_term = request.args.get("choice")
+        refresh = request.args.get("refresh")
+        windows = request.args.get("windows")
     else:
         final_term = request.form.get("choice")
+        refresh = request.form.get("refresh")
+        windows = request.form.get("windows")
+
+    # e.g. "refresh=1"; "0", "false" and other values do not force a search
+    force_refresh = (refresh or "").lower() in ("1", "true", "on", "y", "yes")
+
+    # e.g. "tspan:24h,tspan:w,tspan:m"
+    search_windows = [window for window in (windows or "").split(",") 
+                                                                if window]
+    unknown = [window for window in search_windows 
+                                        if window not in calcs.WINDOW_DAYS]
+    if unknown:
+        flash("Unknown search window: {}.".format(", ".join(unknown)))
+        return redirect(url_for(".index"))
+
+    if calls.SEARCH_MODE == "job":
+        job_id = calls.enqueue_search(final_term, force_refresh=force_refresh, 
+                                      search_windows=search_windows)
+        return redirect(url_for(".display_results", job_id=job_id))
 
     # `final_term` hard-coded to "carrot" right now; change later
-    calls.find_store_matches(final_term)
+    calls.find_store_matches(final_term, force_refresh=force_refresh, 
+                             search_windows=search_windows)
 
-    return redirect(url_for("display_results"))
+    return redirect(url_for(".display_results"))
 
 
-@app.route("/results", methods=["GET"])
+@routes.route("/jobs/<int:job_id>")
+def job_status(job_id):
+    """Get the status and progress of a search job."""
+    job = calls.get_job(job_id)
+    if not job:
+        return jsonify({"error": "No such job."}), 404
+
+    return jsonify({"job_id": job[0], 
+                    "status": job[2], 
+                    "search_id": job[3], 
+                    "posts_done": job[4], 
+                    "posts_total": job[5]})
+
+
+@routes.route("/results", methods=["GET"])
 def display_results():
     """Show the search results and calculated metrics."""
+    job_id = request.args.get("job_id", type=int)
+    if job_id:
+        job = calls.get_job(job_id)
+        if not job or job[2] == "failed":
+            flash("The search could not be completed.")
+            return redirect(url_for(".index"))
+        elif job[2] != "done":
+            return render_template("job_status.html", 
+                                    header_text=job[1].capitalize(), 
+                                    job_id=job[0], 
+                                    posts_done=job[4], 
+                                    posts_total=job[5])
+        session["search_id"] = job[3]
+
     search_id = session.get("search_id")
     if not search_id:
         flash("Not a valid search.")
-        return redirect(url_for("index"))
+        return redirect(url_for(".index"))
+    if calls.is_compacted(search_id):
+        return compacted_search()
 
     srch_term, timestamp, pairings, srch_term_pop = calls.gather_results(search_id)
-
-    # AJAX call in viz.js will get this from the session
-    session["pairings"] = pairings
+    windows, window_rows = calls.gather_window_results(search_id)
     
+    # AJAX call in viz.js gets the chart data by search id
     return render_template("results.html", 
+                            search_id=search_id,
                             header_text=srch_term.capitalize(), 
                             timestamp=timestamp.strftime("%m-%d-%y"),
                             results=pairings,
-                            term_popularity=srch_term_pop)
+                            term_popularity=srch_term_pop,
+                            windows=windows,
+                            window_rows=window_rows)
+
+
+@routes.route("/data.json/<int:search_id>")
+def get_graph_data(search_id):
+    """Get the pairings data of a search for the bubble chart.
+
+    A stored search never changes, so browsers and proxies may keep it, 
+    until retention.py removes its pairings.
+    """
+    if calls.is_compacted(search_id):
+        return jsonify({"error": "Search removed by retention."}), 410
+
+    data, etag = calls.get_graph_data(search_id)
+    if data is None:
+        return jsonify({"error": "No such search."}), 404
+
+    response = Response(data, mimetype="application/json")
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 365 * 24 * 60 * 60
+    response.cache_control.immutable = True
+
+    return response.make_conditional(request)
+
+
+@routes.route("/goes-with/<food_term>")
+def goes_with(food_term):
+    """Get the foods paired most with food_term in any stored search."""
+    score = request.args.get("score", "count")
+    k = min(max(request.args.get("k", 10, type=int), 1), 100)
+    if score not in calls.PAIRING_SCORES:
+        return jsonify({"error": "score must be one of {}.".format(
+                            ", ".join(calls.PAIRING_SCORES))}), 400
+
+    partners = calls.get_partners(food_term, k, score)
+    if partners is None:
+        return jsonify({"error": "Unknown food term."}), 404
+
+    return jsonify({"food_term": food_term.lower(), 
+                    "score": score, 
+                    "partners": [{"term": term, 
+                                  "count": count, 
+                                  "lift": round(lift, 3), 
+                                  "pmi": round(pmi, 3)} 
+                                 for term, count, lift, pmi in partners]})
 
 
-@app.route("/data.json")
-def get_graph_data():
-    """Get the pairings data from the session."""
-    pairings = session.get("pairings")
-    if not pairings:
-        flash("User did not enter a query.")
-        return redirect(url_for("index"))
+@routes.route("/top-pairings/<food_term>")
+def top_pairings(food_term):
+    """Get the foods paired most with food_term in recent searches."""
+    k = min(max(request.args.get("k", 10, type=int), 1), 100)
+    days = min(max(request.args.get("days", 30, type=float), 0), 3650)
 
-    dataset = formatting.format_pairings(pairings)
-    session.clear()
-    return jsonify(dataset)
+    pairings = calls.get_top_pairings(food_term, days, k)
+    if pairings is None:
+        return jsonify({"error": "Unknown food term."}), 404
 
+    return jsonify({"food_term": food_term.lower(), 
+                    "days": days, 
+                    "pairings": [{"term": term, 
+                                  "occurences": occurences, 
+                                  "searches": num_searches, 
+                                  "daily": [[day.isoformat(), day_occurences] 
+                                            for day, day_occurences in daily]} 
+                                 for term, occurences, num_searches, daily 
+                                 in pairings]})
 
-@app.route("/recent-searches")
+
+@routes.route("/trends/<food_term>")
+def pairing_trends(food_term):
+    """Get the pairings of food_term growing fastest over its searches."""
+    k = min(max(request.args.get("k", 10, type=int), 1), 100)
+    days = request.args.get("days", type=float)
+
+    found = calls.get_trends(food_term, k, days)
+    if found is None:
+        return jsonify({"error": "Food term never searched for."}), 404
+
+    timestamps, rising = found
+    return jsonify({"food_term": food_term.lower(), 
+                    "searched_at": [timestamp.isoformat() 
+                                    for timestamp in timestamps], 
+                    "rising": [{"term": term, 
+                                "growth_per_day": round(growth, 3), 
+                                "mean_popularity": round(mean, 2), 
+                                "searches": seen, 
+                                "rolling": [round(value, 2) 
+                                            for value in rolling]} 
+                               for term, growth, mean, seen, rolling 
+                               in rising]})
+
+
+@routes.route("/recent-searches")
 def get_recent():
     """Display recent search summaries."""
-    summaries = calls.search_summaries()
-    return render_template("recent_searches.html", summaries=summaries)
+    # pages with flashed messages are only for this user; base.html pops 
+    # the messages while rendering, so this is checked first
+    personal = "_flashes" in session
+    entry = None if personal else calls.recent_page_cache.get("page")
+    if entry is None:
+        summaries = calls.search_summaries()
+        page = render_template("recent_searches.html", summaries=summaries)
+
+        if personal:
+            return page
+        entry = calls.recent_page_cache.set("page", page)
 
+    return cached_page(entry, calls.RECENT_CACHE_TTL)
 
-@app.route("/recent-searches/<past_search_id>")
+
+@routes.route("/recent-searches/<int:past_search_id>")
 def past_result(past_search_id):
     """Display a past search's results."""
-    srch_term, timestamp, pairings, srch_term_pop = calls.gather_results(past_search_id)
-    session["pairings"] = pairings
+    if calls.is_compacted(past_search_id):
+        return compacted_search()
 
-    return render_template("results.html", 
-                            header_text=srch_term.capitalize(), 
-                            timestamp=timestamp.strftime("%m-%d-%y"),
-                            results=pairings,
-                            term_popularity=srch_term_pop)
+    # as for get_recent
+    personal = "_flashes" in session
+    entry = None if personal else calls.page_cache.get(past_search_id)
+    if entry is None:
+        srch_term, timestamp, pairings, srch_term_pop = calls.gather_results(past_search_id)
+        windows, window_rows = calls.gather_window_results(past_search_id)
+
+        page = render_template("results.html", 
+                                search_id=past_search_id,
+                                header_text=srch_term.capitalize(), 
+                                timestamp=timestamp.strftime("%m-%d-%y"),
+                                results=pairings,
+                                term_popularity=srch_term_pop,
+                                windows=windows,
+                                window_rows=window_rows)
+
+        if personal:
+            return page
+        entry = calls.page_cache.set(past_search_id, page)
+
+    return cached_page(entry, calls.PAGE_CACHE_TTL)
 
 
 #####################################################################
 
+# for `flask run`, WSGI servers and tests
+app = create_app()
+
 if __name__ == "__main__":
     """Run the server."""
     app.run(port=5000, host="0.0.0.0", debug=True)
\ No newline at end of file
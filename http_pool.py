@@ -0,0 +1,89 @@
+"""Pooled HTTP connections for calls to external APIs.
+
+Spoonacular and Twingly calls go through one HTTPAdapter per process, so
+connections are kept alive and reused instead of a new TCP and TLS handshake
+per call. Failed connections, and 429 and 5xx answers, are retried a bounded
+number of times with exponential backoff. RateLimiter spaces out calls to
+an API shared by many threads.
+
+Connections must not be shared with a forked child (pre-fork WSGI servers
+fork after import), so callers keep them in a process_local.ProcessLocal.
+"""
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def make_adapter(pool_connections=4, pool_maxsize=10, retries=2,
+                                                    backoff_factor=0.3):
+    """Make an adapter keeping up to pool_maxsize connections per host."""
+    retry = Retry(total=retries,
+                  backoff_factor=backoff_factor,
+                  status_forcelist=RETRY_STATUSES,
+                  allowed_methods=frozenset(["GET", "POST"]),
+                  respect_retry_after_header=True,
+                  # give back the last answer so raise_for_status works as before
+                  raise_on_status=False)
+
+    return HTTPAdapter(pool_connections=pool_connections,
+                       pool_maxsize=pool_maxsize,
+                       max_retries=retry)
+
+
+class PooledSession(requests.Session):
+    """Session sending requests through a shared adapter.
+
+    timeout, a (connect, read) pair of seconds, is used for requests not
+    given their own.
+    """
+
+    def __init__(self, adapter, timeout=None):
+        super().__init__()
+        self.timeout = timeout
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().request(method, url, **kwargs)
+
+
+class RateLimiter():
+    """Token bucket allowing `rate` calls per second, shared by threads.
+
+    Up to `burst` calls may go through at once after a quiet spell. A rate 
+    of 0 means no limit.
+    """
+
+    def __init__(self, rate=0, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Wait until a call is allowed."""
+        if not self.rate:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, 
+                               self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            # take the token now and sleep off any debt outside the lock
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait:
+            time.sleep(wait)
@@ -0,0 +1,84 @@
+"""Background search workers for Food Trends application.
+
+Search jobs are queued in the jobs table (see calls.enqueue_search) and run by
+a pool of worker threads; no separate message broker is needed. Workers run
+inside the web server process when SEARCH_MODE is "job", or on their own:
+
+    python jobs.py
+
+Stop with Ctrl-C or SIGTERM; workers finish their current job first.
+"""
+
+import os
+import signal
+import threading
+import traceback
+
+
+class WorkerPool():
+    """Threads that claim queued jobs from the database and run them."""
+
+    def __init__(self, db, handler, num_workers=2, poll_interval=1.0,
+                                                    stale_after=10 * 60):
+        self.db = db
+        self.handler = handler
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """Requeue abandoned jobs and start the worker threads."""
+        requeued = self.db.requeue_stale_jobs(self.stale_after)
+        if requeued:
+            print("Requeued {} abandoned search jobs.".format(requeued))
+
+        self._stopping.clear()
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._work,
+                                      name="search-worker-{}".format(i),
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Stop claiming jobs and wait for running ones to finish."""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self.db.claim_job()
+            if job is None:
+                self._stopping.wait(self.poll_interval)
+                continue
+
+            try:
+                self.handler(job)
+            except Exception as error:
+                traceback.print_exc()
+                self.db.fail_job(job[0], repr(error))
+
+
+if __name__ == '__main__':
+    """Run search workers until interrupted."""
+    import calls
+
+    pool = WorkerPool(calls.db, calls.run_job,
+                      num_workers=int(os.environ.get("SEARCH_WORKERS", 4)))
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+
+    pool.start()
+    print("Search workers running.")
+    try:
+        while not stopped.wait(1):
+            pass
+    except KeyboardInterrupt:
+        pass
+
+    print("Waiting for running jobs to finish...")
+    pool.stop()
@@ -1,10 +1,17 @@
 """Metric calculations."""
 
 
-def get_srch_term_popularity(num_matches_total):
-    """Calculate the search term popularity."""
-    # based on the past week
-    return num_matches_total // 7
+# length in days of each Twingly search window (the tspan: operator)
+WINDOW_DAYS = {"tspan:12h": 0.5, 
+               "tspan:24h": 1, 
+               "tspan:w": 7, 
+               "tspan:m": 30, 
+               "tspan:3m": 90}
+
+
+def get_srch_term_popularity(num_matches_total, search_window="tspan:w"):
+    """Calculate the search term popularity (posts per day)."""
+    return int(num_matches_total / WINDOW_DAYS[search_window])
 
 
 def get_pairing_popularities(pairings_dict, num_matches_returned):
@@ -18,4 +25,35 @@ def get_pairing_popularities(pairings_dict, num_matches_returned):
         {"food_term": popularity, ..., "food_term_n": popularity}
     """
     return {food_term: int((occurences/num_matches_returned)*100) for \
-                (food_term, occurences) in pairings_dict.items()}
\ No newline at end of file
+                (food_term, occurences) in pairings_dict.items()}
+
+
+def compare_windows(window_pairings):
+    """Line up pairing popularities from searches over several windows.
+
+    Takes a list of (search_window, pairings) with pairings as returned by 
+    get_pairing_popularities, shortest window first.
+
+    Returns a list of (food_term, [popularity per window], trend), where 
+    trend is "rising" if the pairing is more popular in the shortest window 
+    than in the longest, "fading" if less, else "steady". Most popular over 
+    the shortest window first.
+    """
+    all_terms = set()
+    for search_window, pairings in window_pairings:
+        all_terms.update(pairings)
+
+    rows = []
+    for food_term in all_terms:
+        popularities = [pairings.get(food_term, 0) for 
+                                    search_window, pairings in window_pairings]
+        if popularities[0] > popularities[-1]:
+            trend = "rising"
+        elif popularities[0] < popularities[-1]:
+            trend = "fading"
+        else:
+            trend = "steady"
+        rows.append((food_term, popularities, trend))
+
+    rows.sort(key=lambda row: (-row[1][0], row[0]))
+    return rows
@@ -0,0 +1,193 @@
+"""Timing and counting instrumentation for Food Trends application.
+
+Stages of a search (Twingly query, Spoonacular calls, DB methods, template
+rendering) are timed into histograms. Totals are served in the Prometheus
+text format on /metrics; the stages of each request also go back to the
+browser in a Server-Timing header.
+
+Recording an observation is a bisect and a few additions under a lock, so
+instrumentation stays on all the time. Numbers are per process.
+"""
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# seconds; Prometheus client defaults
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+           1.0, 2.5, 5.0, 7.5, 10.0)
+
+REGISTRY = []
+
+# stage timings of the request being handled by this thread
+_local = threading.local()
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram():
+    """Distribution of durations, one series per label value."""
+
+    def __init__(self, name, doc, label, buckets=BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.label = label
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, label_value, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # one count per bucket, then the +Inf bucket, sum and count
+                series = self._series[label_value] = [0] * (
+                                                    len(self.buckets) + 1)
+                series.extend([0.0, 0])
+            series[index] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.doc),
+                 "# TYPE {} histogram".format(self.name)]
+        with self._lock:
+            snapshot = {key: list(series)
+                        for key, series in self._series.items()}
+
+        for label_value, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append('{}_bucket{{{}="{}",le="{}"}} {}'.format(
+                            self.name, self.label, label_value, bound,
+                            cumulative))
+            lines.append('{}_sum{{{}="{}"}} {}'.format(
+                    self.name, self.label, label_value, repr(series[-2])))
+            lines.append('{}_count{{{}="{}"}} {}'.format(
+                    self.name, self.label, label_value, series[-1]))
+
+        return lines
+
+
+class Counter():
+    """Monotonic counts, one series per label value."""
+
+    def __init__(self, name, doc, label):
+        self.name = name
+        self.doc = doc
+        self.label = label
+        self._counts = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, label_value, amount=1):
+        with self._lock:
+            self._counts[label_value] = self._counts.get(label_value,
+                                                         0) + amount
+
+    def values(self):
+        with self._lock:
+            return list(self._counts.items())
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.name, self.doc),
+                 "# TYPE {} counter".format(self.name)]
+        for label_value, count in sorted(self.values()):
+            lines.append('{}{{{}="{}"}} {}'.format(
+                    self.name, self.label, label_value, _format_value(count)))
+        return lines
+
+
+class CallbackCounter(Counter):
+    """Counts kept elsewhere (e.g. cache hits), read when rendered.
+
+    fxn returns (label value, count) pairs.
+    """
+
+    def __init__(self, name, doc, label, fxn):
+        super().__init__(name, doc, label)
+        self.fxn = fxn
+
+    def values(self):
+        return list(self.fxn())
+
+
+STAGE_SECONDS = Histogram("food_trends_stage_seconds",
+                          "Time spent in each stage of handling a request.",
+                          "stage")
+ERRORS = Counter("food_trends_errors_total",
+                 "Exceptions raised in each stage.", "stage")
+
+
+@contextmanager
+def timed(stage):
+    """Time a block (or, as a decorator, a function) as stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(stage, elapsed)
+
+        timings = getattr(_local, "timings", None)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def instrument_methods(prefix):
+    """Class decorator timing every public method as prefix.method_name."""
+
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if callable(method) and not name.startswith("_"):
+                setattr(cls, name, _timed_method(prefix + "." + name,
+                                                 method))
+        return cls
+
+    return decorate
+
+
+def _timed_method(stage, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with timed(stage):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+def begin_request():
+    """Start collecting stage timings for this thread's request."""
+    _local.timings = {}
+
+
+def end_request():
+    """Stop collecting; return this request's {stage: seconds}."""
+    timings = getattr(_local, "timings", None) or {}
+    _local.timings = None
+    return timings
+
+
+def server_timing(timings):
+    """Format stage timings as a Server-Timing header value."""
+    return ", ".join("{};dur={:.1f}".format(stage.replace(".", "-"),
+                                            seconds * 1000)
+                     for stage, seconds in sorted(timings.items()))
+
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
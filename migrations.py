@@ -0,0 +1,170 @@
+"""Bring an existing Food Trends database up to date with create_tables.
+
+Safe to run any number of times, on an empty or a populated database:
+    python migrations.py
+
+Missing tables are created and missing nullable columns added. Missing
+indexes are built with CREATE INDEX CONCURRENTLY so searches can keep
+writing while they build; one left invalid by a failed build is dropped and
+built again. A pairings table from before it was partitioned (see
+retention.py) becomes the first partition of a new one; only its primary
+key is rebuilt, concurrently, and searches wait for the swap itself.
+"""
+
+import os
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.schema import CreateIndex
+
+from create_tables import metadata, pairings, results
+
+
+def migrate(engine):
+    """Create missing tables, columns and indexes."""
+    had_rollups = ("pairing_rollups_daily" in 
+                        inspect(engine).get_table_names())
+    partition_pairings(engine)
+    metadata.create_all(engine, checkfirst=True)
+    add_missing_columns(engine)
+    drop_invalid_indexes(engine)
+    dedupe_results(engine)
+
+    if not had_rollups and engine.execute(
+                        "SELECT EXISTS (SELECT 1 FROM searches)").scalar():
+        print("Rollup tables made; run rollups.py to fill them from the "
+              "searches already stored.")
+
+    # CONCURRENTLY cannot run inside a transaction
+    conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        for table in metadata.sorted_tables:
+            # an index on a partitioned table cannot be built concurrently; 
+            # its partitions already have theirs
+            concurrently = not table.dialect_options["postgresql"][
+                                                            "partition_by"]
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                conn.execute(concurrent_index_ddl(index, engine.dialect, 
+                                                  concurrently))
+    finally:
+        conn.close()
+
+
+def concurrent_index_ddl(index, dialect, concurrently=True):
+    """Return the CREATE INDEX statement for index, built concurrently."""
+    ddl = str(CreateIndex(index).compile(dialect=dialect))
+    return ddl.replace("INDEX ", "INDEX {}IF NOT EXISTS ".format(
+                            "CONCURRENTLY " if concurrently else ""), 1)
+
+
+def add_missing_columns(engine):
+    """Add nullable columns added to create_tables since a table was made.
+
+    Others need a value for existing rows, so are left to a migration of 
+    their own; check_schema reports them.
+    """
+    db_tables = inspect(engine)
+    for table in metadata.sorted_tables:
+        db_columns = {column["name"] for column in 
+                            db_tables.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in db_columns or not column.nullable:
+                continue
+            engine.execute("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} "
+                           "{}".format(table.name, column.name, 
+                                       column.type.compile(engine.dialect)))
+            print("Added column {}.{}.".format(table.name, column.name))
+
+
+def drop_invalid_indexes(engine):
+    """Drop indexes left invalid by a failed concurrent build.
+
+    IF NOT EXISTS would skip them for ever; once dropped they are built 
+    again, e.g. uq_results_url after its duplicates are removed.
+    """
+    names = [index.name for table in metadata.sorted_tables 
+             for index in table.indexes]
+    invalid = [row[0] for row in engine.execute(
+                    "SELECT c.relname FROM pg_index i "
+                    "JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE NOT i.indisvalid AND c.relname = ANY(%(names)s)", 
+                    {"names": names}).fetchall()]
+
+    conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        for name in invalid:
+            conn.execute("DROP INDEX CONCURRENTLY IF EXISTS " + name)
+            print("Dropped invalid index {}.".format(name))
+    finally:
+        conn.close()
+
+
+def partition_pairings(engine):
+    """Make an unpartitioned pairings table the first partition of one.
+
+    It is renamed and attached to a new partitioned pairings table for its 
+    searches and those before; later searches go to partitions made by 
+    retention.py, or until then to the default partition. Skipped if 
+    pairings is partitioned already or does not exist.
+    """
+    kind = engine.execute("SELECT relkind FROM pg_class "
+                          "WHERE oid = to_regclass('pairings')").scalar()
+    if kind != "r":
+        return
+
+    # the primary key must include the partition key
+    conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        conn.execute("CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS "
+                     "pairings_pairing_id_search_id_key "
+                     "ON pairings (pairing_id, search_id)")
+    finally:
+        conn.close()
+
+    with engine.begin() as conn:
+        conn.execute("LOCK TABLE pairings IN EXCLUSIVE MODE")
+        last_search_id, last_pairing_id = conn.execute(
+                "SELECT max(search_id), max(pairing_id) FROM pairings").fetchone()
+        name = "pairings_p0_{}".format((last_search_id or 0) + 1)
+
+        conn.execute("ALTER TABLE pairings RENAME TO " + name)
+        conn.execute("ALTER SEQUENCE pairings_pairing_id_seq "
+                     "RENAME TO {}_pairing_id_seq".format(name))
+        conn.execute("ALTER TABLE {0} DROP CONSTRAINT pairings_pkey, "
+                     "ADD CONSTRAINT {0}_pkey PRIMARY KEY USING INDEX "
+                     "pairings_pairing_id_search_id_key".format(name))
+        conn.execute("ALTER INDEX IF EXISTS ix_pairings_search_id_occurences "
+                     "RENAME TO {}_search_id_occurences_idx".format(name))
+
+        pairings.create(conn)
+        conn.execute("ALTER TABLE pairings ATTACH PARTITION {} "
+                     "FOR VALUES FROM (0) TO ({})".format(
+                                            name, (last_search_id or 0) + 1))
+        if last_pairing_id is not None:
+            conn.execute("SELECT setval('pairings_pairing_id_seq', {:d})".format(
+                                                            last_pairing_id))
+
+    print("Pairings table partitioned.")
+
+
+def dedupe_results(engine):
+    """Remove duplicate results URLs so the unique index can be built.
+
+    The earliest record of each URL is kept. Skipped once the index exists.
+    """
+    index_names = {index["name"] for index in
+                        inspect(engine).get_indexes(results.name)}
+    if "uq_results_url" in index_names:
+        return
+
+    removed = engine.execute(
+        "DELETE FROM results a USING results b "
+        "WHERE a.url = b.url AND a.id > b.id").rowcount
+    print("Removed {} duplicate results records.".format(removed))
+
+
+if __name__ == '__main__':
+    """Migrate the database named by DB_PATH."""
+    engine = create_engine(os.environ.get("DB_PATH",
+                                          "postgresql:///food_trends"))
+    migrate(engine)
+    print("Database is up to date.")
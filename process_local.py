@@ -0,0 +1,51 @@
+"""Objects made once per process, for state that must not cross a fork.
+
+Pre-fork WSGI servers import the app, then fork workers. Database engines,
+HTTP connection pools and worker threads made before the fork would be
+shared by every worker (or, for threads, silently missing from them), so
+they are made on first use in each process instead.
+"""
+
+import os
+import threading
+
+
+# objects inherited from the parent process; kept referenced so they are
+# never garbage collected in the child, which would close the parent's
+# connections (psycopg2 sends a terminate message on the shared socket)
+_inherited = []
+
+
+class ProcessLocal():
+    """Object made by factory on first use in each process."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._pid = None
+        self._value = None
+        self._lock = threading.Lock()
+
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self.reset)
+
+    def get(self):
+        """Return this process's object, making it if needed."""
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._value = self.factory()
+                    self._pid = os.getpid()
+        return self._value
+
+    def peek(self):
+        """Return this process's object, or None if not made yet."""
+        return self._value if self._pid == os.getpid() else None
+
+    def reset(self):
+        """Forget the object; the parent's copy is left alone."""
+        # another thread may have held the lock when the process forked
+        self._lock = threading.Lock()
+        if self._value is not None and self._pid != os.getpid():
+            _inherited.append(self._value)
+        self._pid = None
+        self._value = None
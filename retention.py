@@ -0,0 +1,247 @@
+"""Retention of pairings and results of old searches.
+
+Each search adds a few dozen pairings and about 20 results, so left alone
+both tables grow for ever. Searches older than a maximum age are compacted
+and their raw rows removed, so the tables and their indexes stay about the
+size of the retention period:
+
+    pairings   partitioned by ranges of search ids, which rise with search
+               time. Partitions are added ahead of the newest search; those
+               whose searches are all past the maximum age are dropped
+               whole (after being archived, if an archive directory is
+               set). Old rows in the default partition, or in a partition
+               also holding newer searches, are deleted in batches.
+    results    deleted in batches, by search id. The maximum age is at
+               least the longest search window (metric_calcs.WINDOW_DAYS),
+               so the posts are outside every window and a later search
+               cannot return them again and store them twice.
+
+The compacted form of old pairings is the daily and weekly rollups (see
+rollups.py), which top pairings over long time ranges are read from. Raw
+pairings are only removed once their totals are found in the daily rollups;
+if not, they are left and a warning printed to run rollups.py first. Trends
+(trends.py) and co-occurrence counts (cooccurrence.py) read raw pairings,
+so they cover the retention period only. Pages and chart data of compacted
+searches answer 410 Gone once the web server next reads the retention marks
+(every RETENTION_CHECK_INTERVAL seconds).
+
+Run alongside the web server and search workers:
+
+    python retention.py --interval 3600
+
+Deletes go in batches of RETENTION_BATCH_SIZE rows with a pause after each,
+and partitions are attached and dropped under a short lock timeout, skipped
+until the next run if the lock is not free, so live ingest is barely slowed.
+Only one process runs retention at a time.
+"""
+
+import argparse
+import gzip
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+from metric_calcs import WINDOW_DAYS
+
+
+# key of the advisory lock held while retention runs
+LOCK_KEY = 2404
+
+
+class Retention():
+    """Removes rows of old searches from pairings and results."""
+
+    def __init__(self, db, max_age_days=90, partition_searches=5000,
+                 partitions_ahead=2, batch_size=5000, pause=0.5,
+                 archive_dir=None, lock_timeout="2s"):
+        # results of younger searches could still be returned again
+        if max_age_days < max(WINDOW_DAYS.values()):
+            raise ValueError("max_age_days must be at least the longest "
+                             "search window, {} days.".format(
+                                                max(WINDOW_DAYS.values())))
+        self.db = db
+        self.max_age_days = max_age_days
+        self.partition_searches = partition_searches
+        self.partitions_ahead = partitions_ahead
+        self.batch_size = batch_size
+        self.pause = pause
+        self.archive_dir = archive_dir
+        self.lock_timeout = lock_timeout
+        self._stopping = threading.Event()
+
+    def ensure_partitions(self):
+        """Add pairings partitions ahead of the newest search.
+
+        Return the names of the partitions added.
+        """
+        # no search is newer, so this is the id the next one gets
+        next_id = self.db.first_search_id_since(datetime.max) or 1
+        ranged = [partition for partition in self.db.pairing_partitions()
+                  if partition[1] is not None]
+        # searches not in a partition stay in the default one
+        start_id = max(ranged[-1][2], next_id) if ranged else next_id
+
+        added = []
+        while start_id < next_id + self.partitions_ahead * \
+                                        self.partition_searches:
+            end_id = start_id + self.partition_searches
+            added.append(self.db.add_pairing_partition(start_id, end_id,
+                                                       self.lock_timeout))
+            start_id = end_id
+
+        return added
+
+    def compact(self):
+        """Remove pairings and results of searches past the maximum age.
+
+        Return counts of what was done, as a dictionary.
+        """
+        stats = {"partitions_dropped": 0, "partitions_skipped": 0,
+                 "pairings_deleted": 0, "results_deleted": 0}
+        cutoff = datetime.utcnow() - timedelta(days=self.max_age_days)
+        end_id = self.db.first_search_id_since(cutoff)
+        if end_id is None:
+            return stats
+
+        old = [partition for partition in self.db.pairing_partitions()
+               if partition[1] is None or partition[1] < end_id]
+        missing = [name for name, start_id, stop_id in old if
+                   self.db.pairings_missing_from_rollups(name, end_id)]
+        if missing:
+            print("Pairings in {} are missing from the rollups; run "
+                  "rollups.py to keep them.".format(", ".join(missing)))
+            old = []
+        else:
+            # before any are removed, so rollups.py stops rebuilding them
+            self.db.mark_retention("pairings", end_id)
+
+        for name, start_id, stop_id in old:
+            whole = stop_id is not None and stop_id <= end_id
+            if not whole and not self.db.has_rows_before(name, end_id):
+                continue
+            if self.archive_dir:
+                self._archive(name, None if whole else end_id)
+
+            if not whole:
+                stats["pairings_deleted"] += self._delete_in_batches(name,
+                                                                     end_id)
+                self.db.vacuum(name)
+                continue
+            try:
+                self.db.drop_pairing_partition(name, self.lock_timeout)
+                stats["partitions_dropped"] += 1
+            except OperationalError as error:
+                # tried again next run
+                print("Could not drop {}: {}".format(name, error.orig))
+                stats["partitions_skipped"] += 1
+
+        stats["partitions_skipped"] += len(missing)
+        stats["results_deleted"] = self._delete_in_batches("results", end_id)
+        self.db.mark_retention("results", end_id)
+        if stats["results_deleted"]:
+            # so new results fill the space instead of growing the table
+            self.db.vacuum("results")
+
+        return stats
+
+    def _delete_in_batches(self, table_name, end_id):
+        """Delete rows of searches before end_id, pausing between batches."""
+        deleted = 0
+        while not self._stopping.is_set():
+            count = self.db.delete_old_rows(table_name, end_id,
+                                            self.batch_size)
+            deleted += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.pause)
+        return deleted
+
+    def _archive(self, table_name, end_id):
+        """Save pairings about to be removed to a gzipped CSV file."""
+        path = os.path.join(self.archive_dir, "{}_{}.csv.gz".format(
+                    table_name, datetime.utcnow().strftime("%Y%m%dT%H%M%S")))
+        # a file is only there once complete
+        with gzip.open(path + ".tmp", "wt") as f:
+            self.db.copy_pairings(table_name, f, end_id)
+        os.replace(path + ".tmp", path)
+
+    def run_once(self):
+        """Add partitions and compact, unless another process is.
+
+        Return counts of what was done, or None if retention was running
+        elsewhere.
+        """
+        with self.db.advisory_lock(LOCK_KEY) as locked:
+            if not locked:
+                return None
+
+            stats = self.compact()
+            try:
+                stats["partitions_added"] = len(self.ensure_partitions())
+            except DBAPIError as error:
+                # e.g. a lock not free, or a search stored in the range 
+                # just as it was attached
+                print("Could not add partitions: {}".format(error.orig))
+                stats["partitions_added"] = 0
+            return stats
+
+    def run(self, interval):
+        """Run retention every interval seconds until stopped."""
+        self._stopping.clear()
+        while not self._stopping.is_set():
+            start = time.perf_counter()
+            stats = self.run_once()
+            if stats is None:
+                print("Retention is running elsewhere; skipped.")
+            else:
+                print("Retention done in {:.1f}s: {}".format(
+                            time.perf_counter() - start, stats), flush=True)
+            self._stopping.wait(interval)
+
+    def stop(self):
+        """Stop after the current batch."""
+        self._stopping.set()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--once", action="store_true",
+                        help="run once and exit")
+    parser.add_argument("--interval", type=float, default=3600,
+                        help="seconds between runs")
+    parser.add_argument("--archive-dir",
+                        default=os.environ.get("RETENTION_ARCHIVE_DIR"),
+                        help="save pairings here before removing them")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    """Run retention on the database named by DB_PATH."""
+    import signal
+    from connector import DBConnector
+
+    args = parse_args()
+    db = DBConnector(os.environ.get("DB_PATH", "postgresql:///food_trends"))
+    try:
+        retention = Retention(
+            db,
+            max_age_days=float(os.environ.get("RETENTION_MAX_AGE_DAYS", 90)),
+            partition_searches=int(os.environ.get(
+                                    "RETENTION_PARTITION_SEARCHES", 5000)),
+            batch_size=int(os.environ.get("RETENTION_BATCH_SIZE", 5000)),
+            pause=float(os.environ.get("RETENTION_PAUSE", 0.5)),
+            archive_dir=args.archive_dir)
+    except ValueError as error:
+        raise SystemExit("RETENTION_MAX_AGE_DAYS: {}".format(error))
+
+    if args.once:
+        print(retention.run_once())
+    else:
+        signal.signal(signal.SIGTERM, lambda signum, frame: retention.stop())
+        try:
+            retention.run(args.interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,127 @@
+"""Daily and weekly rollups of pairings.
+
+The pairing_rollups_daily and pairing_rollups_weekly tables hold summed
+occurences and the number of searches per (searched term, search window,
+period, partner). DBConnector.ingest_searches adds each search to them in
+the same transaction that stores it, so queries over long time ranges read
+a few rollup rows per partner instead of every pairing. Only the part of a
+range that is not a whole day, the start of its first day and today so far,
+is read from raw pairings (see plan_spans).
+
+Run directly to rebuild the rollups from raw pairings, e.g. after a bulk
+import or for searches stored before the rollup tables existed:
+
+    python rollups.py --since 2018-03-01 --chunk-weeks 4
+
+Each chunk of weeks is rebuilt in one transaction. Searches being stored
+wait for it to finish before adding to the rollups, so none are lost or
+counted twice; reads carry on.
+"""
+
+import argparse
+import os
+import time
+from datetime import datetime, date, timedelta
+
+
+DAY = timedelta(days=1)
+WEEK = timedelta(days=7)
+
+
+def week_start(day):
+    """Return the Monday starting the week of day (a date)."""
+    return day - timedelta(days=day.weekday())
+
+
+def plan_spans(since, now, use_weeks=True):
+    """Split the time from since to now by where its pairings are read.
+
+    Return a list of (source, start, end), oldest first: source is "week"
+    or "day" for whole weeks or days read from the rollups (start and end
+    are dates, end excluded), or "raw" for raw pairings of searches from
+    start up to end (datetimes; end None for no limit). Whole weeks are only
+    used if use_weeks.
+    """
+    today = now.date()
+    first_day = since.date()
+    if datetime.combine(first_day, datetime.min.time()) < since:
+        first_day += DAY
+    if first_day >= today:
+        return [("raw", since, None)]
+
+    spans = []
+    first_day_start = datetime.combine(first_day, datetime.min.time())
+    if since < first_day_start:
+        spans.append(("raw", since, first_day_start))
+
+    first_week = week_start(first_day)
+    if first_week < first_day:
+        first_week += WEEK
+    # the last whole week ends on this week's Monday
+    last_week = week_start(today)
+
+    if use_weeks and first_week < last_week:
+        if first_day < first_week:
+            spans.append(("day", first_day, first_week))
+        spans.append(("week", first_week, last_week))
+        if last_week < today:
+            spans.append(("day", last_week, today))
+    else:
+        spans.append(("day", first_day, today))
+
+    spans.append(("raw", datetime.combine(today, datetime.min.time()), None))
+    return spans
+
+
+def rebuild(db, since=None, chunk_weeks=4):
+    """Rebuild the rollups of searches since a date (all if None).
+
+    Whole weeks are rebuilt, chunk_weeks at a time; weeks whose pairings
+    retention has started removing are left alone. Return the number of
+    (daily, weekly) rollup rows written.
+    """
+    first_search = db.first_search_time()
+    if first_search is None:
+        return 0, 0
+
+    start = week_start(max(since or date.min, first_search.date()))
+    removed_until = db.removed_until("pairings")
+    if removed_until is not None:
+        # raw pairings of earlier weeks were removed by retention.py; 
+        # their rollups are all that is left of them
+        start = max(start, week_start(removed_until.date()) + WEEK)
+    end = week_start(datetime.utcnow().date()) + WEEK
+    written = [0, 0]
+    while start < end:
+        chunk_end = min(start + chunk_weeks * WEEK, end)
+        chunk_start_time = time.perf_counter()
+        daily, weekly = db.rebuild_rollups(start, chunk_end)
+        written[0] += daily
+        written[1] += weekly
+        print("Rebuilt {} to {}: {} daily and {} weekly rows in {:.2f}s.".format(
+                start, chunk_end - DAY, daily, weekly,
+                time.perf_counter() - chunk_start_time), flush=True)
+        start = chunk_end
+
+    return tuple(written)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--since", type=lambda text: datetime.strptime(
+                                        text, "%Y-%m-%d").date(),
+                        help="first day to rebuild, YYYY-MM-DD (default: "
+                             "the first search)")
+    parser.add_argument("--chunk-weeks", type=int, default=4,
+                        help="weeks rebuilt per transaction")
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    """Rebuild the rollups of the database named by DB_PATH."""
+    from connector import DBConnector
+
+    args = parse_args()
+    db = DBConnector(os.environ.get("DB_PATH", "postgresql:///food_trends"))
+    daily, weekly = rebuild(db, args.since, args.chunk_weeks)
+    print("Rollups rebuilt: {} daily and {} weekly rows.".format(daily, weekly))
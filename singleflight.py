@@ -0,0 +1,105 @@
+"""Coalesce concurrent identical calls for Food Trends application.
+
+Callers asking for the same key while a call is running wait for it and share
+its result instead of running their own. Threads in one process are
+coalesced by SingleFlight itself; a lock backend serializes calls for the
+same key across processes.
+"""
+
+import fcntl
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+from sqlalchemy import func
+from sqlalchemy.sql import select
+
+
+class LocalLock():
+    """No cross-process locking; only threads in this process coalesce."""
+
+    @contextmanager
+    def hold(self, key):
+        yield
+
+
+class FileLock():
+    """Serialize calls across processes on one host with lock files."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def hold(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        with open(os.path.join(self.directory, digest + ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class AdvisoryLock():
+    """Serialize calls across processes with Postgres advisory locks."""
+
+    def __init__(self, db):
+        # anything with an engine attribute, looked up when a lock is taken
+        self.db = db
+
+    @contextmanager
+    def hold(self, key):
+        lock_id = func.hashtext(key)
+        with self.db.engine.connect() as conn:
+            conn.execute(select([func.pg_advisory_lock(lock_id)]))
+            try:
+                yield
+            finally:
+                conn.execute(select([func.pg_advisory_unlock(lock_id)]))
+
+
+class _Call():
+    """A call in progress and, once done, its outcome."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight():
+    """Run at most one call per key at a time and share its result."""
+
+    def __init__(self, lock_backend=None):
+        self.lock_backend = lock_backend or LocalLock()
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fxn):
+        """Return fxn(), or the result of a call for key already running."""
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            with self.lock_backend.hold(key):
+                call.result = fxn()
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
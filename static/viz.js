@@ -60,4 +60,5 @@ function makeBubbleChart(data) {
 
 
 // main
-d3.json('/data.json', makeBubbleChart)
\ No newline at end of file
+var searchId = document.getElementById("bubble-chart").dataset.searchId;
+d3.json('/data.json/' + searchId, makeBubbleChart);
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""Find known food terms in text without calling Spoonacular.
+
+The terms already in the food_terms table are kept in a trie keyed by word.
+Matching walks the trie from each word of the text, so a title is scanned in
+time linear in its length (times the longest term's word count, a small
+constant). Like Spoonacular, overlapping terms are all reported: "carrot
+cake" gives "carrot cake", "carrot" and "cake".
+"""
+
+import re
+import threading
+import time
+
+
+WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)*")
+
+# marks a trie node where a term ends
+_END = ""
+
+
+def words(text):
+    """Split text into lowercase words."""
+    return WORD.findall(text.lower())
+
+
+class TermMatcher():
+    """Word trie of food terms, updated incrementally from the database."""
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self.num_terms = 0
+        self.last_id = 0
+        self.last_refresh = None
+        self._root = {}
+        self._lock = threading.Lock()
+
+    def add_terms(self, terms):
+        """Add food terms to the trie."""
+        with self._lock:
+            for term in terms:
+                node = self._root
+                for word in words(term):
+                    node = node.setdefault(word, {})
+                if node is not self._root and _END not in node:
+                    node[_END] = term.lower()
+                    self.num_terms += 1
+
+    def refresh(self, db):
+        """Add food terms created since the last refresh."""
+        records = db.terms_since(self.last_id)
+        self.add_terms(record[1] for record in records)
+        if records:
+            self.last_id = max(record[0] for record in records)
+        self.last_refresh = time.time()
+
+    def refresh_if_stale(self, db):
+        """Refresh if refresh_interval seconds have passed since the last."""
+        if (self.last_refresh is None or
+                time.time() - self.last_refresh > self.refresh_interval):
+            self.refresh(db)
+
+    def find(self, text):
+        """Return a list of the known food terms in text (dupes removed)."""
+        text_words = words(text)
+        found = set()
+
+        for start in range(len(text_words)):
+            node = self._root
+            for word in text_words[start:]:
+                node = node.get(word)
+                if node is None:
+                    break
+                if _END in node:
+                    found.add(node[_END])
+
+        return list(found)
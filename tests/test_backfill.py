@@ -0,0 +1,88 @@
+"""Unit tests for the bulk backfill in backfill.py"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+# import from parent directory
+sys.path.append("/home/vagrant/src/food_trends_app/")
+import backfill
+import calls
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Test recording finished terms."""
+
+    def test_resume(self):
+        """Terms recorded by an earlier run should be skipped."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "terms.ckpt")
+            backfill.Checkpoint(path).record([("carrot", 1), ("kale", 2)])
+            with open(path, "a") as f:
+                f.write('{"term": "fe')
+
+            checkpoint = backfill.Checkpoint(path)
+            self.assertEqual(checkpoint.done, {"carrot", "kale"})
+
+            run = backfill.Backfill(["carrot", "feta", "kale"], checkpoint)
+            self.assertEqual(run.terms, ["feta"])
+
+    def test_read_terms(self):
+        """Blank lines, comments and repeats should be dropped."""
+        with tempfile.NamedTemporaryFile("w", suffix=".txt") as f:
+            f.write("# nightly\nCarrot\n\nkale\ncarrot\n")
+            f.flush()
+            self.assertEqual(backfill.read_terms(f.name), ["carrot", "kale"])
+
+
+class TestBackfill(unittest.TestCase):
+    """Test running searches without the APIs or database."""
+
+    def setUp(self):
+        """Mock the search stages; "durian" cannot be searched."""
+        self.batches = []
+        self.real = (calls.fetch_result_pages, calls.process_blog_results,
+                     calls.store_searches)
+
+        def _mock_fetch_result_pages(food_term, search_window):
+            if food_term == "durian":
+                raise ValueError("no such food")
+            return []
+
+        def _mock_process_blog_results(pages, search_term, progress=None):
+            return {"cake": 1}, 100, [(None, None, search_term + ".html")]
+
+        def _mock_store_searches(processed_searches):
+            self.batches.append([item[0] for item in processed_searches])
+            return list(range(len(processed_searches)))
+
+        calls.fetch_result_pages = _mock_fetch_result_pages
+        calls.process_blog_results = _mock_process_blog_results
+        calls.store_searches = _mock_store_searches
+
+    def tearDown(self):
+        """Put back the real fxns."""
+        (calls.fetch_result_pages, calls.process_blog_results,
+         calls.store_searches) = self.real
+
+    def test_batched_writes(self):
+        """Searches should be written in batches and checkpointed."""
+        terms = ["carrot", "kale", "durian", "feta", "beet", "fig", "leek"]
+        checkpoint = backfill.Checkpoint(None)
+        run = backfill.Backfill(terms, checkpoint, num_workers=3,
+                                batch_size=3, flush_interval=0.5,
+                                force_refresh=True, report_every=60)
+        stats = run.run()
+
+        self.assertEqual(stats["stored"], 6)
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["posts"], 6)
+        self.assertTrue(all(len(batch) <= 3 for batch in self.batches))
+        self.assertEqual(checkpoint.done, set(terms) - {"durian"})
+
+
+#####################################################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+"""Unit tests for caches in cache.py"""
+
+import sys
+import tempfile
+import time
+import unittest
+
+# import from parent directory
+sys.path.append("/home/vagrant/src/food_trends_app/")
+import cache
+
+
+class TestLRUCache(unittest.TestCase):
+    """Test the in-process LRU cache."""
+
+    def test_evicts_least_recently_used(self):
+        """Oldest untouched entry should be dropped when full."""
+        lru = cache.LRUCache(maxsize=2)
+        lru.set("carrot", 1)
+        lru.set("cake", 2)
+        lru.get("carrot")
+        lru.set("kale", 3)
+
+        self.assertEqual(lru.get("cake"), None)
+        self.assertEqual(lru.get("carrot"), 1)
+        self.assertEqual(lru.get("kale"), 3)
+
+    def test_expires_entries(self):
+        """Entries older than the TTL should be misses."""
+        lru = cache.LRUCache(ttl=0.01)
+        lru.set("carrot", 1)
+        time.sleep(0.02)
+
+        self.assertEqual(lru.get("carrot"), None)
+        self.assertEqual(lru.misses, 1)
+
+
+class TestURLFilter(unittest.TestCase):
+    """Test the Bloom filter of recent URLs."""
+
+    def test_remembers_urls(self):
+        """Added URLs should always be found, others rarely."""
+        urls = cache.URLFilter(capacity=1000, error_rate=0.01)
+        urls.update("http://blog/{}".format(i) for i in range(1000))
+
+        self.assertTrue(all("http://blog/{}".format(i) in urls 
+                            for i in range(1000)))
+        false_positives = sum("http://other/{}".format(i) in urls 
+                              for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_forgets_old_generation(self):
+        """URLs two generations old should be forgotten."""
+        urls = cache.URLFilter(capacity=2)
+        urls.update(["http://blog/1", "http://blog/2", "http://blog/3"])
+        self.assertIn("http://blog/1", urls)
+
+        urls.update(["http://blog/4", "http://blog/5"])
+        self.assertNotIn("http://blog/1", urls)
+        self.assertIn("http://blog/3", urls)
+        self.assertIn("http://blog/5", urls)
+
+
+class TestAnnotationCache(unittest.TestCase):
+    """Test the two-tier title -> food terms cache."""
+
+    def setUp(self):
+        """Stand in for the annotations table with a dictionary."""
+
+        class _MockDB():
+            def __init__(self):
+                self.rows = {}
+                self.evictions = 0
+
+            def annotation_by_hash(self, title_hash, max_age=None):
+                if title_hash in self.rows:
+                    return (title_hash, self.rows[title_hash])
+
+            def new_annotation_record(self, title_hash, terms_json):
+                self.rows[title_hash] = terms_json
+
+            def evict_annotations(self, max_age, max_rows):
+                self.evictions += 1
+
+        self.db = _MockDB()
+
+    def test_normalized_titles_share_entry(self):
+        """Case and spacing differences should hit the same entry."""
+        annotations = cache.AnnotationCache(self.db)
+        annotations.set("Carrot  Cake", ["carrot cake", "carrot"])
+
+        self.assertEqual(sorted(annotations.get("carrot cake")),
+                            ["carrot", "carrot cake"])
+
+    def test_reads_through_to_store(self):
+        """A fresh process should find terms stored by another one."""
+        cache.AnnotationCache(self.db).set("kale salad", ["kale"])
+        annotations = cache.AnnotationCache(self.db)
+
+        self.assertEqual(annotations.get("kale salad"), ["kale"])
+        self.assertEqual(annotations.stats()["store_hits"], 1)
+
+    def test_evicts_in_background(self):
+        """Every evict_every writes should trim the table off the caller."""
+        annotations = cache.AnnotationCache(self.db, evict_every=2)
+        annotations.set("kale salad", ["kale"])
+        self.assertIsNone(annotations._evicting)
+
+        annotations.set("carrot cake", ["carrot"])
+        annotations._evicting.join()
+        self.assertEqual(self.db.evictions, 1)
+
+
+class TestPageCache(unittest.TestCase):
+    """Test the rendered page cache."""
+
+    def test_shared_directory(self):
+        """A page stored by one process should be found by another."""
+        with tempfile.TemporaryDirectory() as directory:
+            first = cache.PageCache(directory=directory)
+            second = cache.PageCache(directory=directory)
+            entry = first.set(12, "<p>carrot</p>")
+
+            self.assertEqual(second.get(12), entry)
+            self.assertEqual(second.disk_hits, 1)
+
+            first.pop(12)
+            self.assertIsNone(cache.PageCache(directory=directory).get(12))
+
+    def test_expires_entries(self):
+        """Entries older than the TTL should be misses in both tiers."""
+        with tempfile.TemporaryDirectory() as directory:
+            pages = cache.PageCache(ttl=0.01, directory=directory)
+            pages.set(12, "<p>carrot</p>")
+            time.sleep(0.02)
+
+            self.assertIsNone(pages.get(12))
+            self.assertEqual(pages.disk_misses, 1)
+
+    def test_etag_follows_body(self):
+        """Same body, same ETag."""
+        pages = cache.PageCache()
+        self.assertEqual(pages.set(1, "a")[1], pages.set(2, "a")[1])
+        self.assertNotEqual(pages.set(1, "a")[1], pages.set(3, "b")[1])
+
+
+#####################################################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,21 @@
 """Unit tests for fxns in calls.py"""
 
+import os
 import sys
+import json
+import time
 import unittest
 
 # import from parent directory
 sys.path.append("/home/vagrant/src/food_trends_app/")
 import calls
+import create_tables
 import mock_twingly as twingly
+from twingly_search import Result, Post
+from connector import DBConnector
+
+
+TEST_DB_PATH = os.environ.get("TEST_DB_PATH")
 
 
 class TestFirstApiCall(unittest.TestCase):
@@ -74,6 +83,242 @@ class TestTwinglyResponse(unittest.TestCase):
         pass
 
 
+class TestAnnotateTitles(unittest.TestCase):
+    """
+    Test annotating blog post titles concurrently and serially.
+    """
+
+    def setUp(self):
+        """Mock Spoonacular API with a slow, title-dependent response."""
+        self.real_get_food_terms = calls.get_food_terms
+
+        def _mock_get_food_terms(input_text, api_key, timeout=None):
+            time.sleep(0.01 * (len(input_text) % 3))
+            return input_text.split()
+
+        calls.get_food_terms = _mock_get_food_terms
+        self.titles = ["carrot cake", "pecan pie with carrot", "kale", 
+                        "carrot and ginger soup", "chocolate carrot cake"]
+
+    def tearDown(self):
+        """Undo monkey patching."""
+        calls.get_food_terms = self.real_get_food_terms
+
+    def test_concurrent_keeps_order(self):
+        """Concurrent results should line up with the input titles."""
+        annotated = calls.annotate_titles(self.titles, mode="concurrent")
+        self.assertEqual(annotated, [title.split() for title in self.titles])
+
+    def test_modes_agree(self):
+        """Concurrent and serial modes should give the same terms."""
+        self.assertEqual(calls.annotate_titles(self.titles, mode="concurrent"), 
+                            calls.annotate_titles(self.titles, mode="serial"))
+
+    def test_bad_response(self):
+        """A title whose response cannot be read should get no terms."""
+        def _mock_get_food_terms(input_text, api_key, timeout=None):
+            if input_text == "kale":
+                return json.loads("<html>Service Unavailable</html>")
+            return input_text.split()
+
+        calls.get_food_terms = _mock_get_food_terms
+        annotated = calls.annotate_titles(self.titles, mode="concurrent")
+        self.assertEqual(annotated[2], [])
+        self.assertEqual(annotated[0], ["carrot", "cake"])
+
+
+class TestResultPages(unittest.TestCase):
+    """
+    Test sampling several pages of Twingly results.
+    """
+
+    def setUp(self):
+        """Mock both APIs; 95 posts match the search."""
+        self.real = (calls.execute_twingly_query, calls.get_food_terms,
+                        calls.TWINGLY_PAGES)
+        self.queries = []
+
+        def _mock_execute_twingly_query(q):
+            self.queries.append(q)
+            page = int(q.split("page:")[1]) if "page:" in q else 1
+            result = Result()
+            result.number_of_matches_total = 95
+            result.posts = []
+            for i in range(min(20, 95 - 20 * (page - 1))):
+                post = Post()
+                post.title = "carrot cake" if i % 2 else "carrot and kale"
+                post.url = "http://blog/{}/{}".format(page, i)
+                result.posts.append(post)
+            return result
+
+        def _mock_get_food_terms(input_text, api_key, timeout=None):
+            return input_text.replace(" and ", " ").split()
+
+        calls.execute_twingly_query = _mock_execute_twingly_query
+        calls.get_food_terms = _mock_get_food_terms
+        calls.TWINGLY_PAGES = 10
+
+    def tearDown(self):
+        """Undo monkey patching."""
+        (calls.execute_twingly_query, calls.get_food_terms,
+            calls.TWINGLY_PAGES) = self.real
+
+    def test_fetch_result_pages(self):
+        """Only as many pages as there are matches should be fetched."""
+        pages = list(calls.fetch_result_pages("carrot", "tspan:w"))
+
+        self.assertEqual(len(pages), 5)
+        self.assertEqual(len(self.queries), 5)
+        self.assertIn("page:5", " ".join(self.queries))
+
+    def test_process_blog_results(self):
+        """Counts and sample size should cover every page."""
+        progress = []
+        other_terms_dict, num_matches_total, result_rows = \
+            calls.process_blog_results(
+                calls.fetch_result_pages("carrot", "tspan:w"), "carrot",
+                lambda done, total: progress.append((done, total)))
+
+        self.assertEqual(num_matches_total, 95)
+        self.assertEqual(len(result_rows), 95)
+        self.assertEqual(other_terms_dict, {"cake": 47, "kale": 48})
+        self.assertEqual(progress[-1], (95, 95))
+
+
+@unittest.skipUnless(TEST_DB_PATH, "TEST_DB_PATH not set")
+class TestQueryCounts(unittest.TestCase):
+    """
+    Rendering stored searches should take a fixed number of queries.
+    """
+
+    def setUp(self):
+        """Store a dozen searches with a few pairings each."""
+        self.real_db = calls.db
+        calls.db = DBConnector(TEST_DB_PATH)
+        create_tables.metadata.drop_all(calls.db.engine)
+        create_tables.metadata.create_all(calls.db.engine)
+
+        self.search_ids = []
+        for i in range(12):
+            other_terms_dict = {"term{}".format(j): j + 1 for j in range(i % 5)}
+            self.search_ids.append(calls.db.ingest_search("carrot", 100, 20, 
+                                                    [], other_terms_dict))
+
+        # as if in a freshly started worker
+        calls.db.term_cache = type(calls.db.term_cache)()
+
+    def tearDown(self):
+        """Put back the application database."""
+        calls.db.engine.dispose()
+        calls.db = self.real_db
+
+    def test_search_summaries(self):
+        """Recent searches should need two queries."""
+        start = calls.db.query_count
+        summaries = calls.search_summaries()
+
+        self.assertEqual(calls.db.query_count - start, 2)
+        self.assertEqual(len(summaries), 10)
+        self.assertEqual(summaries[0][3], ["term0"])
+        self.assertEqual(summaries[2][3], ["term3", "term2", "term1"])
+
+    def test_gather_results(self):
+        """A search's results should need at most three queries."""
+        start = calls.db.query_count
+        srch_term, timestamp, pairings, srch_term_pop = calls.gather_results(
+                                                        self.search_ids[4])
+
+        self.assertLessEqual(calls.db.query_count - start, 3)
+        self.assertEqual(srch_term, "carrot")
+        self.assertEqual(len(pairings), 4)
+
+    def test_get_partners(self):
+        """Partner names should be looked up together, not one by one."""
+        calls.get_partners("carrot")
+        calls.db.term_cache = type(calls.db.term_cache)()
+
+        start = calls.db.query_count
+        partners = calls.get_partners("carrot", k=3)
+        # the term's id, then its partners' names
+        self.assertEqual(calls.db.query_count - start, 2)
+        self.assertEqual([row[0] for row in partners], 
+                         ["term1", "term2", "term0"])
+
+    def test_get_top_pairings(self):
+        """Top pairings should take a fixed number of queries."""
+        calls.get_top_pairings("carrot")
+        calls.db.term_cache = type(calls.db.term_cache)()
+
+        start = calls.db.query_count
+        top = calls.get_top_pairings("carrot", k=3)
+        # the term's id, its top partners, their days, then their names
+        self.assertEqual(calls.db.query_count - start, 4)
+        self.assertEqual([row[:3] for row in top], 
+                         [("term1", 12, 6), ("term2", 12, 4), ("term0", 9, 9)])
+
+    def test_graph_data_cached(self):
+        """Chart data should be built once per search, then served from memory."""
+        calls.graph_data_cache.clear()
+        data, etag = calls.get_graph_data(self.search_ids[2])
+
+        start = calls.db.query_count
+        self.assertEqual(calls.get_graph_data(self.search_ids[2]), (data, etag))
+        self.assertEqual(calls.db.query_count, start)
+        self.assertEqual(len(json.loads(data)["children"]), 2)
+        self.assertEqual(calls.get_graph_data(-1), (None, None))
+
+    def test_compacted_search(self):
+        """Searches retention compacted should be dropped from the caches."""
+        calls.retention_cache.clear()
+        self.assertFalse(calls.is_compacted(self.search_ids[0]))
+
+        calls.get_graph_data(self.search_ids[0])
+        calls.db.mark_retention("pairings", self.search_ids[1])
+        calls.retention_cache.clear()
+
+        self.assertTrue(calls.is_compacted(self.search_ids[0]))
+        self.assertFalse(calls.is_compacted(self.search_ids[1]))
+        self.assertIsNone(calls.graph_data_cache.get(self.search_ids[0]))
+        calls.retention_cache.clear()
+
+    def test_run_job_windows(self):
+        """A queued job should search over the windows it was queued with."""
+        searched = []
+
+        def _mock_run_window_searches(food_term, search_windows, 
+                                        force_refresh=False, progress=None):
+            searched.append(search_windows)
+            return self.search_ids[0]
+
+        real_run_window_searches = calls.run_window_searches
+        calls.run_window_searches = _mock_run_window_searches
+        try:
+            job_id = calls.enqueue_search("carrot", 
+                                search_windows=["tspan:24h", "tspan:w"])
+            calls.run_job(calls.db.claim_job())
+        finally:
+            calls.run_window_searches = real_run_window_searches
+
+        self.assertEqual(searched, [["tspan:24h", "tspan:w"]])
+        self.assertEqual(calls.get_job(job_id)[2:4], 
+                         ("done", self.search_ids[0]))
+
+    def test_gather_window_results(self):
+        """Linked searches should line up pairings by window, shortest first."""
+        day_id = calls.db.ingest_search("carrot", 10, 20, [], 
+                                        {"term1": 10, "term4": 2}, 
+                                        search_window="tspan:24h")
+        calls.db.link_searches(self.search_ids[4], [day_id])
+        calls.db.link_searches(self.search_ids[4], [day_id])
+
+        windows, rows = calls.gather_window_results(self.search_ids[4])
+
+        self.assertEqual(windows, [("tspan:24h", 1, 10), ("tspan:w", 7, 14)])
+        self.assertEqual(rows[0], ("term1", [50, 10], "rising"))
+        self.assertEqual(rows[-1], ("term3", [0, 20], "fading"))
+        self.assertEqual(calls.gather_window_results(day_id), ([], []))
+
+
 #####################################################################
 
 if __name__ == '__main__':
@@ -0,0 +1,613 @@
+"""Database tests for DBConnector in connector.py
+
+Run against a scratch Postgres database named by the TEST_DB_PATH
+environment variable; skipped if it is not set. Tables are dropped and
+recreated for each test.
+"""
+
+import gzip
+import os
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime, date, timedelta
+
+# import from parent directory
+sys.path.append("/home/vagrant/src/food_trends_app/")
+from sqlalchemy import inspect
+from sqlalchemy.exc import DataError, IntegrityError
+
+import create_tables
+import jobs
+import migrations
+import retention
+import rollups
+from connector import DBConnector
+
+
+TEST_DB_PATH = os.environ.get("TEST_DB_PATH")
+
+
+class Post():
+    """Stands in for a Twingly post."""
+
+    def __init__(self, url):
+        self.url = url
+        self.published_at = datetime(2018, 3, 1)
+        self.indexed_at = datetime(2018, 3, 2)
+
+
+def _result_row(url):
+    """Make a (publish_date, index_date, url) results row."""
+    return (datetime(2018, 3, 1), datetime(2018, 3, 2), url)
+
+
+@unittest.skipUnless(TEST_DB_PATH, "TEST_DB_PATH not set")
+class DBTestCase(unittest.TestCase):
+    """Give each test empty tables and a connector."""
+
+    def setUp(self):
+        """Recreate the tables."""
+        self.db = DBConnector(TEST_DB_PATH)
+        create_tables.metadata.drop_all(self.db.engine)
+        create_tables.metadata.create_all(self.db.engine)
+
+    def tearDown(self):
+        """Release pooled connections."""
+        self.db.engine.dispose()
+
+    def count_rows(self, table_name):
+        """Count the records in a table."""
+        return self.db.execute("SELECT count(*) FROM " +
+                                                table_name).fetchone()[0]
+
+
+class TestIngestSearch(DBTestCase):
+    """Test storing a whole search in one transaction."""
+
+    def test_ingest_search(self):
+        """Search, results and pairings should all be stored."""
+        posts = [_result_row("http://blog/1"), _result_row("http://blog/2")]
+        search_id = self.db.ingest_search("Carrot", 1160, 2, posts,
+                                            {"cake": 2, "ginger": 1})
+
+        self.assertEqual(self.db.search_record_by_id(search_id)[4], 1160)
+        self.assertEqual(self.count_rows("results"), 2)
+        pairings = self.db.pairings_by_search(search_id)
+        self.assertEqual([self.db.term_by_id(p[2]) for p in pairings],
+                            ["cake", "ginger"])
+
+    def test_failed_ingest_writes_nothing(self):
+        """A failing statement should roll back the whole search."""
+        posts = [_result_row("http://blog/1")]
+        too_long = "a" * 40
+
+        with self.assertRaises(DataError):
+            self.db.ingest_search("carrot", 10, 1, posts, {too_long: 1})
+
+        self.assertEqual(self.count_rows("searches"), 0)
+        self.assertEqual(self.count_rows("results"), 0)
+        self.assertEqual(self.count_rows("pairings"), 0)
+
+    def test_ingest_searches(self):
+        """A batch of searches should be stored together, ids in order."""
+        start = self.db.query_count
+        search_ids = self.db.ingest_searches([
+                ("carrot", 10, 2, [_result_row("http://blog/1"), 
+                                   _result_row("http://blog/2")], 
+                 {"cake": 2}, "tspan:w"),
+                ("kale", 20, 1, [_result_row("http://blog/2")], 
+                 {"cake": 1, "feta": 1}, "tspan:m")])
+        queries = self.db.query_count - start
+
+        self.assertEqual([self.db.search_record_by_id(search_id)[2] 
+                          for search_id in search_ids], ["tspan:w", "tspan:m"])
+        self.assertEqual(self.count_rows("results"), 2)
+        self.assertEqual(self.count_rows("pairings"), 3)
+        # terms, two searches, results, pairings and both rollups
+        self.assertLessEqual(queries, 7)
+
+
+class TestResultsDedup(DBTestCase):
+    """Test skipping results whose URL is stored already."""
+
+    def test_skips_stored_urls(self):
+        """Each URL should be stored once, in one statement per batch."""
+        self.db.ingest_search("carrot", 10, 2, 
+                              [_result_row("http://blog/1"), 
+                               _result_row("http://blog/2")], {})
+        # another process stored this search, so the filter has not seen it
+        self.db.url_filter.clear()
+        before = self.db.query_count
+        self.db.ingest_search("kale", 10, 3, 
+                              [_result_row("http://blog/2"), 
+                               _result_row("http://blog/3"), 
+                               _result_row("http://blog/3")], {})
+
+        self.assertEqual(self.count_rows("results"), 3)
+        self.assertEqual(self.db.result_counts(), 
+                         {"inserted": 3, "duplicate": 2, "filtered": 0})
+        # search record, terms, results; no per-post statements
+        self.assertLessEqual(self.db.query_count - before, 4)
+
+    def test_filters_recent_urls(self):
+        """URLs this process stored lately should not reach the database."""
+        search_id = self.db.ingest_search("carrot", 10, 1, 
+                                          [_result_row("http://blog/1")], {})
+        before = self.db.query_count
+        inserted, skipped = self.db.insert_results(
+                                    [_result_row("http://blog/1")], search_id)
+
+        self.assertEqual((inserted, skipped), (0, 1))
+        self.assertEqual(self.db.query_count, before)
+        self.assertEqual(self.db.result_counts()["filtered"], 1)
+
+    def test_new_results_record(self):
+        """A post should only be recorded if its URL is new."""
+        search_id = self.db.ingest_search("carrot", 10, 0, [], {})
+        post = Post("http://blog/1")
+
+        self.assertTrue(self.db.new_results_record(post, search_id))
+        self.db.url_filter.clear()
+        self.assertFalse(self.db.new_results_record(post, search_id))
+        self.assertEqual(self.count_rows("results"), 1)
+
+
+class TestFoodTerms(DBTestCase):
+    """Test resolving food terms to ids."""
+
+    def test_ids_for_terms(self):
+        """New and existing terms should resolve in one call."""
+        carrot_id = self.db.new_food_term_record("Carrot")
+        term_ids = self.db.ids_for_terms(["carrot", "cake", "kale"])
+
+        self.assertEqual(term_ids["carrot"], carrot_id)
+        self.assertEqual(self.count_rows("food_terms"), 3)
+        self.assertEqual(self.db.term_by_id(term_ids["kale"]), "kale")
+
+    def test_terms_by_ids(self):
+        """Terms not cached should be looked up in one query, then cached."""
+        term_ids = self.db.ids_for_terms(["carrot", "cake", "kale"])
+        self.db.term_cache = type(self.db.term_cache)()
+        self.db.term_cache.add("carrot", term_ids["carrot"])
+
+        start = self.db.query_count
+        terms = self.db.terms_by_ids(term_ids.values())
+        self.assertEqual(self.db.query_count - start, 1)
+        self.assertEqual(terms, {term_id: term 
+                                 for term, term_id in term_ids.items()})
+
+        self.db.terms_by_ids(term_ids.values())
+        self.assertEqual(self.db.query_count - start, 1)
+
+    def test_configure(self):
+        """Term ids cached from one database should not be used in another."""
+        self.db.ids_for_terms(["carrot", "cake"])
+        # the same database under another URI, emptied as if another one
+        other_uri = TEST_DB_PATH + ("&" if "?" in TEST_DB_PATH else "?") + \
+                                                    "application_name=other"
+        create_tables.metadata.drop_all(self.db.engine)
+        create_tables.metadata.create_all(self.db.engine)
+        self.db.new_food_term_record("kale")
+
+        self.db.configure(other_uri)
+        search_id = self.db.ingest_search("carrot", 10, 1, [], {"cake": 1})
+
+        search = self.db.search_record_by_id(search_id)
+        pairing = self.db.pairings_by_search(search_id)[0]
+        self.assertEqual(self.db.term_by_id(search[3]), "carrot")
+        self.assertEqual(self.db.term_by_id(pairing[2]), "cake")
+
+    def test_warm_term_cache(self):
+        """Warmed lookups should not need the database."""
+        term_ids = self.db.ids_for_terms(["carrot", "cake"])
+        fresh_db = DBConnector(TEST_DB_PATH)
+        fresh_db.warm_term_cache()
+        fresh_db.engine.dispose()
+
+        self.assertEqual(fresh_db.id_by_term("cake"), term_ids["cake"])
+        self.assertEqual(fresh_db.term_by_id(term_ids["carrot"]), "carrot")
+
+
+class TestPairingCounts(DBTestCase):
+    """Test loading pairings for the co-occurrence graph."""
+
+    def test_pairing_counts_since(self):
+        """Pairings should be summed per term pair, newer ones only."""
+        self.db.ingest_search("carrot", 10, 2, [], {"cake": 2, "kale": 1})
+        self.db.ingest_search("carrot", 10, 2, [], {"cake": 3})
+        ids = self.db.ids_for_terms(["carrot", "cake", "kale"])
+
+        rows, max_id = self.db.pairing_counts_since(0)
+        self.assertEqual(sorted(rows), sorted([
+                            (ids["carrot"], ids["cake"], 5), 
+                            (ids["carrot"], ids["kale"], 1)]))
+
+        self.db.ingest_search("kale", 10, 2, [], {"carrot": 4})
+        rows, newer_max_id = self.db.pairing_counts_since(max_id)
+        self.assertEqual(rows, [(ids["kale"], ids["carrot"], 4)])
+        self.assertEqual(self.db.pairing_counts_since(newer_max_id), 
+                         ([], None))
+
+
+class TestPairingHistory(DBTestCase):
+    """Test loading pairings over a term's searches."""
+
+    def test_pairing_history(self):
+        """Every search of the terms should be found, oldest first."""
+        first = self.db.ingest_search("carrot", 10, 4, [], {"cake": 2})
+        second = self.db.ingest_search("carrot", 10, 4, [], {})
+        self.db.ingest_search("carrot", 10, 4, [], {"cake": 1}, "tspan:m")
+        self.db.ingest_search("kale", 10, 4, [], {"carrot": 1})
+        ids = self.db.ids_for_terms(["carrot", "cake"])
+
+        rows = self.db.pairing_history([ids["carrot"]], "tspan:w")
+        self.assertEqual([(food_id, search_id, returned, partner_id, count) 
+                          for food_id, search_id, timestamp, returned, 
+                              partner_id, count in rows], 
+                         [(ids["carrot"], first, 4, ids["cake"], 2), 
+                          (ids["carrot"], second, 4, 0, 0)])
+        self.assertEqual(len(self.db.pairing_history([ids["carrot"]])), 3)
+
+
+class TestRollups(DBTestCase):
+    """Test daily and weekly pairing rollups."""
+
+    def rollup_rows(self, table_name):
+        """Get (period_start, occurences, num_searches) of a rollup."""
+        return self.db.execute("SELECT period_start, occurences, num_searches "
+                               "FROM {} ORDER BY occurences DESC".format(
+                                                    table_name)).fetchall()
+
+    def age_searches(self, days):
+        """Move every search back in time, as if made days ago."""
+        self.db.execute("UPDATE searches SET user_timestamp = "
+                        "user_timestamp - interval '{} days'".format(days))
+
+    def test_rollups_kept_up_to_date(self):
+        """Storing searches should add to today's and this week's rollups."""
+        self.db.ingest_search("carrot", 10, 4, [], {"cake": 2, "kale": 1})
+        self.db.ingest_search("carrot", 10, 4, [], {"cake": 3})
+        today = datetime.utcnow().date()
+
+        self.assertEqual(self.rollup_rows("pairing_rollups_daily"), 
+                         [(today, 5, 2), (today, 1, 1)])
+        self.assertEqual([row[1:] for row in 
+                          self.rollup_rows("pairing_rollups_weekly")], 
+                         [(5, 2), (1, 1)])
+
+    def test_rebuild_rollups(self):
+        """Rebuilt rollups should match the raw pairings."""
+        self.db.ingest_search("carrot", 10, 4, [], {"cake": 2, "kale": 1})
+        self.age_searches(9)
+        self.db.ingest_search("carrot", 10, 4, [], {"cake": 3})
+        self.db.execute("DELETE FROM pairing_rollups_daily")
+        self.db.execute("UPDATE pairing_rollups_weekly SET occurences = 99")
+
+        written = rollups.rebuild(self.db)
+        self.assertEqual(written, (3, 3))
+        daily = self.rollup_rows("pairing_rollups_daily")
+        self.assertEqual(sorted(row[1:] for row in daily), 
+                         [(1, 1), (2, 1), (3, 1)])
+
+    def test_top_pairings_since(self):
+        """Totals should add up rollups and today's raw pairings."""
+        self.db.ingest_search("carrot", 10, 4, [], {"cake": 2, "kale": 1})
+        self.db.ingest_search("carrot", 10, 4, [], {"kale": 5}, "tspan:m")
+        self.age_searches(20)
+        rollups.rebuild(self.db)
+        self.db.ingest_search("carrot", 10, 4, [], {"cake": 3})
+        ids = self.db.ids_for_terms(["carrot", "cake", "kale"])
+        now = datetime.utcnow()
+
+        # rollups are not read for today, so stale ones do no harm
+        daily_rollup = create_tables.pairing_rollups_daily
+        self.db.execute(daily_rollup.update().where(
+                    daily_rollup.c.period_start == now.date()).values(
+                    occurences=99))
+        self.assertEqual(self.db.top_pairings_since(ids["carrot"], "tspan:w", 
+                                        now - timedelta(days=30), 10), 
+                         [(ids["cake"], 5, 2), (ids["kale"], 1, 1)])
+        self.assertEqual(self.db.top_pairings_since(ids["carrot"], "tspan:w", 
+                                        now - timedelta(days=30), 1), 
+                         [(ids["cake"], 5, 2)])
+        self.assertEqual(self.db.top_pairings_since(ids["carrot"], "tspan:w", 
+                                        now - timedelta(days=2), 10), 
+                         [(ids["cake"], 3, 1)])
+
+        daily = self.db.daily_pairing_totals(ids["carrot"], "tspan:w", 
+                            now - timedelta(days=30), [ids["cake"]])
+        self.assertEqual([row[1:] for row in daily], 
+                         [(ids["cake"], 2, 1), (ids["cake"], 3, 1)])
+        self.assertEqual(daily[-1][0], now.date())
+
+
+class TestRetention(DBTestCase):
+    """Test partitioning pairings and removing rows of old searches."""
+
+    def make_retention(self, **kwargs):
+        """Make a Retention with tiny partitions that does not pause."""
+        options = {"partition_searches": 2, "batch_size": 1, "pause": 0}
+        options.update(kwargs)
+        return retention.Retention(self.db, **options)
+
+    def age_searches(self, days):
+        """Move every search back in time, as if made days ago."""
+        self.db.execute("UPDATE searches SET user_timestamp = "
+                        "user_timestamp - interval '{} days'".format(days))
+
+    def test_max_age_covers_windows(self):
+        """Results still inside a search window should never be removed."""
+        with self.assertRaises(ValueError):
+            self.make_retention(max_age_days=28)
+        self.assertEqual(self.make_retention(max_age_days=90).max_age_days, 
+                         90)
+
+    def test_ensure_partitions(self):
+        """Partitions should be added ahead of the newest search, once."""
+        keeper = self.make_retention(partition_searches=10)
+        self.assertEqual(keeper.ensure_partitions(), 
+                         ["pairings_p1_11", "pairings_p11_21"])
+        self.assertEqual(keeper.ensure_partitions(), [])
+
+        self.db.ingest_search("carrot", 10, 4, [], {"cake": 2, "kale": 1})
+        self.assertEqual(self.count_rows("pairings_p1_11"), 2)
+        self.assertEqual(self.count_rows("pairings_default"), 0)
+        self.assertEqual([partition[1:] for partition in 
+                          self.db.pairing_partitions()], 
+                         [(1, 11), (11, 21), (None, None)])
+
+    def test_compact(self):
+        """Old partitions should be dropped and other old rows deleted."""
+        keeper = self.make_retention()
+        keeper.ensure_partitions()
+        for i in range(3):
+            self.db.ingest_search("carrot", 10, 4, 
+                                  [_result_row("http://blog/{}".format(i))], 
+                                  {"cake": 2, "kale": 1})
+        self.age_searches(100)
+        rollups.rebuild(self.db)
+        self.db.ingest_search("carrot", 10, 4, [_result_row("http://blog/3")], 
+                              {"cake": 3})
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            keeper.archive_dir = archive_dir
+            stats = keeper.compact()
+            archived = sorted(os.listdir(archive_dir))
+            self.assertEqual(len(archived), 2)
+            with gzip.open(os.path.join(archive_dir, archived[0]), "rt") as f:
+                self.assertEqual(len(f.readlines()), 5)
+
+        self.assertEqual(stats, {"partitions_dropped": 1, 
+                                 "partitions_skipped": 0, 
+                                 "pairings_deleted": 2, 
+                                 "results_deleted": 3})
+        self.assertEqual([partition[0] for partition in 
+                          self.db.pairing_partitions()], 
+                         ["pairings_p3_5", "pairings_default"])
+        self.assertEqual(self.count_rows("pairings"), 1)
+        self.assertEqual(self.count_rows("results"), 1)
+        self.assertEqual(self.db.kept_from("pairings"), 4)
+        ids = self.db.ids_for_terms(["carrot", "cake"])
+        self.assertEqual([row[1] for row in 
+                          self.db.pairing_history([ids["carrot"]])], [4])
+
+        # the old searches live on in the rollups, which are not rebuilt
+        since = datetime.utcnow() - timedelta(days=200)
+        self.assertEqual(rollups.rebuild(self.db), (1, 1))
+        self.assertEqual(self.db.top_pairings_since(ids["carrot"], "tspan:w", 
+                                                    since, 1), 
+                         [(ids["cake"], 9, 4)])
+
+    def test_missing_rollups(self):
+        """Pairings not in the rollups should be kept."""
+        self.db.ingest_search("carrot", 10, 4, [_result_row("http://blog/1")], 
+                              {"cake": 2})
+        # rolled up under today, so the old day has nothing
+        self.age_searches(100)
+
+        stats = self.make_retention().compact()
+        self.assertEqual(stats["partitions_skipped"], 1)
+        self.assertEqual(self.count_rows("pairings"), 1)
+        self.assertEqual(self.count_rows("results"), 0)
+        self.assertIsNone(self.db.removed_until("pairings"))
+
+    def test_one_runner(self):
+        """Retention should not run while another process holds the lock."""
+        with self.db.advisory_lock(retention.LOCK_KEY) as locked:
+            self.assertTrue(locked)
+            self.assertIsNone(self.make_retention().run_once())
+        self.assertEqual(self.make_retention().run_once()["partitions_added"], 
+                         2)
+
+
+class TestPlanSpans(unittest.TestCase):
+    """Test splitting time ranges between rollups and raw pairings."""
+
+    def test_plan_spans(self):
+        """Whole weeks, then whole days, then raw pairings should be used."""
+        # Thursday 2018-03-01 10:00 to Wednesday 2018-03-21 12:00
+        spans = rollups.plan_spans(datetime(2018, 3, 1, 10), 
+                                   datetime(2018, 3, 21, 12))
+        self.assertEqual(spans, [
+                ("raw", datetime(2018, 3, 1, 10), datetime(2018, 3, 2)), 
+                ("day", date(2018, 3, 2), date(2018, 3, 5)), 
+                ("week", date(2018, 3, 5), date(2018, 3, 19)), 
+                ("day", date(2018, 3, 19), date(2018, 3, 21)), 
+                ("raw", datetime(2018, 3, 21), None)])
+
+        spans = rollups.plan_spans(datetime(2018, 3, 1), 
+                                   datetime(2018, 3, 21, 12), use_weeks=False)
+        self.assertEqual(spans, [
+                ("day", date(2018, 3, 1), date(2018, 3, 21)), 
+                ("raw", datetime(2018, 3, 21), None)])
+
+    def test_today_only(self):
+        """A range within today and yesterday should be read raw."""
+        since = datetime(2018, 3, 20, 12)
+        self.assertEqual(rollups.plan_spans(since, datetime(2018, 3, 21, 12)), 
+                         [("raw", since, None)])
+
+
+class TestFreshSearch(DBTestCase):
+    """Test finding a recent search to reuse."""
+
+    def test_fresh_search_id(self):
+        """Only a recent search in the same window should be found."""
+        search_id = self.db.ingest_search("carrot", 10, 0, [], {})
+
+        self.assertEqual(self.db.fresh_search_id("Carrot", "tspan:w", 60),
+                            search_id)
+        self.assertIsNone(self.db.fresh_search_id("carrot", "tspan:m", 60))
+        self.assertIsNone(self.db.fresh_search_id("kale", "tspan:w", 60))
+
+        self.db.execute("UPDATE searches SET user_timestamp = "
+                        "user_timestamp - interval '2 minutes'")
+        self.assertIsNone(self.db.fresh_search_id("carrot", "tspan:w", 60))
+
+
+class TestAnnotations(DBTestCase):
+    """Test the annotations table."""
+
+    def test_evict_annotations(self):
+        """Expired records and those past the newest max_rows should go."""
+        for i in range(5):
+            self.db.new_annotation_record("hash{}".format(i), "[]")
+        # hash0 newest, hash4 oldest
+        self.db.execute("UPDATE annotations SET created_at = created_at - "
+                        "make_interval(secs => CAST(substr(title_hash, 5) "
+                        "AS int))")
+        self.db.execute("UPDATE annotations SET created_at = created_at - "
+                        "interval '2 days' WHERE title_hash = 'hash0'")
+
+        self.db.evict_annotations(24 * 60 * 60, 2)
+        kept = self.db.execute("SELECT title_hash FROM annotations "
+                               "ORDER BY title_hash").fetchall()
+        self.assertEqual([row[0] for row in kept], ["hash1", "hash2"])
+
+
+class TestSearchJobs(DBTestCase):
+    """Test the search job queue."""
+
+    def test_claim_job(self):
+        """A queued job should be claimed only once."""
+        job_id = self.db.new_job_record("avocado", 
+                                        search_windows=["tspan:w", "tspan:m"])
+
+        self.assertEqual(self.db.claim_job(), 
+                         (job_id, "avocado", False, "tspan:w,tspan:m"))
+        self.assertIsNone(self.db.claim_job())
+        self.assertEqual(self.db.job_by_id(job_id)[2], "running")
+
+    def test_worker_pool(self):
+        """Workers should run queued jobs and record failures."""
+        search_id = self.db.ingest_search("avocado", 10, 0, [], {})
+        good_job = self.db.new_job_record("avocado")
+        bad_job = self.db.new_job_record("kale")
+
+        def _handler(job):
+            if job[1] == "kale":
+                raise ValueError("Twingly is down")
+            self.db.update_job_progress(job[0], 20, 20)
+            self.db.finish_job(job[0], search_id)
+
+        pool = jobs.WorkerPool(self.db, _handler, poll_interval=0.01)
+        pool.start()
+        for _ in range(500):
+            if self.db.job_by_id(bad_job)[2] == "failed":
+                break
+            time.sleep(0.01)
+        pool.stop()
+
+        self.assertEqual(self.db.job_by_id(good_job)[2:6],
+                            ("done", search_id, 20, 20))
+        self.assertIn("Twingly is down", self.db.job_by_id(bad_job)[6])
+
+
+class TestMigrations(DBTestCase):
+    """Test bringing an older database up to date."""
+
+    def test_migrate_twice(self):
+        """Duplicate URLs should go and indexes be built, idempotently."""
+        self.db.execute("DROP INDEX uq_results_url")
+        self.db.execute("DROP INDEX ix_annotations_created_at")
+        self.db.execute("DROP TABLE jobs")
+        search_id = self.db.ingest_search("carrot", 10, 0, [], {})
+        for url in ["http://blog/1", "http://blog/1", "http://blog/2"]:
+            self.db.execute(self.db.meta.tables["results"].insert().values(
+                            publish_date=datetime(2018, 3, 1),
+                            index_date=datetime(2018, 3, 2),
+                            url=url, search_id=search_id))
+
+        migrations.migrate(self.db.engine)
+        migrations.migrate(self.db.engine)
+
+        self.assertEqual(self.count_rows("results"), 2)
+        self.assertEqual(self.db.check_schema(), [])
+        self.assertIsNone(self.db.job_by_id(1))
+        self.assertIn("ix_annotations_created_at", [index["name"] for index 
+                      in inspect(self.db.engine).get_indexes("annotations")])
+
+    def test_add_missing_columns(self):
+        """Nullable columns added since a table was made should be added."""
+        self.db.execute("ALTER TABLE jobs DROP COLUMN search_windows")
+        self.assertEqual(self.db.check_schema(), 
+                         ["missing column jobs.search_windows"])
+
+        migrations.migrate(self.db.engine)
+        self.assertEqual(self.db.check_schema(), [])
+
+    def test_invalid_unique_index(self):
+        """A unique index whose build failed should be rebuilt after dedup."""
+        search_id = self.db.ingest_search("carrot", 10, 0, [], {})
+        self.db.execute("DROP INDEX uq_results_url")
+        for url in ["http://blog/1", "http://blog/1"]:
+            self.db.execute(self.db.meta.tables["results"].insert().values(
+                            publish_date=datetime(2018, 3, 1),
+                            index_date=datetime(2018, 3, 2),
+                            url=url, search_id=search_id))
+        conn = self.db.engine.connect().execution_options(
+                                            isolation_level="AUTOCOMMIT")
+        with self.assertRaises(IntegrityError):
+            conn.execute("CREATE UNIQUE INDEX CONCURRENTLY uq_results_url "
+                         "ON results (url)")
+        conn.close()
+
+        migrations.migrate(self.db.engine)
+
+        self.assertEqual(self.count_rows("results"), 1)
+        self.assertTrue(self.db.execute(
+                "SELECT indisvalid FROM pg_index "
+                "WHERE indexrelid = to_regclass('uq_results_url')").fetchone()[0])
+
+    def test_partition_pairings(self):
+        """An unpartitioned pairings table should become a partition."""
+        self.db.execute("DROP TABLE pairings")
+        self.db.execute(
+            "CREATE TABLE pairings (pairing_id BIGSERIAL PRIMARY KEY, "
+            "food_id1 integer NOT NULL REFERENCES food_terms (id), "
+            "food_id2 integer NOT NULL REFERENCES food_terms (id), "
+            "search_id bigint NOT NULL REFERENCES searches (id), "
+            "occurences integer NOT NULL)")
+        self.db.execute("CREATE INDEX ix_pairings_search_id_occurences "
+                        "ON pairings (search_id, occurences DESC)")
+        self.db.ingest_search("carrot", 10, 4, [], {"cake": 2, "kale": 1})
+
+        migrations.migrate(self.db.engine)
+        migrations.migrate(self.db.engine)
+
+        self.assertEqual(self.db.pairing_partitions(), 
+                         [("pairings_p0_2", 0, 2), 
+                          ("pairings_default", None, None)])
+        search_id = self.db.ingest_search("carrot", 10, 4, [], {"cake": 3})
+        self.assertEqual([pairing[0] for pairing in 
+                          self.db.pairings_by_search(search_id)], [3])
+        self.assertEqual(self.count_rows("pairings"), 3)
+        self.assertEqual(self.db.check_schema(), [])
+
+
+#####################################################################
+
+if __name__ == '__main__':
+    unittest.main()
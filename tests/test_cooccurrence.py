@@ -0,0 +1,105 @@
+"""Unit tests for the pairing co-occurrence graph in cooccurrence.py"""
+
+import math
+import sys
+import threading
+import time
+import unittest
+
+# import from parent directory
+sys.path.append("/home/vagrant/src/food_trends_app/")
+import cooccurrence
+
+
+# term ids
+BURRATA, TOMATO, BASIL, FIG, BREAD = 1, 2, 3, 4, 5
+
+
+class TestPairingGraph(unittest.TestCase):
+    """Test counting and ranking partners."""
+
+    def setUp(self):
+        """Make a graph from a few searches' pairings."""
+        self.graph = cooccurrence.PairingGraph()
+        self.graph.add_pairings([(BURRATA, TOMATO, 6), (BURRATA, FIG, 2),
+                                 (TOMATO, BURRATA, 2), (TOMATO, BASIL, 8),
+                                 (TOMATO, BREAD, 10), (BASIL, BREAD, 1),
+                                 (FIG, FIG, 3)])
+
+    def test_symmetric_counts(self):
+        """Pairings should count for both terms, whichever was searched."""
+        self.assertEqual(self.graph.count(BURRATA, TOMATO), 8)
+        self.assertEqual(self.graph.count(TOMATO, BURRATA), 8)
+        self.assertEqual(self.graph.count(FIG, FIG), 0)
+        self.assertEqual(self.graph.num_pairs, 5)
+
+    def test_top_by_count(self):
+        """Partners should be ranked by how often they were seen together."""
+        top = self.graph.top_partners(TOMATO, k=2)
+        self.assertEqual([partner[0] for partner in top], [BREAD, BURRATA])
+
+    def test_top_by_lift(self):
+        """Lift should favor partners that mostly appear with the term."""
+        top = self.graph.top_partners(BURRATA, k=2, score="lift")
+        self.assertEqual([partner[0] for partner in top], [FIG, TOMATO])
+
+        partner_id, count, lift, pmi = top[0]
+        # total 58; count(burrata) 10, count(fig) 2
+        self.assertAlmostEqual(lift, 2 * 58 / (10 * 2))
+        self.assertAlmostEqual(pmi, math.log2(lift))
+
+    def test_min_count(self):
+        """Rare pairs should be left out of lift rankings."""
+        top = self.graph.top_partners(BASIL, score="pmi", min_count=2)
+        self.assertEqual([partner[0] for partner in top], [TOMATO])
+
+    def test_refresh(self):
+        """Refreshing should only add pairings newer than the last seen."""
+
+        class _MockDB():
+            def pairing_counts_since(self, last_id):
+                rows = {5: (BURRATA, TOMATO, 4), 9: (FIG, BREAD, 1)}
+                newer = [row for pairing_id, row in rows.items()
+                         if pairing_id > last_id]
+                return newer, max(rows) if newer else None
+
+        graph = cooccurrence.PairingGraph()
+        graph.refresh(_MockDB())
+        graph.refresh(_MockDB())
+
+        self.assertEqual(graph.last_id, 9)
+        self.assertEqual(graph.count(TOMATO, BURRATA), 4)
+        graph.rebuild(_MockDB())
+        self.assertEqual(graph.count(TOMATO, BURRATA), 4)
+
+    def test_rebuild_in_background(self):
+        """Stale counts should be served while a rebuild runs."""
+        rows = [(BURRATA, TOMATO, 4)]
+        loading = threading.Event()
+
+        class _MockDB():
+            def pairing_counts_since(self, last_id):
+                loading.wait(5)
+                return list(rows), 1
+
+        graph = cooccurrence.PairingGraph(rebuild_interval=0)
+        loading.set()
+        graph.refresh_if_stale(_MockDB())
+        self.assertEqual(graph.count(TOMATO, BURRATA), 4)
+
+        # the first rebuild was waited for; later ones are not
+        loading.clear()
+        rows.append((FIG, BREAD, 1))
+        time.sleep(0.01)
+        graph.refresh_if_stale(_MockDB())
+        self.assertEqual(graph.count(FIG, BREAD), 0)
+
+        loading.set()
+        graph._rebuilding.join()
+        self.assertEqual(graph.count(FIG, BREAD), 1)
+
+
+#####################################################################
+
+if __name__ == '__main__':
+    unittest.main()
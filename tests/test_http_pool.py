@@ -0,0 +1,85 @@
+"""Unit tests for pooled HTTP sessions in http_pool.py"""
+
+import sys
+import time
+import unittest
+
+from requests.adapters import BaseAdapter
+from requests.models import Response
+
+# import from parent directory
+sys.path.append("/home/vagrant/src/food_trends_app/")
+import http_pool
+
+
+class _RecordingAdapter(BaseAdapter):
+    """Answers every request with 200 and remembers its timeout."""
+
+    def __init__(self):
+        super().__init__()
+        self.timeouts = []
+
+    def send(self, request, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        response = Response()
+        response.status_code = 200
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class TestPooledSession(unittest.TestCase):
+    """Test sessions sharing an adapter."""
+
+    def test_default_timeout(self):
+        """Requests without their own timeout should get the session's."""
+        adapter = _RecordingAdapter()
+        session = http_pool.PooledSession(adapter, timeout=(3, 30))
+        session.get("https://example.com/")
+        session.post("https://example.com/", timeout=5)
+
+        self.assertEqual(adapter.timeouts, [(3, 30), 5])
+
+    def test_shared_adapter(self):
+        """Two sessions should send through the same adapter."""
+        adapter = _RecordingAdapter()
+        http_pool.PooledSession(adapter).get("http://example.com/")
+        http_pool.PooledSession(adapter).get("https://example.com/")
+
+        self.assertEqual(len(adapter.timeouts), 2)
+
+    def test_retries(self):
+        """Adapters should retry a bounded number of times."""
+        adapter = http_pool.make_adapter(retries=3, backoff_factor=0.5)
+        self.assertEqual(adapter.max_retries.total, 3)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Test spacing out calls."""
+
+    def test_rate(self):
+        """Calls past the burst should wait their turn."""
+        limiter = http_pool.RateLimiter(rate=100, burst=1)
+        start = time.perf_counter()
+        for _ in range(6):
+            limiter.acquire()
+
+        self.assertGreaterEqual(time.perf_counter() - start, 0.045)
+
+    def test_unlimited(self):
+        """A rate of 0 should never wait."""
+        limiter = http_pool.RateLimiter(rate=0)
+        start = time.perf_counter()
+        for _ in range(1000):
+            limiter.acquire()
+
+        self.assertLess(time.perf_counter() - start, 0.05)
+
+
+#####################################################################
+
+if __name__ == '__main__':
+    unittest.main()
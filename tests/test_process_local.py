@@ -0,0 +1,47 @@
+"""Unit tests for per-process objects in process_local.py"""
+
+import os
+import sys
+import unittest
+
+# import from parent directory
+sys.path.append("/home/vagrant/src/food_trends_app/")
+import process_local
+
+
+class TestProcessLocal(unittest.TestCase):
+    """Test per-process objects."""
+
+    def test_made_once(self):
+        """The factory should run once per process."""
+        made = []
+        local = process_local.ProcessLocal(lambda: made.append(1) or object())
+
+        self.assertIs(local.get(), local.get())
+        self.assertEqual(len(made), 1)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "needs os.fork")
+    def test_remade_after_fork(self):
+        """A forked child should make its own and keep the parent's alive."""
+        local = process_local.ProcessLocal(os.getpid)
+        parent_pid = local.get()
+        self.assertEqual(parent_pid, os.getpid())
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.write(write_fd, str(local.get() == os.getpid() and 
+                        parent_pid in process_local._inherited).encode())
+            os._exit(0)
+
+        os.close(write_fd)
+        os.waitpid(pid, 0)
+        with os.fdopen(read_fd) as f:
+            self.assertEqual(f.read(), "True")
+
+
+#####################################################################
+
+if __name__ == '__main__':
+    unittest.main()
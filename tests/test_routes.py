@@ -62,6 +62,243 @@ class TestVerifyTerm(unittest.TestCase):
         pass
 
 
+class TestSearch(unittest.TestCase):
+    """Test the '/search' route."""
+
+    def setUp(self):
+        """Make an app instance."""
+        food_trends.app.config["TESTING"] = True
+        self.client = food_trends.app.test_client()
+
+    def test_unknown_window(self):
+        """Unknown search windows should be refused, not searched."""
+        response = self.client.get("/search?choice=carrot&windows=tspan:y", 
+                                   follow_redirects=True)
+        self.assertIn(b"Unknown search window: tspan:y.", response.data)
+
+    def test_refresh_values(self):
+        """Only true-looking refresh values should force a new search."""
+        refreshes = []
+
+        def _mock_find_store_matches(food_term, force_refresh=False, 
+                                                    search_windows=None):
+            refreshes.append(force_refresh)
+
+        real_find_store_matches = food_trends.calls.find_store_matches
+        food_trends.calls.find_store_matches = _mock_find_store_matches
+        try:
+            for value in ["0", "false", "", "no", "1", "true", "on"]:
+                self.client.get("/search?choice=carrot&refresh=" + value)
+            self.client.post("/search", data={"choice": "carrot", 
+                                              "refresh": "false"})
+        finally:
+            food_trends.calls.find_store_matches = real_find_store_matches
+
+        self.assertEqual(refreshes, 
+                         [False, False, False, False, True, True, True, False])
+
+
+class TestGraphData(unittest.TestCase):
+    """Test '/data.json/<search_id>' route."""
+
+    def setUp(self):
+        """Make an app instance with stored chart data for search 7."""
+        food_trends.app.config["TESTING"] = True
+        self.client = food_trends.app.test_client()
+
+        def _mock_get_graph_data(search_id):
+            if search_id == 7:
+                return '{"children": []}', "abc123"
+            return None, None
+
+        self.real_get_graph_data = food_trends.calls.get_graph_data
+        self.real_is_compacted = food_trends.calls.is_compacted
+        food_trends.calls.get_graph_data = _mock_get_graph_data
+        food_trends.calls.is_compacted = lambda search_id: search_id < 5
+
+    def tearDown(self):
+        """Put back the real fxns."""
+        food_trends.calls.get_graph_data = self.real_get_graph_data
+        food_trends.calls.is_compacted = self.real_is_compacted
+
+    def test_cache_headers(self):
+        """Chart data should be cacheable for a long time."""
+        response = self.client.get("/data.json/7")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), {"children": []})
+        self.assertEqual(response.headers["ETag"], '"abc123"')
+        self.assertIn("immutable", response.headers["Cache-Control"])
+
+    def test_not_modified(self):
+        """A matching If-None-Match should get an empty 304."""
+        response = self.client.get("/data.json/7", 
+                                   headers={"If-None-Match": '"abc123"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+
+    def test_no_such_search(self):
+        """Unknown searches should 404."""
+        response = self.client.get("/data.json/8")
+        self.assertEqual(response.status_code, 404)
+
+    def test_compacted_search(self):
+        """Searches removed by retention should be gone, not cached."""
+        response = self.client.get("/data.json/4")
+        self.assertEqual(response.status_code, 410)
+        self.assertNotIn("immutable", response.headers.get("Cache-Control", ""))
+
+        response = self.client.get("/recent-searches/4")
+        self.assertEqual(response.status_code, 410)
+        self.assertIn(b"too old", response.data)
+
+
+class TestRecentSearches(unittest.TestCase):
+    """Test caching of the '/recent-searches' page."""
+
+    def setUp(self):
+        """Make an app instance with one fake summary."""
+        food_trends.app.config["TESTING"] = True
+        self.client = food_trends.app.test_client()
+        self.num_calls = 0
+
+        def _mock_search_summaries():
+            self.num_calls += 1
+            return [("carrot", 3, "10-18-26", ["cake", "ginger"])]
+
+        self.real_search_summaries = food_trends.calls.search_summaries
+        food_trends.calls.search_summaries = _mock_search_summaries
+        food_trends.calls.recent_page_cache.clear()
+
+    def tearDown(self):
+        """Put back the real fxn."""
+        food_trends.calls.search_summaries = self.real_search_summaries
+        food_trends.calls.recent_page_cache.clear()
+
+    def test_page_cached(self):
+        """The page should be rendered once until the cache is cleared."""
+        first = self.client.get("/recent-searches")
+        second = self.client.get("/recent-searches")
+
+        self.assertIn(b"Carrot", first.data)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(self.num_calls, 1)
+        self.assertIn("max-age=", first.headers["Cache-Control"])
+
+        food_trends.calls.recent_page_cache.clear()
+        self.client.get("/recent-searches")
+        self.assertEqual(self.num_calls, 2)
+
+    def test_not_modified(self):
+        """Revalidating with the ETag should get a 304."""
+        etag = self.client.get("/recent-searches").headers["ETag"]
+        response = self.client.get("/recent-searches", 
+                                   headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_flashes_not_shared(self):
+        """One user's flashed message should not be cached for others."""
+        with self.client.session_transaction() as sess:
+            sess["_flashes"] = [("message", "Only for you")]
+        mine = self.client.get("/recent-searches")
+        theirs = food_trends.app.test_client().get("/recent-searches")
+
+        self.assertIn(b"Only for you", mine.data)
+        self.assertNotIn("public", mine.headers.get("Cache-Control", ""))
+        self.assertNotIn(b"Only for you", theirs.data)
+        self.assertIn(b"Carrot", theirs.data)
+
+
+class TestCreateApp(unittest.TestCase):
+    """Test making app instances."""
+
+    def tearDown(self):
+        """Point back at the usual database."""
+        food_trends.create_app()
+
+    def test_other_database(self):
+        """Nothing cached from one database should be used with another."""
+        food_trends.calls.graph_data_cache.set(7, ('{"children": []}', "abc"))
+        food_trends.calls.db.term_cache.add("carrot", 1)
+        real_prepare_db = food_trends.db_ready.factory
+        food_trends.db_ready.factory = lambda: True
+        food_trends.db_ready.get()
+        food_trends.db_ready.factory = real_prepare_db
+
+        food_trends.create_app({"DB_PATH": "postgresql:///food_trends_other"})
+
+        self.assertEqual(food_trends.calls.db.db_uri, 
+                         "postgresql:///food_trends_other")
+        self.assertIsNone(food_trends.calls.graph_data_cache.get(7))
+        self.assertIsNone(food_trends.calls.db.term_cache.id_for("carrot"))
+        self.assertIsNone(food_trends.db_ready.peek())
+
+
+class TestPrepareDB(unittest.TestCase):
+    """Test checking the database on each process's first request."""
+
+    def setUp(self):
+        """Make an app instance that is not in testing mode."""
+        food_trends.app.config["TESTING"] = False
+        self.client = food_trends.app.test_client()
+        self.problems = ["missing table jobs"]
+        self.warmed = 0
+
+        def _mock_warm_term_cache():
+            self.warmed += 1
+
+        self.real_db = food_trends.calls.db
+        food_trends.calls.db = type("MockDB", (), {
+                "check_schema": lambda db: self.problems, 
+                "pairing_counts_since": lambda db, last_id: ([], None), 
+                "warm_term_cache": lambda db: _mock_warm_term_cache()})()
+        self.real_pairing_graph = food_trends.calls.pairing_graph
+        food_trends.calls.pairing_graph = type(self.real_pairing_graph)()
+        food_trends.db_ready.reset()
+
+    def tearDown(self):
+        """Put back the real database and pairing graph."""
+        food_trends.calls.db = self.real_db
+        food_trends.calls.pairing_graph = self.real_pairing_graph
+        food_trends.db_ready.reset()
+
+    def test_checked_once(self):
+        """An old schema should fail requests until migrated."""
+        self.assertEqual(self.client.get("/").status_code, 500)
+        self.assertEqual(self.warmed, 0)
+
+        self.problems = []
+        self.assertEqual(self.client.get("/").status_code, 200)
+        self.assertEqual(self.client.get("/").status_code, 200)
+        self.assertEqual(self.warmed, 1)
+        # the pairing graph is loaded in the background
+        food_trends.calls.pairing_graph._rebuilding.join()
+        self.assertIsNotNone(food_trends.calls.pairing_graph.last_rebuild)
+
+
+class TestMetrics(unittest.TestCase):
+    """Test timing instrumentation."""
+
+    def setUp(self):
+        """Make an app instance."""
+        food_trends.app.config["TESTING"] = True
+        self.client = food_trends.app.test_client()
+
+    def test_server_timing(self):
+        """Responses should report their stage timings."""
+        response = self.client.get("/")
+        self.assertIn("render;dur=", response.headers["Server-Timing"])
+        self.assertIn("total;dur=", response.headers["Server-Timing"])
+
+    def test_metrics(self):
+        """Timings should be exposed in Prometheus text format."""
+        self.client.get("/")
+        response = self.client.get("/metrics")
+        self.assertIn(b'food_trends_stage_seconds_count{stage="render"}',
+                        response.data)
+        self.assertIn(b"# TYPE food_trends_errors_total counter",
+                        response.data)
+
+
 #####################################################################
 
 if __name__ == '__main__':
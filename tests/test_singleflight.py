@@ -0,0 +1,96 @@
+"""Unit tests for request coalescing in singleflight.py"""
+
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# import from parent directory
+sys.path.append("/home/vagrant/src/food_trends_app/")
+import singleflight
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Test coalescing concurrent calls."""
+
+    def run_threads(self, flights, key):
+        """Call a slow function for key from several threads at once."""
+        calls = []
+        results = []
+
+        def _slow_search():
+            calls.append(key)
+            time.sleep(0.05)
+            return len(calls)
+
+        threads = [threading.Thread(target=lambda flight=flight:
+                                results.append(flight.do(key, _slow_search)))
+                   for flight in flights]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return calls, results
+
+    def test_concurrent_calls_share_result(self):
+        """Only one call should run; every caller gets its result."""
+        flight = singleflight.SingleFlight()
+        calls, results = self.run_threads([flight] * 5, "avocado|tspan:w")
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [1] * 5)
+
+    def test_errors_reach_waiters(self):
+        """Callers waiting on a failing call should see its error."""
+        flight = singleflight.SingleFlight()
+
+        def _failing_search():
+            time.sleep(0.05)
+            raise ValueError("Twingly is down")
+
+        errors = []
+
+        def _caller():
+            try:
+                flight.do("avocado", _failing_search)
+            except ValueError as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=_caller) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(errors), 3)
+
+    def test_file_lock_serializes(self):
+        """Separate flights sharing a lock directory should not overlap."""
+        lock_dir = tempfile.mkdtemp()
+        flights = [singleflight.SingleFlight(singleflight.FileLock(lock_dir))
+                   for _ in range(3)]
+        running = []
+        overlaps = []
+
+        def _search():
+            running.append(1)
+            overlaps.append(len(running) > 1)
+            time.sleep(0.02)
+            running.pop()
+
+        threads = [threading.Thread(target=flight.do, args=("kale", _search))
+                   for flight in flights]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(overlaps, [False] * 3)
+
+
+#####################################################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+"""Unit tests for the local food term matcher in term_matcher.py"""
+
+import sys
+import unittest
+
+# import from parent directory
+sys.path.append("/home/vagrant/src/food_trends_app/")
+import term_matcher
+
+
+class TestTermMatcher(unittest.TestCase):
+    """Test finding known food terms in titles."""
+
+    def setUp(self):
+        """Make a matcher with a few terms."""
+        self.matcher = term_matcher.TermMatcher()
+        self.matcher.add_terms(["carrot", "cake", "carrot cake",
+                                "peanut butter", "butter"])
+
+    def test_overlapping_terms(self):
+        """All known terms in the title should be found, like Spoonacular."""
+        found = self.matcher.find("Classic Carrot Cake with Peanut Butter!")
+        self.assertEqual(sorted(found), ["butter", "cake", "carrot",
+                                         "carrot cake", "peanut butter"])
+
+    def test_whole_words_only(self):
+        """Terms inside other words should not match."""
+        self.assertEqual(self.matcher.find("Carrots and cupcakes"), [])
+
+    def test_incremental_add(self):
+        """Terms added later should be found."""
+        self.matcher.add_terms(["ginger"])
+        self.assertEqual(sorted(self.matcher.find("Carrot ginger soup")),
+                         ["carrot", "ginger"])
+        self.assertEqual(self.matcher.num_terms, 6)
+
+    def test_refresh(self):
+        """Refreshing should only load terms newer than the last seen."""
+
+        class _MockDB():
+            def terms_since(self, last_id):
+                rows = [(1, "carrot"), (2, "kale"), (3, "feta")]
+                return [row for row in rows if row[0] > last_id]
+
+        matcher = term_matcher.TermMatcher()
+        matcher.refresh(_MockDB())
+        matcher.refresh(_MockDB())
+
+        self.assertEqual(matcher.last_id, 3)
+        self.assertEqual(matcher.num_terms, 3)
+        self.assertEqual(sorted(matcher.find("Kale & feta salad")),
+                         ["feta", "kale"])
+
+
+#####################################################################
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+"""Unit tests for pairing trend analytics in trends.py"""
+
+import sys
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+# import from parent directory
+sys.path.append("/home/vagrant/src/food_trends_app/")
+import metric_calcs
+import trends
+
+
+# term ids
+BURRATA, TOMATO, FIG, BASIL, KALE = 1, 2, 3, 4, 5
+
+
+def _rows(term_id, searches):
+    """Make pairing history rows from (search_id, day, pairings) searches.
+
+    Every search looked at 10 posts.
+    """
+    rows = []
+    for search_id, day, pairings in searches:
+        timestamp = datetime(2018, 3, day)
+        for partner_id, occurences in pairings.items():
+            rows.append((term_id, search_id, timestamp, 10, partner_id,
+                         occurences))
+        if not pairings:
+            rows.append((term_id, search_id, timestamp, 10, 0, 0))
+    return rows
+
+
+class TestPairingHistory(unittest.TestCase):
+    """Test analysing one term's pairings over its searches."""
+
+    def setUp(self):
+        """Tomato grows, fig fades and basil only shows up once."""
+        rows = _rows(BURRATA, [(1, 1, {TOMATO: 1, FIG: 5}),
+                               (2, 2, {TOMATO: 2, FIG: 4}),
+                               (5, 3, {}),
+                               (7, 4, {TOMATO: 4, FIG: 2, BASIL: 9})])
+        self.history = trends.histories_from_rows(rows)[BURRATA]
+
+    def test_popularity(self):
+        """Popularities should match those of single searches."""
+        self.assertEqual(list(self.history.search_ids), [1, 2, 5, 7])
+        self.assertEqual(list(self.history.days), [0, 1, 2, 3])
+        self.assertEqual(list(self.history.series(TOMATO)), [10, 20, 0, 40])
+        self.assertEqual(list(self.history.series(KALE)), [0, 0, 0, 0])
+
+        pairings = metric_calcs.get_pairing_popularities({TOMATO: 4, FIG: 2,
+                                                          BASIL: 9}, 10)
+        for partner_id, popularity in pairings.items():
+            self.assertEqual(self.history.series(partner_id)[-1], popularity)
+
+    def test_rolling_mean(self):
+        """Each search should be averaged with those of the days before."""
+        rolling = self.history.rolling_mean(days=1)
+        tomato = self.history.index_of(TOMATO)
+        self.assertEqual(list(rolling[:, tomato]), [10, 15, 10, 20])
+
+    def test_growth_rates(self):
+        """Growth should be the least-squares slope per day."""
+        growth = self.history.growth_rates()
+        tomato = self.history.index_of(TOMATO)
+        self.assertAlmostEqual(growth[tomato],
+                               np.polyfit([0, 1, 2, 3], [10, 20, 0, 40], 1)[0])
+
+        recent = self.history.growth_rates(days=1)
+        self.assertAlmostEqual(recent[tomato], 40)
+
+    def test_rising(self):
+        """Only growing partners seen often enough should be ranked."""
+        rising = self.history.rising(k=5, min_searches=2)
+        self.assertEqual([partner[0] for partner in rising], [TOMATO])
+
+        partner_id, growth, mean, seen = rising[0]
+        self.assertAlmostEqual(mean, 17.5)
+        self.assertEqual(seen, 3)
+
+        rising = self.history.rising(k=1, min_searches=1)
+        self.assertEqual([partner[0] for partner in rising], [BASIL])
+
+    def test_single_search(self):
+        """A term searched once should have no growth."""
+        history = trends.histories_from_rows(
+                            _rows(KALE, [(3, 1, {TOMATO: 2})]))[KALE]
+        self.assertEqual(list(history.growth_rates()), [0])
+        self.assertEqual(history.rising(), [])
+
+
+class TestManyTerms(unittest.TestCase):
+    """Test analysing several terms' histories together."""
+
+    def test_rising_across(self):
+        """Pairings of all terms should be ranked together."""
+        rows = (_rows(BURRATA, [(1, 1, {TOMATO: 1}), (3, 2, {TOMATO: 2})]) +
+                _rows(KALE, [(2, 1, {FIG: 1, BASIL: 5}),
+                             (4, 2, {FIG: 4, BASIL: 6})]))
+        histories = trends.histories_from_rows(rows)
+        self.assertEqual(sorted(histories), [BURRATA, KALE])
+
+        rising = trends.rising_across(histories, k=2)
+        self.assertEqual([(term_id, partner_id) for term_id, partner_id,
+                          growth, mean, seen in rising],
+                         [(KALE, FIG), (BURRATA, TOMATO)])
+
+    def test_no_rows(self):
+        """No rows should give no histories."""
+        self.assertEqual(trends.histories_from_rows([]), {})
+
+
+#####################################################################
+
+if __name__ == '__main__':
+    unittest.main()
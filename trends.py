@@ -0,0 +1,188 @@
+"""How a term's pairings change over its stored searches, with NumPy.
+
+metric_calcs.get_pairing_popularities scores the pairings of one search. A
+PairingHistory holds the same popularity scores for every search of a term,
+as a (searches x partners) array ordered by searches.user_timestamp, so the
+whole history can be analysed at once:
+
+    rolling_mean   trailing average over the last few days, per search
+    growth_rates   least-squares slope of popularity, in points per day
+    rising         partners whose popularity grows fastest
+
+Partners missing from a search count as popularity 0 in it. Histories of
+many terms are loaded with a single query by load_histories.
+"""
+
+import numpy as np
+
+
+class PairingHistory():
+    """Pairing popularities of one food term over its searches, oldest first.
+
+    timestamps holds each search's user_timestamp, days the same as days
+    since the first search, and popularity[i, j] the popularity of
+    partner_ids[j] in search_ids[i].
+    """
+
+    def __init__(self, term_id, search_ids, timestamps, partner_ids,
+                                                          popularity):
+        self.term_id = term_id
+        self.search_ids = search_ids
+        self.timestamps = timestamps
+        self.days = (timestamps - timestamps[0]) / np.timedelta64(1, "D")
+        self.partner_ids = partner_ids
+        self.popularity = popularity
+
+    @property
+    def num_searches(self):
+        return len(self.search_ids)
+
+    def index_of(self, partner_id):
+        """Return the column of partner_id (None if never paired)."""
+        index = int(np.searchsorted(self.partner_ids, partner_id))
+        if (index == len(self.partner_ids) or
+                self.partner_ids[index] != partner_id):
+            return None
+        return index
+
+    def series(self, partner_id):
+        """Return the popularity of one partner in each search."""
+        index = self.index_of(partner_id)
+        if index is None:
+            return np.zeros(self.num_searches)
+        return self.popularity[:, index]
+
+    def rolling_mean(self, days=7):
+        """Average popularity over each search and those of the days before.
+
+        Return an array shaped like popularity.
+        """
+        totals = np.zeros((self.num_searches + 1, len(self.partner_ids)))
+        np.cumsum(self.popularity, axis=0, out=totals[1:])
+
+        # the first search inside the window ending at each search
+        starts = np.searchsorted(self.days, self.days - days, side="left")
+        counts = np.arange(1, self.num_searches + 1) - starts
+
+        return (totals[1:] - totals[starts]) / counts[:, None]
+
+    def _recent(self, days):
+        """Index of the first search in the last `days` (all if None)."""
+        if days is None:
+            return 0
+        return np.searchsorted(self.days, self.days[-1] - days, side="left")
+
+    def growth_rates(self, days=None):
+        """Slope of each partner's popularity, in points per day.
+
+        Fitted by least squares over the searches of the last `days` days
+        (all of them if None). Zero if they were all made at the same time.
+        """
+        first = self._recent(days)
+        offsets = self.days[first:] - self.days[first:].mean()
+        spread = offsets @ offsets
+        if not spread:
+            return np.zeros(len(self.partner_ids))
+
+        # offsets sum to 0, so the mean popularity drops out
+        return offsets @ self.popularity[first:] / spread
+
+    def rising(self, k=10, days=None, min_searches=2):
+        """Return the k partners whose popularity grows fastest.
+
+        Each is (partner_id, growth per day, mean popularity, searches seen),
+        fastest first. Only partners seen in at least min_searches of the
+        searches looked at, and growing, are ranked.
+        """
+        first = self._recent(days)
+        growth = self.growth_rates(days)
+        recent = self.popularity[first:]
+        seen = np.count_nonzero(recent, axis=0)
+
+        candidates = np.flatnonzero((seen >= min_searches) & (growth > 0))
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-growth[candidates],
+                                                    k - 1)[:k]]
+        # fastest first, then lowest id
+        candidates = candidates[np.lexsort((self.partner_ids[candidates],
+                                            -growth[candidates]))]
+
+        means = recent[:, candidates].mean(axis=0)
+        return [(int(self.partner_ids[index]), float(growth[index]),
+                 float(mean), int(seen[index]))
+                for index, mean in zip(candidates, means)]
+
+
+def histories_from_rows(rows):
+    """Build a PairingHistory per term from pairing history rows.
+
+    Takes (food_id, search_id, user_timestamp, num_matches_returned,
+    partner_id, occurences) rows ordered by food_id, then user_timestamp and
+    search_id, as returned by DBConnector.pairing_history. A search without
+    pairings has a single row with partner_id 0. Return a dictionary of
+    term id to PairingHistory.
+    """
+    if not rows:
+        return {}
+
+    (food_ids, search_ids, timestamps, returned, partner_ids,
+            occurences) = (np.array(column) for column in zip(*rows))
+
+    histories = {}
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(food_ids)) + 1,
+                             [len(food_ids)]))
+    for first, stop in zip(bounds[:-1], bounds[1:]):
+        histories[int(food_ids[first])] = _history(int(food_ids[first]),
+                search_ids[first:stop], timestamps[first:stop],
+                returned[first:stop], partner_ids[first:stop],
+                occurences[first:stop])
+
+    return histories
+
+
+def _history(term_id, search_ids, timestamps, returned, partner_ids,
+                                                            occurences):
+    """Build the PairingHistory of one term from its rows."""
+    # rows of a search are together, in time order
+    new_search = np.empty(len(search_ids), dtype=bool)
+    new_search[0] = True
+    np.not_equal(search_ids[1:], search_ids[:-1], out=new_search[1:])
+    search_index = np.cumsum(new_search) - 1
+
+    paired = partner_ids > 0
+    unique_partners, partner_index = np.unique(partner_ids[paired],
+                                               return_inverse=True)
+
+    popularity = np.zeros((int(search_index[-1]) + 1, len(unique_partners)))
+    # as metric_calcs.get_pairing_popularities
+    popularity[search_index[paired], partner_index] = np.trunc(
+            occurences[paired] / np.maximum(returned[paired], 1) * 100)
+
+    # datetimes are slow to convert, so only one per search is
+    return PairingHistory(term_id, search_ids[new_search],
+                          timestamps[new_search].astype("datetime64[us]"),
+                          unique_partners, popularity)
+
+
+def load_histories(db, term_ids, search_window=None):
+    """Load the pairing histories of many terms with one query.
+
+    Only searches over search_window are used, if given. Return a dictionary
+    of term id to PairingHistory; terms never searched for are left out.
+    """
+    return histories_from_rows(db.pairing_history(term_ids, search_window))
+
+
+def rising_across(histories, k=10, days=None, min_searches=2):
+    """Return the k fastest growing pairings over many terms' histories.
+
+    Each is (term_id, partner_id, growth per day, mean popularity, searches
+    seen), fastest first.
+    """
+    ranked = []
+    for term_id, history in histories.items():
+        ranked.extend((term_id,) + partner for partner in
+                      history.rising(k, days, min_searches))
+
+    ranked.sort(key=lambda row: (-row[2], row[0], row[1]))
+    return ranked[:k]